@@ -153,12 +153,14 @@ def get_incorrect_question_cases(
 
     for _, row in df_incorrect.iterrows():
         qid = row["questionId"]
+        domain = row.get("domain")
         test_result_question_id = row[tq_id_col]
         incorrect_questions.append(
             {
                 "questionId": qid if pd.notna(qid) else None,
                 "testResultQuestionId": test_result_question_id,
                 "questionText": row.get("question", None),
+                "domain": domain if pd.notna(domain) else None,
                 "explanation": row.get("explanation", None),
                 "studentAnswers": row["student_answers"],
                 "correctAnswers": correct_lookup.get(qid, []),
@@ -1,28 +1,41 @@
 # agents/agent3_weakness_extraction.py
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any
+import copy
 import json
 import ast
 import re
 import ulid
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from config import client, GENERATION_MODEL
-from pipeline.run_logging import log_token_usage, extract_token_counts
+import numpy as np
 
+from config import (
+    client,
+    GENERATION_MODEL,
+    CACHE_DIR,
+    WEAKNESS_CACHE_TTL_SECONDS,
+    WEAKNESS_CACHE_MAX_ENTRIES,
+    WEAKNESS_CACHE_DISK_ENABLED,
+    AGENT3_DIAGNOSIS_MEMO_ENABLED,
+    AGENT3_MAP_REDUCE_THRESHOLD,
+    AGENT3_MAP_REDUCE_PARTITION,
+    AGENT3_MAP_CHUNK_SIZE,
+    AGENT3_MAP_MAX_CONCURRENCY,
+    AGENT3_REDUCE_MODE,
+    AGENT3_REDUCE_SIMILARITY,
+    AGENT3_CASES_TOKEN_BUDGET,
+)
+from agents.question_diagnosis import aggregate_diagnoses, diagnose_cases, undiagnosed_cases
+from pipeline.cache import TTLCache, stable_hash
+from pipeline.prompt_builder import compact_json, fit_records_to_budget, record_prompt_size
+from pipeline.context_cache import get_context_cache
+from pipeline.priority import with_current_priority
+from pipeline.run_logging import log_token_usage, extract_token_counts, extract_cached_token_count
+from pipeline.streaming_json import JsonArrayStreamParser
 
-def extract_weaknesses_and_patterns(
-    incorrect_cases: List[Dict[str, Any]],
-    model_name: str = GENERATION_MODEL,
-) -> List[Dict[str, Any]]:
-    """
-    Use Gemini to turn incorrect question cases into concrete weaknesses & patterns.
-    """
-    if not incorrect_cases:
-        return []
-
-    cases_json = json.dumps(incorrect_cases, ensure_ascii=False, indent=2)
-
-    prompt = f"""
+# Static instruction prefix, sent first and served from the context cache once large enough to cache; only the cases vary per call.
+EXTRACTION_PROMPT_PREFIX = """
         You are a diagnostic engine for assessment tests across many domains
         (e.g., language exams, aptitude tests, professional certifications,
         and Thai civil service exams such as ข้อสอบ กพ).
@@ -37,22 +50,345 @@ def extract_weaknesses_and_patterns(
         Output format (JSON ONLY, no extra text):
 
         [
-        {{
+        {
             "weakness": "short name (1 sentence max, specific to the pattern)",
             "pattern_type": "language | numeracy | logical_reasoning | reading_comprehension | domain_knowledge | test_strategy | other",
             "description": "2–4 sentences explaining the pattern and why errors happen.",
             "evidence_question_ids": [<questionId>, ...],
             "frequency": <number of questions that show this pattern>."
-        }}
+        }
         ]
+"""
 
+# Content-addressed cache: identical incorrect-case payloads (retries, repeat views, identical
+# wrong-answer sets across students) reuse the previous extraction.
+_weakness_cache = TTLCache(
+    name="agent3_weaknesses",
+    maxsize=WEAKNESS_CACHE_MAX_ENTRIES,
+    ttl_seconds=WEAKNESS_CACHE_TTL_SECONDS,
+    disk_dir=CACHE_DIR / "agent3_weaknesses" if WEAKNESS_CACHE_DISK_ENABLED else None,
+)
+
+
+def extract_weaknesses_and_patterns(
+    incorrect_cases: List[Dict[str, Any]],
+    model_name: str = GENERATION_MODEL,
+    use_diagnosis_memo: bool = AGENT3_DIAGNOSIS_MEMO_ENABLED,
+    map_reduce_threshold: int = AGENT3_MAP_REDUCE_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    Use Gemini to turn incorrect question cases into concrete weaknesses & patterns.
+    With `use_diagnosis_memo`, per-question diagnoses are reused from the memo store and only
+    never-seen (questionId, wrong-answer set) cases are sent to Gemini.
+    With at least `map_reduce_threshold` cases (0 disables), extraction runs per partition
+    concurrently and the partial lists are merged.
+    """
+    if not incorrect_cases:
+        return []
+
+    mode = _extraction_mode(incorrect_cases, use_diagnosis_memo, map_reduce_threshold)
+    cache_key = stable_hash(_canonical_cases(incorrect_cases), model_name, mode)
+    cached = _cached_weaknesses(cache_key)
+    if cached is not None:
+        return cached
+
+    if use_diagnosis_memo:
+        diagnoses = diagnose_cases(incorrect_cases, model_name=model_name)
+        missing = undiagnosed_cases(incorrect_cases, diagnoses)
+        # A partial list must not be cached under the key of the full case set.
+        if missing:
+            print(
+                f"[WARN] {len(missing)} of {len(incorrect_cases)} cases have no diagnosis; "
+                "falling back to full extraction."
+            )
+        else:
+            weaknesses = aggregate_diagnoses(incorrect_cases, diagnoses)
+            if weaknesses:
+                _weakness_cache.set(cache_key, copy.deepcopy(weaknesses))
+                return _assign_ids(weaknesses)
+            print("[WARN] Diagnosis memo produced no weaknesses; falling back to full extraction.")
+
+    complete = True
+    if map_reduce_threshold and len(incorrect_cases) >= map_reduce_threshold:
+        weaknesses, complete = _map_reduce_extract(incorrect_cases, model_name)
+    else:
+        weaknesses = _extract_with_llm(incorrect_cases, model_name)
+    if weaknesses and complete:
+        _weakness_cache.set(cache_key, copy.deepcopy(weaknesses))
+
+    return _assign_ids(weaknesses)
+
+def stream_weaknesses_and_patterns(
+    incorrect_cases: List[Dict[str, Any]],
+    on_weakness: Callable[[Dict[str, Any]], None],
+    model_name: str = GENERATION_MODEL,
+    use_diagnosis_memo: bool = AGENT3_DIAGNOSIS_MEMO_ENABLED,
+    map_reduce_threshold: int = AGENT3_MAP_REDUCE_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    Streaming variant of `extract_weaknesses_and_patterns`: the response is streamed and each
+    weakness (with its id) is passed to `on_weakness` as soon as its JSON object closes, so
+    callers can start retrieval while Gemini is still generating the rest of the array.
+    Cache hits, the diagnosis memo and map-reduce extraction have no partial output to
+    stream; their weaknesses are emitted together once available. Returns all weaknesses.
+    """
+    if not incorrect_cases:
+        return []
+
+    mode = _extraction_mode(incorrect_cases, use_diagnosis_memo, map_reduce_threshold)
+    streamable = mode == "single"
+    cache_key = stable_hash(_canonical_cases(incorrect_cases), model_name, mode)
+    weaknesses = _cached_weaknesses(cache_key)
+    if weaknesses is None and not streamable:
+        weaknesses = extract_weaknesses_and_patterns(
+            incorrect_cases,
+            model_name=model_name,
+            use_diagnosis_memo=use_diagnosis_memo,
+            map_reduce_threshold=map_reduce_threshold,
+        )
+    if weaknesses is not None:
+        for weakness in weaknesses:
+            on_weakness(weakness)
+        return weaknesses
+
+    weaknesses = _stream_extract_with_llm(incorrect_cases, model_name, on_weakness)
+    if weaknesses:
+        _weakness_cache.set(cache_key, [{k: v for k, v in w.items() if k != "id"} for w in weaknesses])
+    return weaknesses
+
+def _extraction_mode(
+    incorrect_cases: List[Dict[str, Any]],
+    use_diagnosis_memo: bool,
+    map_reduce_threshold: int,
+) -> str:
+    """Which extraction path handles these cases: memo, map_reduce or single (one call)."""
+    if use_diagnosis_memo:
+        return "memo"
+    if map_reduce_threshold and len(incorrect_cases) >= map_reduce_threshold:
+        return "map_reduce"
+    return "single"
+
+def _cached_weaknesses(cache_key: str) -> List[Dict[str, Any]] | None:
+    start = time.time()
+    cached = _weakness_cache.get(cache_key)
+    if cached is None:
+        return None
+    log_token_usage(
+        usage="agent3: weakness extraction (cache hit)",
+        input_tokens=0,
+        output_tokens=0,
+        runtime_seconds=time.time() - start,
+    )
+    return _assign_ids(copy.deepcopy(cached))
+
+def _extraction_suffix(incorrect_cases: List[Dict[str, Any]]) -> tuple[str, Dict[str, int]]:
+    """Per-request part of the extraction prompt (the cases) plus its prompt-size record."""
+    # Per-attempt ids add nothing for the model; evidence is reported by questionId.
+    cases_payload = fit_records_to_budget(
+        [{k: v for k, v in case.items() if k != "testResultQuestionId"} for case in incorrect_cases],
+        truncatable_fields=("explanation", "questionText"),
+        budget_tokens=AGENT3_CASES_TOKEN_BUDGET,
+    )
+    cases_json = compact_json(cases_payload)
+    prompt_size = record_prompt_size(
+        "agent3",
+        json.dumps(incorrect_cases, ensure_ascii=False, indent=2, default=str),
+        cases_json,
+    )
+
+    prompt_suffix = f"""
         Here is the JSON array of incorrect questions:
 
         {cases_json}
 
         Respond with ONLY the JSON array as described above.
         """
-    
+    return prompt_suffix, prompt_size
+
+def _stream_extract_with_llm(
+    incorrect_cases: List[Dict[str, Any]],
+    model_name: str,
+    on_weakness: Callable[[Dict[str, Any]], None],
+    usage: str = "agent3: weakness extraction (streamed)",
+) -> List[Dict[str, Any]]:
+    """Stream the extraction prompt, emitting each weakness as soon as it is parsed."""
+    prompt_suffix, prompt_size = _extraction_suffix(incorrect_cases)
+    parser = JsonArrayStreamParser()
+    weaknesses: List[Dict[str, Any]] = []
+    usage_chunk = None
+    first_weakness_seconds = None
+    start = time.time()
+    try:
+        for chunk in get_context_cache().generate_content_stream(
+            model=model_name,
+            prefix=EXTRACTION_PROMPT_PREFIX,
+            suffix=prompt_suffix,
+            label="agent3-extraction",
+        ):
+            if getattr(chunk, "usage_metadata", None) is not None:
+                usage_chunk = chunk
+            for item in parser.feed(getattr(chunk, "text", None) or ""):
+                if not isinstance(item, dict):
+                    continue
+                weakness = _assign_ids([item])[0]
+                weaknesses.append(weakness)
+                if first_weakness_seconds is None:
+                    first_weakness_seconds = round(time.time() - start, 4)
+                on_weakness(weakness)
+    finally:
+        elapsed = time.time() - start
+        input_tokens, output_tokens = extract_token_counts(usage_chunk) if usage_chunk else (None, None)
+        log_token_usage(
+            usage=usage,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            runtime_seconds=elapsed,
+            details={
+                **prompt_size,
+                "cached_tokens": extract_cached_token_count(usage_chunk) if usage_chunk else None,
+                "streamed_weaknesses": len(weaknesses),
+                "first_weakness_seconds": first_weakness_seconds,
+            },
+        )
+
+    if not weaknesses:
+        # Not a well-formed JSON array: fall back to the tolerant whole-text parser.
+        weaknesses = _assign_ids(convert_llm_weaknesses_for_agent3(remove_code_fences(parser.text)))
+        for weakness in weaknesses:
+            on_weakness(weakness)
+    return weaknesses
+
+def _extract_with_llm(
+    incorrect_cases: List[Dict[str, Any]],
+    model_name: str,
+    usage: str = "agent3: weakness extraction",
+) -> List[Dict[str, Any]]:
+    """Single extraction prompt over a list of cases; returns weakness dicts without ids."""
+    prompt_suffix, prompt_size = _extraction_suffix(incorrect_cases)
+
+    response = None
+    start = time.time()
+    try:
+        response = get_context_cache().generate_content(
+            model=model_name,
+            prefix=EXTRACTION_PROMPT_PREFIX,
+            suffix=prompt_suffix,
+            label="agent3-extraction",
+        )
+    finally:
+        elapsed = time.time() - start
+        input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
+        log_token_usage(
+            usage=usage,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            runtime_seconds=elapsed,
+            details={**prompt_size, "cached_tokens": extract_cached_token_count(response) if response else None},
+        )
+    return convert_llm_weaknesses_for_agent3(remove_code_fences(response.text))
+
+def _map_reduce_extract(
+    incorrect_cases: List[Dict[str, Any]],
+    model_name: str,
+) -> tuple[List[Dict[str, Any]], bool]:
+    """
+    Map: extract weaknesses per partition concurrently (a failed partition only loses its own cases).
+    Reduce: merge near-duplicate weaknesses across partitions.
+    Returns (weaknesses, complete); `complete` is False when any partition failed.
+    """
+    partitions = _partition_cases(incorrect_cases, AGENT3_MAP_REDUCE_PARTITION, AGENT3_MAP_CHUNK_SIZE)
+    print(f"[Agent3] Map-reduce over {len(incorrect_cases)} cases in {len(partitions)} partitions.")
+
+    partials: List[Dict[str, Any]] = []
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(AGENT3_MAP_MAX_CONCURRENCY, len(partitions)))) as pool:
+        futures = [
+            pool.submit(
+                with_current_priority(_extract_with_llm),
+                part,
+                model_name,
+                f"agent3: weakness extraction (map {i}/{len(partitions)}: {label})",
+            )
+            for i, (label, part) in enumerate(partitions, start=1)
+        ]
+        for future in futures:
+            try:
+                partials.extend(w for w in future.result() if isinstance(w, dict) and w.get("weakness"))
+            except Exception as exc:
+                failures += 1
+                print(f"[WARN] Agent 3 map partition failed: {exc}")
+    if failures == len(partitions):
+        raise RuntimeError("All agent 3 map partitions failed.")
+
+    if AGENT3_REDUCE_MODE == "llm":
+        return _reduce_with_llm(partials, model_name), failures == 0
+    return _reduce_by_embedding(partials), failures == 0
+
+
+def _partition_cases(
+    incorrect_cases: List[Dict[str, Any]],
+    partition_by: str,
+    chunk_size: int,
+) -> List[tuple[str, List[Dict[str, Any]]]]:
+    """Group cases by domain (or not at all), then split each group into chunks of `chunk_size`."""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for case in incorrect_cases:
+        label = "all"
+        if partition_by == "domain":
+            label = str(case.get("domain") or "Unknown")
+        groups.setdefault(label, []).append(case)
+
+    partitions: List[tuple[str, List[Dict[str, Any]]]] = []
+    for label, cases in groups.items():
+        for start in range(0, len(cases), chunk_size):
+            partitions.append((label, cases[start:start + chunk_size]))
+    return partitions
+
+
+def _reduce_by_embedding(partials: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Greedy merge: a weakness joins the first kept weakness whose embedding is similar enough."""
+    if len(partials) < 2:
+        return partials
+    from agents.agent4_course_recommendation import embed_texts
+
+    ordered = sorted(partials, key=lambda w: _to_int(w.get("frequency")), reverse=True)
+    try:
+        vectors = np.asarray(
+            embed_texts([f"{w.get('weakness')}: {w.get('description') or ''}" for w in ordered]),
+            dtype=np.float32,
+        )
+    except Exception as exc:
+        print(f"[WARN] Embedding merge failed ({exc}); merging identical names only.")
+        return _merge_clusters(ordered, [[i] for i in range(len(ordered))], exact_names=True)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+    similarity = vectors @ vectors.T
+
+    clusters: List[List[int]] = []
+    for i in range(len(ordered)):
+        for cluster in clusters:
+            if similarity[cluster[0], i] >= AGENT3_REDUCE_SIMILARITY:
+                cluster.append(i)
+                break
+        else:
+            clusters.append([i])
+    return _merge_clusters(ordered, clusters)
+
+
+def _reduce_with_llm(partials: List[Dict[str, Any]], model_name: str) -> List[Dict[str, Any]]:
+    """Ask the model to merge duplicates in the partial lists; falls back to the embedding merge."""
+    if len(partials) < 2:
+        return partials
+    prompt = f"""
+        Merge this list of weaknesses extracted from different parts of one student's test.
+        Combine entries that describe the same underlying weakness: union their
+        evidence_question_ids and set frequency to the number of merged evidence ids.
+        Keep distinct weaknesses separate. Do not invent new evidence.
+
+        Output the merged list as a JSON array with the same fields, JSON ONLY:
+
+        {compact_json(partials)}
+        """
     response = None
     start = time.time()
     try:
@@ -60,18 +396,71 @@ def extract_weaknesses_and_patterns(
             model=model_name,
             contents=[{"parts": [{"text": prompt}]}],
         )
+        merged = json.loads(remove_code_fences(response.text or ""))
+        if isinstance(merged, list) and merged:
+            return merged
+    except Exception as exc:
+        print(f"[WARN] LLM reduce failed: {exc}")
     finally:
         elapsed = time.time() - start
         input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
         log_token_usage(
-            usage="agent3: weakness extraction",
+            usage="agent3: weakness extraction (reduce)",
             input_tokens=input_tokens,
             output_tokens=output_tokens,
             runtime_seconds=elapsed,
         )
-    weaknesses = convert_llm_weaknesses_for_agent3(remove_code_fences(response.text))
+    return _reduce_by_embedding(partials)
+
+
+def _merge_clusters(
+    ordered: List[Dict[str, Any]],
+    clusters: List[List[int]],
+    exact_names: bool = False,
+) -> List[Dict[str, Any]]:
+    if exact_names:
+        by_name: Dict[str, List[int]] = {}
+        for i, w in enumerate(ordered):
+            by_name.setdefault(" ".join(str(w.get("weakness", "")).lower().split()), []).append(i)
+        clusters = list(by_name.values())
+
+    merged: List[Dict[str, Any]] = []
+    for cluster in clusters:
+        head = dict(ordered[cluster[0]])
+        evidence: List[Any] = []
+        for i in cluster:
+            for qid in ordered[i].get("evidence_question_ids") or []:
+                if qid not in evidence:
+                    evidence.append(qid)
+        head["evidence_question_ids"] = evidence
+        head["frequency"] = len(evidence) or sum(_to_int(ordered[i].get("frequency")) for i in cluster)
+        merged.append(head)
+    merged.sort(key=lambda w: _to_int(w.get("frequency")), reverse=True)
+    return merged
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def _canonical_cases(incorrect_cases: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Attempt-independent view of the cases for cache keys: drops per-attempt ids and sorts
+    cases and answer lists so the same wrong-answer set hashes identically for any student.
+    """
+    canonical = []
+    for case in incorrect_cases:
+        item = {k: v for k, v in case.items() if k != "testResultQuestionId"}
+        for field in ("studentAnswers", "correctAnswers"):
+            if isinstance(item.get(field), list):
+                item[field] = sorted(item[field], key=str)
+        canonical.append(item)
+    return sorted(canonical, key=lambda c: str(c.get("questionId")))
 
-    # Add ULID as id
+def _assign_ids(weaknesses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Add a fresh ULID as id (per run, also for cached results)."""
     for d in weaknesses:
         d["id"] = str(ulid.new())
     return weaknesses
@@ -2,12 +2,16 @@
 
 from __future__ import annotations
 
-import csv
 import uuid
 import json
 import time
-from typing import Any, Dict, List
+import heapq
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import replace
+from typing import Any, Dict, Hashable, List
 
+import numpy as np
 from google.cloud import aiplatform
 from google.cloud.aiplatform import MatchingEngineIndexEndpoint
 import vertexai
@@ -15,7 +19,6 @@ from google import genai
 from google.genai.types import EmbedContentConfig
 
 from config import (
-    COURSE_CSV_PATH,
     DEFAULT_LOCATION,
     DEFAULT_PROJECT_ID,
     DEPLOYED_INDEX_ID,
@@ -23,19 +26,87 @@ from config import (
     ENDPOINT_DISPLAY_NAME,
     EMBEDDING_MODEL_NAME,
     EMBEDDING_DIMENSION,
+    EMBED_BATCH_WINDOW_MS,
+    EMBED_BATCH_MAX_SIZE,
+    VECTOR_SEARCH_BATCH_WINDOW_MS,
+    VECTOR_SEARCH_BATCH_MAX_QUERIES,
+    MICRO_BATCH_AGING_SECONDS,
+    MIN_COURSES_PER_WEAKNESS,
+    MAX_COURSES_PER_WEAKNESS,
+    COURSE_SELECTION_DIVERSITY,
+    MMR_LAMBDA,
+    COURSE_RETRIEVAL_MODE,
+    VECTOR_SEARCH_TIMEOUT_SECONDS,
+    RRF_K,
+    BM25_SCORE_PIVOT,
+    RERANK_MODE,
+    RERANK_MAX_CONCURRENCY,
+    RERANK_DEADLINE_SECONDS,
+    RERANK_AUTO_MARGIN,
+    RERANK_AUTO_THRESHOLD_BAND,
+    RERANK_TITLE_MAX_TOKENS,
+    MIN_RECOMMENDATION_SCORE,
+    CACHE_DIR,
+    RERANK_CACHE_TTL_SECONDS,
+    RERANK_CACHE_MAX_ENTRIES,
+    RERANK_CACHE_DISK_ENABLED,
     GENERATION_MODEL,
-    client as llm_client,
     Course,
     Weakness,
     CourseScore,
 )
+from agents.course_catalog import CourseCatalog, get_course_catalog
+from pipeline.cache import TTLCache, normalize_text, stable_hash
+from pipeline.micro_batching import MicroBatcher
+from pipeline.priority import with_current_priority
+from pipeline.prompt_builder import record_prompt_size, truncate_text
+from pipeline.context_cache import get_context_cache
+from pipeline.model_governor import govern_client
+from pipeline.run_logging import log_token_usage, extract_token_counts, extract_cached_token_count
 
 # Initialize Vertex AI and GenAI client
 vertexai.init(project=DEFAULT_PROJECT_ID, location=DEFAULT_LOCATION)
 aiplatform.init(project=DEFAULT_PROJECT_ID, location=DEFAULT_LOCATION)
-genai_client = genai.Client()
+genai_client = govern_client(genai.Client())
+
+# Static rerank instructions, sent first and served from the context cache once large enough to cache; only the candidates vary per call.
+RERANK_SINGLE_PROMPT_PREFIX = """
+        You are scoring courses for a single weakness.
+        Keep all candidate courses listed below the weakness and score each one's relevance 0-1.
+
+        Output JSON ONLY:
+        [
+          {"course_id": "<id>", "relevance_score": <0-1>, "justification": "<very short>"},
+          ...
+        ]
+"""
+RERANK_BATCHED_PROMPT_PREFIX = """
+        You are scoring candidate courses for several weaknesses.
+        Score each candidate ONLY against the weakness it is listed under.
+
+        Output JSON ONLY, one object per (weakness, course) pair:
+        [
+          {"weakness": "<w1|w2|...>", "course_id": "<id>", "relevance_score": <0-1>, "justification": "<very short>"},
+          ...
+        ]
+"""
+
+_rerank_cache = TTLCache(
+    name="rerank",
+    maxsize=RERANK_CACHE_MAX_ENTRIES,
+    ttl_seconds=RERANK_CACHE_TTL_SECONDS,
+    disk_dir=CACHE_DIR / "rerank" if RERANK_CACHE_DISK_ENABLED else None,
+)
 
 def embed_texts(texts: List[str], dim: int = EMBEDDING_DIMENSION) -> List[List[float]]:
+    """
+    Embed texts through the process-wide micro-batcher so concurrent requests share
+    `embed_content` calls instead of paying request overhead for a handful of strings each.
+    """
+    return _embedding_batcher.submit(texts, key=dim)
+
+
+def _embed_texts_direct(dim: Hashable, texts: List[str]) -> List[List[float]]:
     """Embed texts in batches to respect 100-request limit."""
     batch_size = 100
     all_vectors: List[List[float]] = []
@@ -52,19 +123,19 @@ def embed_texts(texts: List[str], dim: int = EMBEDDING_DIMENSION) -> List[List[f
         all_vectors.extend([e.values for e in resp.embeddings])
     return all_vectors
 
-def _load_course_lookup() -> Dict[str, Dict[str, Any]]:
-    if not COURSE_CSV_PATH.exists():
-        raise FileNotFoundError(f"Course CSV not found at {COURSE_CSV_PATH}")
 
-    course_lookup: Dict[str, Dict[str, Any]] = {}
-    with COURSE_CSV_PATH.open("r", encoding="utf-8") as handle:
-        reader = csv.DictReader(handle)
-        for row in reader:
-            course_id = row.get("id")
-            if not course_id:
-                continue
-            course_lookup[course_id] = row
-    return course_lookup
+_embedding_batcher = MicroBatcher(
+    name="embeddings",
+    batch_fn=_embed_texts_direct,
+    window_ms=EMBED_BATCH_WINDOW_MS,
+    max_batch_size=EMBED_BATCH_MAX_SIZE,
+    aging_seconds=MICRO_BATCH_AGING_SECONDS,
+)
+
+
+def get_embedding_batcher_stats() -> Dict[str, Any]:
+    """Batch fill and queueing-delay metrics for the shared embedding batcher."""
+    return _embedding_batcher.get_stats()
 
 def _parse_weaknesses(weaknesses_raw: List[Dict[str, Any]]) -> List[Weakness]:
     weaknesses: List[Weakness] = []
@@ -76,132 +147,520 @@ def _parse_weaknesses(weaknesses_raw: List[Dict[str, Any]]) -> List[Weakness]:
         weaknesses.append(Weakness(id=w_id, text=text, importance=importance, metadata=meta))
     return weaknesses
 
-def _query_vertex_index(query_text: str, limit: int) -> List[Any]:
-    endpoints = aiplatform.MatchingEngineIndexEndpoint.list()
-    endpoint_name = ""
-    for ep in endpoints:
-        if ep.display_name == ENDPOINT_DISPLAY_NAME:
-            endpoint_name = ep.resource_name
+_endpoint_lock = threading.Lock()
+_endpoint: MatchingEngineIndexEndpoint | None = None
+
+
+def _get_index_endpoint() -> MatchingEngineIndexEndpoint:
+    """Resolve the deployed endpoint once per process instead of listing endpoints per query."""
+    global _endpoint
+    with _endpoint_lock:
+        if _endpoint is not None:
+            return _endpoint
+        endpoints = aiplatform.MatchingEngineIndexEndpoint.list()
+        endpoint_name = ""
+        for ep in endpoints:
+            if ep.display_name == ENDPOINT_DISPLAY_NAME:
+                endpoint_name = ep.resource_name
+
+        if not endpoint_name:
+            raise ValueError(f"Matching Engine endpoint with display name '{ENDPOINT_DISPLAY_NAME}' not found.")
+        _endpoint = MatchingEngineIndexEndpoint(index_endpoint_name=endpoint_name)
+        return _endpoint
+
+
+def _find_neighbors_direct(key: Hashable, queries: List[tuple[List[float], int]]) -> List[List[Any]]:
+    """
+    One multi-query find_neighbors call for a coalesced batch; each query is (vector, limit)
+    and the batch key is `return_full_datapoint`.
+    Requests the largest limit once and trims per query when demultiplexing.
+    """
+    endpoint = _get_index_endpoint()
+    num_neighbors = max(limit for _, limit in queries)
+    neighbors = endpoint.find_neighbors(
+        deployed_index_id=DEPLOYED_INDEX_ID,
+        queries=[vector for vector, _ in queries],
+        num_neighbors=num_neighbors,
+        return_full_datapoint=bool(key),
+    )
+    neighbors = list(neighbors or [])
+    results: List[List[Any]] = []
+    for i, (_, limit) in enumerate(queries):
+        results.append(list(neighbors[i])[:limit] if i < len(neighbors) else [])
+    return results
+
+
+_vector_search_batcher = MicroBatcher(
+    name="vector_search",
+    batch_fn=_find_neighbors_direct,
+    window_ms=VECTOR_SEARCH_BATCH_WINDOW_MS,
+    max_batch_size=VECTOR_SEARCH_BATCH_MAX_QUERIES,
+    aging_seconds=MICRO_BATCH_AGING_SECONDS,
+)
+
+
+def get_vector_search_batcher_stats() -> Dict[str, Any]:
+    """Batch fill and queueing-delay metrics for the shared vector-search batcher."""
+    return _vector_search_batcher.get_stats()
+
+
+def _query_vertex_index_batch(
+    query_texts: List[str],
+    limit: int,
+    return_full_datapoint: bool = False,
+) -> List[List[Any]]:
+    """Embed all query texts in one call and send every vector through the vector-search batcher."""
+    if not query_texts:
+        return []
+    query_vectors = embed_texts(query_texts)
+    return _vector_search_batcher.submit(
+        [(vector, limit) for vector in query_vectors],
+        key=return_full_datapoint,
+    )
+
+
+# Runs hybrid-mode vector queries so callers can stop waiting after VECTOR_SEARCH_TIMEOUT_SECONDS.
+_vector_query_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="vector-query")
+# Separate pool: prefetch tasks block on _vector_query_executor futures.
+_prefetch_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="candidate-prefetch")
+# Per-weakness rerank calls; each request caps its own share with RERANK_MAX_CONCURRENCY.
+_rerank_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="rerank")
 
-    if not endpoint_name:
-        raise ValueError(f"Matching Engine endpoint with display name '{ENDPOINT_DISPLAY_NAME}' not found.")    
-    else:
-        endpoint = MatchingEngineIndexEndpoint(index_endpoint_name=endpoint_name)
-        query_vector = embed_texts([query_text])[0]
-        neighbors = endpoint.find_neighbors(
-            deployed_index_id=DEPLOYED_INDEX_ID,
-            queries=[query_vector],
-            num_neighbors=limit,
-            return_full_datapoint=False,
-        )
-    return neighbors[0] if neighbors else []
 
 def recommend_courses_for_student(
     weaknesses_raw: List[Dict[str, Any]],
     max_courses_pr_weakness: int = 5,
-    rerank_enabled: bool = False,
+    rerank_enabled: bool | str = False,
+    min_score: float = MIN_RECOMMENDATION_SCORE,
+    max_total_courses: int | None = None,
+    diversity: str = COURSE_SELECTION_DIVERSITY,
+    retrieval_mode: str = COURSE_RETRIEVAL_MODE,
+    prefetched: Dict[str, Future] | None = None,
 ) -> Dict[str, Any]:
     """
     Fast online path:
     - assumes Vertex Matching Engine index is already deployed
-    - embeds each weakness and queries deployed endpoint for nearest courses
+    - embeds all weaknesses together and queries deployed endpoint for nearest courses
+      (queries from concurrent requests are coalesced into multi-query find_neighbors calls)
+    - `retrieval_mode="hybrid"` fuses vector hits with the in-process BM25 index (RRF);
+      `"lexical"` skips the vector backend entirely, and hybrid degrades to lexical when the
+      vector backend errors or exceeds VECTOR_SEARCH_TIMEOUT_SECONDS
+    - `rerank_enabled="auto"` only sends weaknesses with ambiguous vector scores to the LLM
+    - selects at most `max_total_courses` (defaults to `max_courses_pr_weakness`) unique courses,
+      optionally diversified with MMR (`diversity="mmr"`)
+    - `prefetched` maps weakness id -> future from `prefetch_candidates` (streamed agent 3 output);
+      those weaknesses skip retrieval here, the rest are retrieved as one batch
     """
 
     weaknesses = _parse_weaknesses(weaknesses_raw)
-    course_lookup = _load_course_lookup()
+    use_mmr = diversity == "mmr"
 
     all_recommendations: List[CourseScore] = []
+    course_vectors: Dict[str, List[float]] = {}
+    remaining = weaknesses
+    if prefetched:
+        remaining = []
+        for w in weaknesses:
+            future = prefetched.get(w.id)
+            try:
+                recs, vectors = future.result() if future is not None else (None, None)
+            except Exception as exc:
+                print(f"[WARN] Prefetched retrieval failed for weakness {w.id}: {exc}")
+                recs, vectors = None, None
+            if recs is None:
+                remaining.append(w)
+                continue
+            all_recommendations.extend(recs)
+            course_vectors.update(vectors)
+        print(f"Using prefetched candidates for {len(weaknesses) - len(remaining)} weaknesses.")
+
+    if remaining:
+        print(f"Querying courses for {len(remaining)} weaknesses (mode={retrieval_mode})...")
+        recs, vectors = _retrieve_candidates(
+            remaining,
+            limit=max_courses_pr_weakness,
+            mode=retrieval_mode,
+            return_full_datapoint=use_mmr,
+        )
+        all_recommendations.extend(recs)
+        course_vectors.update(vectors)
+
+    selected_recommendations = _select_final_courses(
+        all_recommendations,
+        max_total=max_total_courses or max_courses_pr_weakness,
+        diversity=diversity,
+        course_vectors=course_vectors,
+    )
+
+    # Optional LLM re-ranking/validation layer
+    if rerank_enabled == "auto":
+        selected_recommendations = _auto_rerank_courses(
+            weaknesses, all_recommendations, selected_recommendations, min_score
+        )
+    elif rerank_enabled:
+        reranked = _llm_rerank_courses(weaknesses, selected_recommendations)
+        if reranked:
+            selected_recommendations = reranked
+    selected_recommendations = _with_full_descriptions(selected_recommendations)
 
-    for w in weaknesses:
-        print(f"Querying courses for weakness: {w.id} - {w.text[:60]}...")
-        neighbors = _query_vertex_index(w.text, max_courses_pr_weakness)
+    response = {
+        "weaknesses": weaknesses,
+        "recommendations": selected_recommendations,
+    }
+    print("Course recommendation process completed.")
+    return response
+
+
+def prefetch_candidates(
+    weakness_raw: Dict[str, Any],
+    max_courses_pr_weakness: int = 5,
+    diversity: str = COURSE_SELECTION_DIVERSITY,
+    retrieval_mode: str = COURSE_RETRIEVAL_MODE,
+) -> tuple[str, Future]:
+    """
+    Start candidate retrieval (embedding + vector/BM25 search) for one weakness in the
+    background, e.g. while agent 3 is still streaming the others. Returns (weakness id, future)
+    for `recommend_courses_for_student(prefetched=...)`; the weakness must already carry its id.
+    """
+    weakness = _parse_weaknesses([weakness_raw])[0]
+    future = _prefetch_executor.submit(
+        with_current_priority(_retrieve_candidates),
+        [weakness],
+        max_courses_pr_weakness,
+        retrieval_mode,
+        diversity == "mmr",
+    )
+    return weakness.id, future
+
+
+def _retrieve_candidates(
+    weaknesses: List[Weakness],
+    limit: int,
+    mode: str = COURSE_RETRIEVAL_MODE,
+    return_full_datapoint: bool = False,
+) -> tuple[List[CourseScore], Dict[str, List[float]]]:
+    """
+    Retrieve up to `limit` candidate courses per weakness.
+    Returns the flat candidate list plus any course embeddings returned by the index.
+    """
+    catalog = get_course_catalog()
+    texts = [w.text for w in weaknesses]
+    course_vectors: Dict[str, List[float]] = {}
+
+    vector_hits: List[List[Any]] = [[] for _ in weaknesses]
+    if mode == "vector":
+        # No fallback to switch to, so wait for the index however long it takes.
+        vector_hits = _query_vertex_index_batch(texts, limit, return_full_datapoint)
+    elif mode == "hybrid":
+        try:
+            vector_hits = _vector_query_executor.submit(
+                with_current_priority(_query_vertex_index_batch), texts, limit, return_full_datapoint
+            ).result(timeout=VECTOR_SEARCH_TIMEOUT_SECONDS)
+        except Exception as exc:
+            print(f"[WARN] Vector search unavailable ({exc!r}); using lexical retrieval only.")
+            mode = "lexical"
 
+    all_recommendations: List[CourseScore] = []
+    for w, neighbors in zip(weaknesses, vector_hits):
+        vector_scores: Dict[str, float] = {}
         for neighbor in neighbors:
             course_id = str(neighbor.id)
-            metadata = course_lookup.get(course_id, {})
-            lesson_title = metadata.get("lesson_title") or "Untitled course"
-            desc = metadata.get("description") or ""
-            link = metadata.get("link") or metadata.get("course_url") or ""
-            course = Course(
-                id=course_id,
-                lesson_title=lesson_title,
-                description=desc,
-                link=link,
-                metadata=metadata,
-            )
+            if return_full_datapoint and getattr(neighbor, "feature_vector", None):
+                course_vectors[course_id] = list(neighbor.feature_vector)
             distance = float(getattr(neighbor, "distance", 0.0) or 0.0)
-            score = 1 / (1 + distance)
-            reason = f"Retrieved by semantic match to weakness '{w.text[:80]}...'."
-
+            vector_scores[course_id] = 1 / (1 + distance)
+
+        lexical_scores: Dict[str, float] = {}
+        if mode != "vector":
+            lexical_scores = {
+                course_id: bm25 / (bm25 + BM25_SCORE_PIVOT)
+                for course_id, bm25 in catalog.lexical_index.search(w.text, limit)
+            }
+
+        # Each mode scores on one scale: vector and lexical keep their own [0, 1] scores, while
+        # hybrid uses the fused RRF score scaled so rank 1 in both sources is 1.0.
+        if mode == "vector":
+            scores = vector_scores
+        elif mode == "lexical":
+            scores = lexical_scores
+        else:
+            rankings = [list(vector_scores), list(lexical_scores)]
+            best_possible = len(rankings) / (RRF_K + 1)
+            scores = {
+                course_id: fused / best_possible
+                for course_id, fused in _reciprocal_rank_fusion(rankings)[:limit]
+            }
+
+        for course_id, score in scores.items():
+            in_vector = course_id in vector_scores
+            in_lexical = course_id in lexical_scores
+            if in_vector and in_lexical:
+                reason = f"Retrieved by semantic and keyword match to weakness '{w.text[:80]}...'."
+            elif in_lexical:
+                reason = f"Retrieved by keyword match to weakness '{w.text[:80]}...'."
+            else:
+                reason = f"Retrieved by semantic match to weakness '{w.text[:80]}...'."
             all_recommendations.append(
                 CourseScore(
-                    course=course,
+                    course=_course_from_catalog(catalog, course_id),
                     weakness_id=w.id,
                     score=score,
                     reason=reason,
                 )
             )
+    return all_recommendations, course_vectors
 
-    selected_recommendations = _select_final_courses(
-        all_recommendations, max_total=5
+
+def _reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[tuple[str, float]]:
+    """Merge ranked id lists: score(id) = sum(1 / (k + rank)), best first."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, course_id in enumerate(ranking, start=1):
+            fused[course_id] = fused.get(course_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def _course_from_catalog(catalog: CourseCatalog, course_id: str) -> Course:
+    """
+    Build a lightweight Course from the resident catalog. `description` is the short
+    description; `_with_full_descriptions` fills in the full text for the final selection.
+    """
+    record = catalog.get(course_id)
+    if record is None:
+        return Course(id=course_id, lesson_title="Untitled course", description="", link="", metadata={})
+    return Course(
+        id=course_id,
+        lesson_title=record.lesson_title,
+        description=record.short_description,
+        link=record.link,
+        metadata=record.to_metadata(),
     )
 
-    # Optional LLM re-ranking/validation layer
-    if rerank_enabled:
-        reranked = _llm_rerank_courses(weaknesses, selected_recommendations)
-        if reranked:
-            selected_recommendations = reranked
 
-    response = {
-        "weaknesses": weaknesses,
-        "recommendations": selected_recommendations,
-    }
-    print("Course recommendation process completed.")
-    return response
+def _with_full_descriptions(recommendations: List[CourseScore]) -> List[CourseScore]:
+    """
+    Swap the short description used during retrieval for the full catalog description on the
+    courses that reach the response (the long text is read from disk on first use).
+    """
+    catalog = get_course_catalog()
+    return [
+        replace(r, course=replace(r.course, description=catalog.get_long_text(r.course.id) or r.course.description))
+        for r in recommendations
+    ]
 
 
 def _select_final_courses(
     all_recommendations: List[CourseScore],
     max_total: int,
+    min_per_weakness: int = MIN_COURSES_PER_WEAKNESS,
+    max_per_weakness: int | None = MAX_COURSES_PER_WEAKNESS or None,
+    diversity: str = COURSE_SELECTION_DIVERSITY,
+    mmr_lambda: float = MMR_LAMBDA,
+    course_vectors: Dict[str, List[float]] | None = None,
 ) -> List[CourseScore]:
-    if not all_recommendations:
+    """
+    Pick up to `max_total` unique courses.
+
+    1. Quota pass: the best `min_per_weakness` courses of every weakness (heap per weakness).
+    2. Fill pass: remaining slots by score (lazy heap pops), or by Maximal Marginal Relevance
+       over course embeddings when `diversity="mmr"`.
+    Courses are compared by id, and no weakness contributes more than `max_per_weakness`.
+    """
+    if not all_recommendations or max_total <= 0:
         return []
 
-    # Guarantee at most one top pick per weakness
-    top_per_weakness: Dict[str, CourseScore] = {}
-    for rec in all_recommendations:
-        best = top_per_weakness.get(rec.weakness_id)
-        if best is None or rec.score > best.score:
-            top_per_weakness[rec.weakness_id] = rec
+    selected: List[CourseScore] = []
+    selected_ids: set[str] = set()
+    per_weakness: Dict[str, int] = {}
+
+    def _can_take(rec: CourseScore) -> bool:
+        if rec.course.id in selected_ids:
+            return False
+        return max_per_weakness is None or per_weakness.get(rec.weakness_id, 0) < max_per_weakness
+
+    def _take(rec: CourseScore) -> None:
+        selected.append(rec)
+        selected_ids.add(rec.course.id)
+        per_weakness[rec.weakness_id] = per_weakness.get(rec.weakness_id, 0) + 1
+
+    # 1) Per-weakness quota
+    by_weakness: Dict[str, List[int]] = {}
+    for idx, rec in enumerate(all_recommendations):
+        by_weakness.setdefault(rec.weakness_id, []).append(idx)
+
+    quota_picks: List[CourseScore] = []
+    quota_ids: set[str] = set()
+    if min_per_weakness > 0:
+        for indices in by_weakness.values():
+            heap = [(-all_recommendations[i].score, i) for i in indices]
+            heapq.heapify(heap)
+            taken = 0
+            while heap and taken < min_per_weakness:
+                _, i = heapq.heappop(heap)
+                rec = all_recommendations[i]
+                if rec.course.id in quota_ids:
+                    continue
+                quota_picks.append(rec)
+                quota_ids.add(rec.course.id)
+                taken += 1
+    for rec in heapq.nlargest(len(quota_picks), quota_picks, key=lambda cs: cs.score):
+        if len(selected) >= max_total:
+            return selected
+        if _can_take(rec):
+            _take(rec)
+
+    # 2) Fill remaining slots
+    candidates = [rec for rec in all_recommendations if rec.course.id not in selected_ids]
+    if diversity == "mmr" and course_vectors:
+        _fill_by_mmr(candidates, selected, max_total, mmr_lambda, course_vectors, _can_take, _take)
+    else:
+        heap = [(-rec.score, i) for i, rec in enumerate(candidates)]
+        heapq.heapify(heap)
+        while heap and len(selected) < max_total:
+            _, i = heapq.heappop(heap)
+            if _can_take(candidates[i]):
+                _take(candidates[i])
+    return selected
+
+
+def _fill_by_mmr(
+    candidates: List[CourseScore],
+    selected: List[CourseScore],
+    max_total: int,
+    mmr_lambda: float,
+    course_vectors: Dict[str, List[float]],
+    can_take: Any,
+    take: Any,
+) -> None:
+    """Greedy MMR: lambda * relevance - (1 - lambda) * max cosine similarity to picks so far."""
+    if not candidates:
+        return
+    dim = len(next(iter(course_vectors.values())))
+    matrix = np.zeros((len(candidates), dim), dtype=np.float32)
+    for row, rec in enumerate(candidates):
+        vec = course_vectors.get(rec.course.id)
+        if vec is not None and len(vec) == dim:
+            matrix[row] = vec
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1.0, norms)
+    relevance = np.array([rec.score for rec in candidates], dtype=np.float32)
+    course_ids = np.array([rec.course.id for rec in candidates], dtype=object)
+
+    max_sim = np.zeros(len(candidates), dtype=np.float32)
+    for rec in selected:
+        vec = course_vectors.get(rec.course.id)
+        if vec is not None and len(vec) == dim:
+            max_sim = np.maximum(max_sim, matrix @ _unit(vec))
+
+    available = np.ones(len(candidates), dtype=bool)
+    while len(selected) < max_total and available.any():
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * max_sim
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        available[best] = False
+        rec = candidates[best]
+        if not can_take(rec):
+            continue
+        take(rec)
+        # Drop other entries of the same course and widen the similarity penalty.
+        available &= course_ids != rec.course.id
+        max_sim = np.maximum(max_sim, matrix @ matrix[best])
 
-    selected = _dedupe_by_course(list(top_per_weakness.values()))
-    selected.sort(key=lambda cs: cs.score, reverse=True)
 
-    if len(selected) >= max_total:
-        return selected[:max_total]
+def _unit(vec: List[float]) -> np.ndarray:
+    arr = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(arr)
+    return arr / norm if norm else arr
 
-    remaining_slots = max_total - len(selected)
-    remaining = [
-        rec
-        for rec in all_recommendations
-        if rec not in selected
-    ]
-    remaining = _dedupe_by_course(remaining)
-    remaining.sort(key=lambda cs: cs.score, reverse=True)
 
-    return selected + remaining[:remaining_slots]
+_auto_rerank_lock = threading.Lock()
+_auto_rerank_stats: Dict[str, float] = {
+    "requests": 0,
+    "weaknesses_considered": 0,
+    "weaknesses_reranked": 0,
+    "weaknesses_skipped": 0,
+    "rerank_calls": 0,
+    "rerank_calls_skipped": 0,
+    "avg_rerank_call_seconds": 0.0,
+    "estimated_latency_saved_seconds": 0.0,
+}
 
 
-def _dedupe_by_course(recs: List[CourseScore]) -> List[CourseScore]:
-    seen: set[str] = set()
-    unique: List[CourseScore] = []
-    for rec in recs:
-        cid = rec.course.id
-        if cid in seen:
-            continue
-        seen.add(cid)
-        unique.append(rec)
-    return unique
+def _auto_rerank_courses(
+    weaknesses: List[Weakness],
+    all_recommendations: List[CourseScore],
+    selected: List[CourseScore],
+    min_score: float,
+) -> List[CourseScore]:
+    """
+    Rerank only the selected courses whose weakness has an uncertain vector ranking;
+    confident weaknesses keep their vector scores.
+    """
+    uncertain = _uncertain_weaknesses(all_recommendations, min_score)
+    considered = {rec.weakness_id for rec in selected}
+    to_rerank = [rec for rec in selected if rec.weakness_id in uncertain]
+    keep = [rec for rec in selected if rec.weakness_id not in uncertain]
+
+    elapsed = 0.0
+    if to_rerank:
+        start = time.time()
+        to_rerank = _llm_rerank_courses(weaknesses, to_rerank) or to_rerank
+        elapsed = time.time() - start
+
+    reranked_count = len(considered & uncertain)
+    with _auto_rerank_lock:
+        stats = _auto_rerank_stats
+        stats["requests"] += 1
+        stats["weaknesses_considered"] += len(considered)
+        stats["weaknesses_reranked"] += reranked_count
+        stats["weaknesses_skipped"] += len(considered) - reranked_count
+        if to_rerank and reranked_count:
+            stats["rerank_calls"] += 1
+            # Exponential moving average of a full rerank pass, used to price skipped passes.
+            prev = stats["avg_rerank_call_seconds"]
+            stats["avg_rerank_call_seconds"] = elapsed if stats["rerank_calls"] == 1 else 0.8 * prev + 0.2 * elapsed
+        elif considered:
+            stats["rerank_calls_skipped"] += 1
+            stats["estimated_latency_saved_seconds"] += stats["avg_rerank_call_seconds"]
+    print(f"[Rerank:auto] reranking {reranked_count}/{len(considered)} weaknesses with ambiguous vector scores.")
+
+    combined = keep + to_rerank
+    combined.sort(key=lambda cs: cs.score, reverse=True)
+    return combined
+
+
+def _uncertain_weaknesses(
+    all_recommendations: List[CourseScore],
+    min_score: float,
+    margin: float = RERANK_AUTO_MARGIN,
+    threshold_band: float = RERANK_AUTO_THRESHOLD_BAND,
+) -> set[str]:
+    """
+    A weakness is uncertain when its top candidates are nearly tied (top-1 minus top-2 below
+    `margin`) or when its best score sits within `threshold_band` of `min_score`, where an LLM
+    judgment decides whether the course is shown at all.
+    """
+    scores_by_weakness: Dict[str, List[float]] = {}
+    for rec in all_recommendations:
+        scores_by_weakness.setdefault(rec.weakness_id, []).append(rec.score)
+
+    uncertain: set[str] = set()
+    for wid, scores in scores_by_weakness.items():
+        top = heapq.nlargest(2, scores)
+        near_threshold = abs(top[0] - min_score) < threshold_band
+        tied = len(top) > 1 and top[0] - top[1] < margin
+        if near_threshold or tied:
+            uncertain.add(wid)
+    return uncertain
+
+
+def get_auto_rerank_stats() -> Dict[str, Any]:
+    """Counters for rerank_courses="auto": how often rerank was skipped and estimated time saved."""
+    with _auto_rerank_lock:
+        stats = dict(_auto_rerank_stats)
+    stats["avg_rerank_call_seconds"] = round(stats["avg_rerank_call_seconds"], 4)
+    stats["estimated_latency_saved_seconds"] = round(stats["estimated_latency_saved_seconds"], 4)
+    return stats
 
 
 def _llm_rerank_courses(
@@ -209,10 +668,16 @@ def _llm_rerank_courses(
     recommendations: List[CourseScore],
     model: str = GENERATION_MODEL,
     max_candidates_per_weakness: int = 4,
+    mode: str = RERANK_MODE,
 ) -> List[CourseScore]:
     """
     Uses LLM to validate and re-rank the vector-search recommendations.
-    Optimized to reduce tokens: prompt per-weakness with capped candidates.
+    Optimized to reduce tokens: capped candidates per weakness.
+    - mode="batched": one prompt scores every (weakness, candidate) pair; weaknesses whose part
+      of the answer is missing or invalid are retried with per-weakness prompts.
+    - mode="per_weakness": one prompt per weakness, run concurrently (RERANK_MAX_CONCURRENCY)
+      under an overall RERANK_DEADLINE_SECONDS.
+    LLM judgments are cached per (weakness text, course id, model); cached pairs skip the prompt.
     Returns a new list sorted by LLM relevance score if successful; otherwise returns [].
     """
     if not recommendations:
@@ -230,63 +695,270 @@ def _llm_rerank_courses(
     # Quick lookup for weakness text
     weakness_lookup = {w.id: w.text for w in weaknesses}
 
+    # Serve cached (weakness, course) judgments; only uncached pairs go into the prompt.
+    rescored, pending = _split_cached_rerank(recs_by_weakness, weakness_lookup, model)
+    if not pending:
+        print("[Cache] All rerank pairs served from cache; skipping LLM call.")
+
+    if mode == "batched" and len(pending) > 1:
+        batched = _rerank_batched(pending, weakness_lookup, model)
+        for recs in batched.values():
+            rescored.extend(recs)
+        pending = {wid: recs for wid, recs in pending.items() if wid not in batched}
+        if pending:
+            print(f"[WARN] Batched re-rank invalid for {len(pending)} weaknesses; retrying per weakness.")
+
+    if pending:
+        rescored.extend(_rerank_per_weakness_concurrently(pending, weakness_lookup, model))
+
+    # Keep at most one per weakness in final top list, sorted by score
+    rescored.sort(key=lambda cs: cs.score, reverse=True)
+    return rescored
+
+
+def _rerank_per_weakness_concurrently(
+    recs_by_weakness: Dict[str, List[CourseScore]],
+    weakness_lookup: Dict[str, str],
+    model: str,
+    max_concurrency: int = RERANK_MAX_CONCURRENCY,
+    deadline_seconds: float = RERANK_DEADLINE_SECONDS,
+) -> List[CourseScore]:
+    """
+    Run per-weakness rerank prompts in parallel so latency is max() rather than sum().
+    Weaknesses whose call fails or misses the deadline keep their vector ordering; calls still
+    running at the deadline are abandoned and neither log tokens nor populate the rerank cache.
+    """
+    slots = threading.Semaphore(max(1, max_concurrency))
+    abandoned = threading.Event()
+
+    def _run(wid: str, recs: List[CourseScore]) -> List[CourseScore]:
+        with slots:
+            if abandoned.is_set():
+                return list(recs)
+            return _rerank_single_weakness(wid, weakness_lookup.get(wid) or "", recs, model, abandoned)
+
+    futures = {
+        _rerank_executor.submit(with_current_priority(_run), wid, recs): wid
+        for wid, recs in recs_by_weakness.items()
+    }
+    done, not_done = wait(futures, timeout=deadline_seconds)
+    abandoned.set()
+    for future in not_done:
+        future.cancel()
+
     rescored: List[CourseScore] = []
+    for future, wid in futures.items():
+        if future in done:
+            rescored.extend(future.result())
+        else:
+            print(f"[WARN] LLM re-rank timed out for weakness {wid}; keeping vector ordering.")
+            rescored.extend(recs_by_weakness[wid])
+    return rescored
 
+
+def _rerank_single_weakness(
+    wid: str,
+    weakness_text: str,
+    recs: List[CourseScore],
+    model: str,
+    abandoned: threading.Event | None = None,
+) -> List[CourseScore]:
+    """
+    Score one weakness's candidates; falls back to the existing ordering on any failure.
+    Once `abandoned` is set the caller has stopped waiting, so the result is discarded unlogged.
+    """
+    rec_lines = "\n".join(
+        f'- id="{r.course.id}", title="{truncate_text(r.course.lesson_title, RERANK_TITLE_MAX_TOKENS)}"'
+        for r in recs
+    )
+    prompt_size = record_prompt_size(
+        "agent4",
+        "\n".join(f'- id="{r.course.id}", title="{r.course.lesson_title}"' for r in recs),
+        rec_lines,
+    )
+    prompt_suffix = f"""
+        Weakness:
+        "{weakness_text}"
+
+        Candidate courses (keep all, just score relevance 0-1):
+        {rec_lines}
+        """
+    response = None
+    start = time.time()
+    try:
+        response = get_context_cache().generate_content(
+            model=model,
+            prefix=RERANK_SINGLE_PROMPT_PREFIX,
+            suffix=prompt_suffix,
+            label="agent4-rerank",
+        )
+        data = _parse_rerank_json(response.text)
+        if not isinstance(data, list):
+            return []
+        rec_lookup = {r.course.id: r for r in recs}
+        rescored: List[CourseScore] = []
+        for item in data:
+            cid = item.get("course_id")
+            if cid not in rec_lookup:
+                continue
+            rescored.append(_rescore(rec_lookup[cid], item))
+        if abandoned is None or not abandoned.is_set():
+            _cache_rerank_scores(weakness_text, rescored, model)
+        return rescored
+    except Exception as exc:
+        print(f"[WARN] LLM re-rank failed for weakness {wid}: {exc}")
+        # fall back to existing ordering for this weakness
+        return list(recs)
+    finally:
+        if abandoned is None or not abandoned.is_set():
+            elapsed = time.time() - start
+            input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
+            log_token_usage(
+                usage=f"agent4: course rerank ({wid})",
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                runtime_seconds=elapsed,
+                details={**prompt_size, "cached_tokens": extract_cached_token_count(response) if response else None},
+            )
+
+
+def _rerank_batched(
+    recs_by_weakness: Dict[str, List[CourseScore]],
+    weakness_lookup: Dict[str, str],
+    model: str,
+) -> Dict[str, List[CourseScore]]:
+    """
+    Score all (weakness, candidate) pairs in one call. Weaknesses are aliased as w1, w2, ...
+    to keep ids short. Returns rescored lists only for weaknesses whose results were valid.
+    """
+    aliases = {f"w{i}": wid for i, wid in enumerate(recs_by_weakness, start=1)}
+    blocks = []
+    full_blocks = []
+    for alias, wid in aliases.items():
+        rec_lines = "\n".join(
+            f'  - id="{r.course.id}", title="{truncate_text(r.course.lesson_title, RERANK_TITLE_MAX_TOKENS)}"'
+            for r in recs_by_weakness[wid]
+        )
+        blocks.append(f'{alias}: "{weakness_lookup.get(wid) or ""}"\n{rec_lines}')
+        full_lines = "\n".join(
+            f'  - id="{r.course.id}", title="{r.course.lesson_title}"' for r in recs_by_weakness[wid]
+        )
+        full_blocks.append(f'{alias}: "{weakness_lookup.get(wid) or ""}"\n{full_lines}')
+    weakness_blocks = "\n\n".join(blocks)
+    prompt_size = record_prompt_size("agent4", "\n\n".join(full_blocks), weakness_blocks)
+
+    prompt_suffix = f"""
+        Weaknesses and their candidate courses (keep all, just score relevance 0-1):
+        {weakness_blocks}
+        """
+
+    response = None
+    parsed: Dict[str, List[CourseScore]] = {}
+    start = time.time()
+    try:
+        response = get_context_cache().generate_content(
+            model=model,
+            prefix=RERANK_BATCHED_PROMPT_PREFIX,
+            suffix=prompt_suffix,
+            label="agent4-batched-rerank",
+        )
+        data = _parse_rerank_json(response.text)
+        if isinstance(data, list):
+            parsed = _map_batched_items(data, aliases, recs_by_weakness)
+        for wid, recs in parsed.items():
+            _cache_rerank_scores(weakness_lookup.get(wid) or "", recs, model)
+    except Exception as exc:
+        print(f"[WARN] Batched LLM re-rank failed: {exc}")
+    finally:
+        elapsed = time.time() - start
+        input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
+        log_token_usage(
+            usage="agent4: batched course rerank",
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            runtime_seconds=elapsed,
+            details={
+                "weaknesses": len(recs_by_weakness),
+                "valid_weaknesses": len(parsed),
+                # Each valid weakness would otherwise have been its own serial round trip.
+                "serial_calls_avoided": max(len(parsed) - 1, 0),
+                **prompt_size,
+                "cached_tokens": extract_cached_token_count(response) if response else None,
+            },
+        )
+    return parsed
+
+
+def _map_batched_items(
+    items: List[Any],
+    aliases: Dict[str, str],
+    recs_by_weakness: Dict[str, List[CourseScore]],
+) -> Dict[str, List[CourseScore]]:
+    """Group batched items back by weakness id; a weakness with any malformed item is dropped."""
+    lookups = {wid: {r.course.id: r for r in recs} for wid, recs in recs_by_weakness.items()}
+    parsed: Dict[str, List[CourseScore]] = {}
+    invalid: set[str] = set()
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        wid = aliases.get(str(item.get("weakness", "")).strip())
+        if wid is None or wid in invalid:
+            continue
+        base = lookups[wid].get(item.get("course_id"))
+        if base is None:
+            continue
+        try:
+            parsed.setdefault(wid, []).append(_rescore(base, item))
+        except (TypeError, ValueError):
+            invalid.add(wid)
+            parsed.pop(wid, None)
+    return parsed
+
+
+def _rerank_cache_key(weakness_text: str, course_id: str, model: str) -> str:
+    return f"{stable_hash(normalize_text(weakness_text))}:{course_id}:{model}"
+
+
+def _split_cached_rerank(
+    recs_by_weakness: Dict[str, List[CourseScore]],
+    weakness_lookup: Dict[str, str],
+    model: str,
+) -> tuple[List[CourseScore], Dict[str, List[CourseScore]]]:
+    """Return (rescored from cache, remaining uncached candidates grouped by weakness)."""
+    cached: List[CourseScore] = []
+    pending: Dict[str, List[CourseScore]] = {}
     for wid, recs in recs_by_weakness.items():
         weakness_text = weakness_lookup.get(wid) or ""
-        rec_lines = "\n".join(
-            f'- id="{r.course.id}", title="{r.course.lesson_title}"'
-            for r in recs
+        for rec in recs:
+            hit = _rerank_cache.get(_rerank_cache_key(weakness_text, rec.course.id, model))
+            if hit is None:
+                pending.setdefault(wid, []).append(rec)
+            else:
+                cached.append(_rescore(rec, hit))
+    return cached, pending
+
+
+def _cache_rerank_scores(weakness_text: str, rescored: List[CourseScore], model: str) -> None:
+    for rec in rescored:
+        _rerank_cache.set(
+            _rerank_cache_key(weakness_text, rec.course.id, model),
+            {"relevance_score": rec.score, "justification": rec.reason},
         )
-        prompt = f"""
-            You are scoring courses for a single weakness.
 
-            Weakness:
-            "{weakness_text}"
 
-            Candidate courses (keep all, just score relevance 0-1):
-            {rec_lines}
+def _rescore(base: CourseScore, item: Dict[str, Any]) -> CourseScore:
+    return CourseScore(
+        course=base.course,
+        weakness_id=base.weakness_id,
+        score=float(item.get("relevance_score", base.score)),
+        reason=item.get("justification") or base.reason,
+    )
 
-            Output JSON ONLY:
-            [
-              {{"course_id": "<id>", "relevance_score": <0-1>, "justification": "<very short>"}},
-              ...
-            ]
-            """
-        try:
-            response = llm_client.models.generate_content(
-                model=model,
-                contents=[{"parts": [{"text": prompt}]}],
-            )
-            raw = (response.text or "").strip()
-            raw = raw.replace("```json", "").replace("```", "").strip()
-            data = json.loads(raw)
-            if not isinstance(data, list):
-                continue
-            rec_lookup = {r.course.id: r for r in recs}
-            for item in data:
-                cid = item.get("course_id")
-                if cid not in rec_lookup:
-                    continue
-                base = rec_lookup[cid]
-                score = float(item.get("relevance_score", base.score))
-                justification = item.get("justification") or base.reason
-                rescored.append(
-                    CourseScore(
-                        course=base.course,
-                        weakness_id=base.weakness_id,
-                        score=score,
-                        reason=justification,
-                    )
-                )
-        except Exception as exc:
-            print(f"[WARN] LLM re-rank failed for weakness {wid}: {exc}")
-            # fall back to existing ordering for this weakness
-            rescored.extend(recs)
 
-    # Keep at most one per weakness in final top list, sorted by score
-    rescored.sort(key=lambda cs: cs.score, reverse=True)
-    return rescored
+def _parse_rerank_json(text: str | None) -> Any:
+    raw = (text or "").strip()
+    raw = raw.replace("```json", "").replace("```", "").strip()
+    return json.loads(raw)
 
 
     # response = {
@@ -1,18 +1,124 @@
 # agents/agent5_user_facing_response.py
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
+import copy
 import json
 import time
 from config import (
     GENERATION_MODEL,
-    client,
     Course,
     Weakness,
     CourseScore,
     PARTICIPANT_RANKING,
     MIN_RECOMMENDATION_SCORE,
+    AGENT5_DATA_TOKEN_BUDGET,
+    SUMMARY_MODE,
+    SUMMARY_POLISH_FIELD,
+    SUMMARY_LANGUAGES,
+    SUMMARY_ALT_LANGUAGE_MODE,
+    CACHE_DIR,
+    SUMMARY_CACHE_TTL_SECONDS,
+    SUMMARY_CACHE_MAX_ENTRIES,
+    SUMMARY_CACHE_DISK_ENABLED,
+)
+from pipeline.prompt_builder import (
+    compact_json,
+    estimate_tokens,
+    fit_records_to_budget,
+    record_prompt_size,
+    strip_empty,
+    truncate_text,
+)
+from pipeline.cache import TTLCache, normalize_text, stable_hash
+from pipeline.context_cache import get_context_cache
+from pipeline.streaming_json import JsonObjectStreamParser
+from pipeline.run_logging import log_token_usage, extract_token_counts, extract_cached_token_count
+
+# Static instruction prefix, sent first and served from the context cache once large enough to cache; only the input data varies per call.
+SUMMARY_PROMPT_PREFIX = """
+        You are generating a concise JSON report for a student or professional
+        based on their weaknesses and recommended courses.
+
+        DOMAIN INFERENCE RULE:
+        - You MAY infer the domain **only if** the weaknesses, course titles, or metadata
+          clearly indicate a domain (e.g., English listening, SQL queries, financial modeling,
+          safety engineering, supply chain forecasting).
+        - If domain is NOT clearly indicated, stay domain-neutral and avoid assuming a specific field.
+
+        DO NOT create fictional exams, fake metrics, or imaginary organizations.
+        Use only information from the weaknesses and course list.
 
+        --- REQUIRED OUTPUT FORMAT (JSON ONLY) ---
+        {
+            "Test Title": "<the current test title>",
+            "Current Performance": "<one short paragraph summarizing current ability. Mention domain only if clearly detectable. Summarize strengths and weaknesses clearly.>",
+            "Area to be Improved": "<one short paragraph describing the key skills or behaviors that need focus.>",
+            "Recommended Course": [
+                "<Course A explanation referencing one of the provided courses>",
+                "<Course B explanation referencing one of the provided courses>",
+                "..."
+            ],
+            "Progress Compared to Previous Test": "<Use the provided heading if history exists, otherwise empty string.>",
+            "Domain Comparison": [
+                "<Domain A: Improved by +X% (short reasoning)>",
+                "<Domain B: Declined by -Y% (short reasoning)>"
+            ]
+        }
+        --- TONE & FORMAT ---
+
+        - Use a supportive and encouraging tone.
+        - Keep each section concise (2-4 sentences).
+        - Focus on clarity and actionable insights.
+        - Write in smooth, narrative paragraphs.
+        - Base "Current Performance" on the provided test result fields (score, attempts, status, totals) plus the incorrect-question summary; do NOT rely solely on weaknesses.
+        - If participant ranking is provided (not N/A), include a short ranking statement using that value.
+        - If domain performance includes both current and history, add a concise domain-wise comparison highlighting improvements or declines; otherwise omit or leave the array empty.
+        - Include the test title at the start via the "Test Title" field.
+        - If there is a previous attempt, set "Progress Compared to Previous Test" to the heading provided in the input data; otherwise set it to an empty string.
+        - Respond in the requested language given at the end of the input data (supported: EN, TH). Keep JSON keys in English.
+        - LANGUAGE RULE: All value strings (not keys) must be written in the requested language. If TH, use natural Thai phrasing; if EN, use English.
+        - Return ONLY valid JSON (no code fences, no commentary).
+        - The "Recommended Course" array must describe each provided course and how it supports the weaknesses.
+        - Do not invent new courses or change their titles.
+"""
+
+# Hybrid mode: the template already holds every fact, the LLM only improves the wording of one field.
+POLISH_PROMPT_PREFIX = """
+        You are polishing one field of a student's test report.
+
+        Rewrite the draft below into a supportive, encouraging paragraph of 2-4 sentences.
+        - Keep every fact, number, percentage and course title from the draft; do not add new ones.
+        - You may mention the listed weaknesses, but do not invent exams, metrics or organizations.
+        - Write in the requested language (EN or TH; if TH, use natural Thai phrasing).
+        - Return ONLY the rewritten paragraph as plain text (no JSON, no quotes, no commentary).
+"""
+
+# Appended to the summary suffix when several languages are generated in the same call.
+BILINGUAL_OUTPUT_INSTRUCTION = """
+        OUTPUT OVERRIDE: Requested languages are {languages}. Return ONE JSON object keyed by
+        language code, in this order: {{{example}}}. Each value is a complete report in the
+        REQUIRED OUTPUT FORMAT written in that language, with the same facts in every language.
+        """
+
+# Translation mode: the second language is derived from the finished summary, not from the input data.
+TRANSLATE_PROMPT_PREFIX = """
+        You are translating a student's test report between English (EN) and Thai (TH).
+
+        Translate every string value of the JSON report into the target language.
+        - Keep the JSON keys (in English), the structure and the array order unchanged.
+        - Keep numbers, percentages, course titles and URLs exactly as written.
+        - Keep the supportive tone; if TH, use natural Thai phrasing.
+        - Return ONLY valid JSON (no code fences, no commentary).
+"""
+
+# Agent 5 is a pure function of its inputs; identical report requests reuse the summary JSON.
+# Score filtering, links and the paragraph are re-derived from it on every request.
+_summary_cache = TTLCache(
+    name="agent5_summary",
+    maxsize=SUMMARY_CACHE_MAX_ENTRIES,
+    ttl_seconds=SUMMARY_CACHE_TTL_SECONDS,
+    disk_dir=CACHE_DIR / "agent5_summary" if SUMMARY_CACHE_DISK_ENABLED else None,
 )
-from pipeline.run_logging import log_token_usage, extract_token_counts
+
 
 def generate_user_facing_response(
     weaknesses: List[Weakness],
@@ -25,61 +131,256 @@ def generate_user_facing_response(
     domain_performance: Optional[Dict[str, Any]] = None,
     language: str = "EN",
     min_score: float = MIN_RECOMMENDATION_SCORE,
+    on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    summary_mode: str = SUMMARY_MODE,
+    alt_language_mode: str = SUMMARY_ALT_LANGUAGE_MODE,
 ) -> Dict[str, Any]:
     """
     Generate a narrative performance report. The model is allowed to infer the domain
     ONLY if domain clues appear in the weakness descriptions, test name, or course titles.
     Otherwise, it must stay domain-neutral.
+
+    With `on_event`, the response is streamed: a "summary_field" event is emitted as each
+    top-level summary field completes and "paragraph_delta" events carry the
+    `user_facing_paragraph` text in order (their concatenation equals the final paragraph,
+    unless the LLM output is unusable and the fallback summary replaces it).
+
+    `summary_mode`:
+    - "llm": one Gemini call writes the whole summary (default)
+    - "template": the summary is rendered locally from the deterministic builders, no LLM call
+    - "hybrid": template summary with only SUMMARY_POLISH_FIELD rewritten by a short LLM call
+
+    `alt_language_mode` adds the other SUMMARY_LANGUAGES under "alternate_languages"
+    ({language: {"summary", "user_facing_paragraph", "recommendations"}}):
+    - "off": requested language only (default)
+    - "bilingual": llm mode writes all languages in the same Gemini call
+    - "translate": the finished summary is translated by a second, shorter call
+    Template and hybrid modes render the other language locally (hybrid polishes it too).
     """
+    language_code = (language or "EN").strip().upper()
+    alt_languages = _alternate_languages(language_code, alt_language_mode)
 
     # Fast path: no incorrect answers, so skip LLM.
     if all_correct:
-        summary_json = _congrats_summary(
+        def _congrats(lang: str) -> Dict[str, Any]:
+            return _congrats_summary(
+                test_result=test_result,
+                history_result=history_result,
+                ranking_sentence=_ranking_sentence(participant_ranking, lang),
+                progress_heading=_progress_heading(test_result, history_result, lang),
+                language=lang,
+            )
+
+        result = {
+            "summary": _congrats(language),
+            "recommendations": [],
+        }
+        if alt_languages:
+            result["alternate_languages"] = {
+                lang: {"summary": _congrats(lang), "recommendations": []} for lang in alt_languages
+            }
+        return result
+
+    paragraph_stream = _ParagraphStream(on_event) if on_event else None
+
+    def _template(lang: str) -> Dict[str, Any]:
+        return _template_summary(
+            weaknesses=weaknesses,
+            recommendations=recommendations,
             test_result=test_result,
             history_result=history_result,
-            ranking_sentence=_ranking_sentence(participant_ranking),
-            progress_heading=_progress_heading(test_result, history_result),
+            incorrect_summary=incorrect_summary,
+            participant_ranking=participant_ranking,
+            domain_performance=domain_performance,
+            language=lang,
         )
-        return {
-            "summary": summary_json,
-            "recommendations": [],
+
+    def _cache_key(lang: str) -> str | None:
+        # Template output costs milliseconds to rebuild; only LLM-written summaries are cached.
+        if summary_mode == "template":
+            return None
+        return _summary_cache_key(
+            weaknesses, recommendations, test_result, history_result, incorrect_summary,
+            participant_ranking, domain_performance, lang, min_score, summary_mode,
+        )
+
+    cache_key = _cache_key(language_code)
+    start = time.time()
+    cached_summary = _summary_cache.get(cache_key) if cache_key else None
+    alt_summaries: Dict[str, Dict[str, Any]] = {}
+
+    if cached_summary is not None:
+        summary_json = copy.deepcopy(cached_summary)
+        log_token_usage(
+            usage="agent5: user-facing response generation (cache hit)",
+            input_tokens=0,
+            output_tokens=0,
+            runtime_seconds=time.time() - start,
+            details={"summary_mode": summary_mode},
+        )
+        if paragraph_stream is not None:
+            for field, value in summary_json.items():
+                paragraph_stream.add_field(field, value)
+    elif summary_mode in ("template", "hybrid"):
+        summary_json = _template(language_code)
+        log_token_usage(
+            usage="agent5: template summary",
+            input_tokens=0,
+            output_tokens=0,
+            runtime_seconds=time.time() - start,
+        )
+        if summary_mode == "hybrid":
+            summary_json, polished = _polish_summary_field(summary_json, weaknesses, language_code)
+            if polished:
+                _summary_cache.set(cache_key, copy.deepcopy(summary_json))
+        if paragraph_stream is not None:
+            for field, value in summary_json.items():
+                paragraph_stream.add_field(field, value)
+    else:
+        bilingual = alt_language_mode == "bilingual" and bool(alt_languages)
+        summaries, generated = _llm_summary(
+            weaknesses=weaknesses,
+            recommendations=recommendations,
+            test_result=test_result,
+            history_result=history_result,
+            incorrect_summary=incorrect_summary,
+            participant_ranking=participant_ranking,
+            domain_performance=domain_performance,
+            languages=[language_code, *alt_languages] if bilingual else [language_code],
+            paragraph_stream=paragraph_stream,
+        )
+        summary_json = summaries.pop(language_code)
+        alt_summaries.update(summaries)
+        # The deterministic fallback after an LLM failure is not cached, so the next request retries.
+        if generated:
+            for lang, summary in ((language_code, summary_json), *alt_summaries.items()):
+                _summary_cache.set(_cache_key(lang), copy.deepcopy(summary))
+
+    # === Other languages: cached, rendered locally, or translated from the final summary === #
+    for lang in alt_languages:
+        if lang in alt_summaries:
+            continue
+        alt_key = _cache_key(lang)
+        hit = _summary_cache.get(alt_key) if alt_key else None
+        if hit is not None:
+            alt_summaries[lang] = copy.deepcopy(hit)
+        elif summary_mode == "template":
+            alt_summaries[lang] = _template(lang)
+        elif summary_mode == "hybrid":
+            alt_summaries[lang], polished = _polish_summary_field(_template(lang), weaknesses, lang)
+            if polished:
+                _summary_cache.set(alt_key, copy.deepcopy(alt_summaries[lang]))
+        else:
+            alt_summaries[lang], translated = _translate_summary(summary_json, lang)
+            if not translated:
+                alt_summaries[lang] = _template(lang)
+            else:
+                _summary_cache.set(alt_key, copy.deepcopy(alt_summaries[lang]))
+
+    result = _render_response(summary_json, recommendations, min_score)
+    if paragraph_stream is not None:
+        # Remaining parts (always including the link-annotated course list) come from the final summary.
+        paragraph_stream.finish(result["summary"])
+    if alt_languages:
+        result["alternate_languages"] = {
+            lang: _render_response(alt_summaries[lang], recommendations, min_score) for lang in alt_languages
         }
+    return result
 
-    weaknesses_text = "\n".join(
-        f"- ({w.id}) {w.text} (importance={w.importance})"
-        for w in weaknesses
+
+def _alternate_languages(language_code: str, alt_language_mode: str) -> List[str]:
+    if alt_language_mode not in ("bilingual", "translate") or language_code not in SUMMARY_LANGUAGES:
+        return []
+    return [lang for lang in SUMMARY_LANGUAGES if lang != language_code]
+
+
+def _render_response(
+    summary_json: Dict[str, Any],
+    recommendations: List[CourseScore],
+    min_score: float,
+) -> Dict[str, Any]:
+    """Score filtering, course links and the paragraph, applied to one language's summary."""
+    # === Build simple recommendations JSON === #
+    rec_list = [
+        {
+            "course_id": cs.course.id,
+            "course_title": cs.course.lesson_title,
+            "target_weakness_id": cs.weakness_id,
+            "explanation": cs.reason or "",
+            "score": cs.score,
+            "course_link": cs.course.link,
+        }
+        for cs in recommendations
+    ]
+
+    summary_json, rec_list_filtered = _filter_recommendations_by_score(
+        summary_json, rec_list, recommendations, min_score=min_score
     )
+    summary_json = _append_links_to_summary(summary_json, rec_list_filtered)
+    user_facing_paragraph = _summary_to_paragraph(summary_json, rec_list_filtered)
 
+    return {
+        "summary": summary_json,
+        "user_facing_paragraph": user_facing_paragraph,
+        "recommendations": rec_list,
+    }
+
+
+def _llm_summary(
+    weaknesses: List[Weakness],
+    recommendations: List[CourseScore],
+    test_result: Optional[Dict[str, Any]],
+    history_result: Optional[Dict[str, Any]],
+    incorrect_summary: Optional[Dict[str, Any]],
+    participant_ranking: Optional[float],
+    domain_performance: Optional[Dict[str, Any]],
+    languages: List[str],
+    paragraph_stream: Optional["_ParagraphStream"],
+) -> tuple[Dict[str, Dict[str, Any]], bool]:
+    """
+    Full summary from one Gemini call; the deterministic summary is used if the output is unusable.
+    With several languages (first = requested) the call returns one summary per language.
+    Returns ({language: summary}, whether it was generated by the LLM).
+    """
     recs_text = "\n".join(
         f"- {cs.course.lesson_title} (id={cs.course.id}) helps weakness {cs.weakness_id}"
         for cs in recommendations
     )
 
-    language_code = (language or "EN").strip().upper()
-
-    test_result_text = json.dumps(test_result or {}, ensure_ascii=False, indent=2)
-    history_result_text = json.dumps(history_result or {}, ensure_ascii=False, indent=2)
-    incorrect_summary_text = json.dumps(incorrect_summary or {}, ensure_ascii=False, indent=2)
+    # Compact data blobs (no indentation, nulls stripped); weakness texts are the only
+    # free text truncated when the data section exceeds AGENT5_DATA_TOKEN_BUDGET.
+    test_result_text = compact_json(test_result or {})
+    history_result_text = compact_json(history_result or {})
+    incorrect_summary_text = compact_json(incorrect_summary or {})
     ranking_text = _ranking_value_for_prompt(participant_ranking)
-    domain_perf_text = json.dumps(domain_performance or {}, ensure_ascii=False, indent=2)
+    domain_perf_text = compact_json(domain_performance or {})
+    blobs_tokens = estimate_tokens(
+        test_result_text + history_result_text + incorrect_summary_text + domain_perf_text + recs_text
+    )
+    fitted_weaknesses = fit_records_to_budget(
+        [{"id": w.id, "text": w.text} for w in weaknesses],
+        truncatable_fields=("text",),
+        budget_tokens=max(AGENT5_DATA_TOKEN_BUDGET - blobs_tokens, 0),
+    )
+    weaknesses_text = "\n".join(
+        f"- ({w.id}) {fitted.get('text', '')} (importance={w.importance})"
+        for w, fitted in zip(weaknesses, fitted_weaknesses)
+    )
+    prompt_size = record_prompt_size(
+        "agent5",
+        "".join(
+            json.dumps(blob or {}, ensure_ascii=False, indent=2)
+            for blob in (test_result, history_result, incorrect_summary, domain_performance)
+        )
+        + "".join(w.text for w in weaknesses),
+        test_result_text + history_result_text + incorrect_summary_text + domain_perf_text + weaknesses_text,
+    )
     progress_heading = _progress_heading(test_result, history_result) or "N/A"
     test_title = _test_title(test_result, history_result) or "N/A"
-    language_text = language_code
-
-    # === JSON Prompt === #
-    prompt = f"""
-        You are generating a concise JSON report for a student or professional
-        based on their weaknesses and recommended courses.
-
-        DOMAIN INFERENCE RULE:
-        - You MAY infer the domain **only if** the weaknesses, course titles, or metadata
-          clearly indicate a domain (e.g., English listening, SQL queries, financial modeling,
-          safety engineering, supply chain forecasting).
-        - If domain is NOT clearly indicated, stay domain-neutral and avoid assuming a specific field.
-
-        DO NOT create fictional exams, fake metrics, or imaginary organizations.
-        Use only information from the weaknesses and course list.
+    language_text = languages[0] if len(languages) == 1 else ", ".join(languages)
 
+    # === JSON Prompt: cached static prefix + per-request data === #
+    prompt_suffix = f"""
         --- INPUT DATA ---
 
         Full test result for the CURRENT attempt (use this for "Current Performance"):
@@ -106,70 +407,58 @@ def generate_user_facing_response(
         Selected recommended courses (do NOT change this list):
         {recs_text}
 
-        --- REQUIRED OUTPUT FORMAT (JSON ONLY) ---
-        {{
-            "Test Title": "<the current test title>",
-            "Current Performance": "<one short paragraph summarizing current ability. Mention domain only if clearly detectable. Summarize strengths and weaknesses clearly.>",
-            "Area to be Improved": "<one short paragraph describing the key skills or behaviors that need focus.>",
-            "Recommended Course": [
-                "<Course A explanation referencing one of the provided courses>",
-                "<Course B explanation referencing one of the provided courses>",
-                "..."
-            ],
-            "Progress Compared to Previous Test": "<Use the provided heading if history exists, otherwise empty string.>",
-            "Domain Comparison": [
-                "<Domain A: Improved by +X% (short reasoning)>",
-                "<Domain B: Declined by -Y% (short reasoning)>"
-            ]
-        }}
-        --- TONE & FORMAT ---
-
-        - Use a supportive and encouraging tone.
-        - Keep each section concise (2-4 sentences).
-        - Focus on clarity and actionable insights.
-        - Write in smooth, narrative paragraphs.
-        - Base "Current Performance" on the provided test result fields (score, attempts, status, totals) plus the incorrect-question summary; do NOT rely solely on weaknesses.
-        - If participant ranking is provided (not N/A), include a short ranking statement using that value.
-        - If domain performance includes both current and history, add a concise domain-wise comparison highlighting improvements or declines; otherwise omit or leave the array empty.
-        - Include the test title at the start via the \"Test Title\" field.
-        - If there is a previous attempt, set \"Progress Compared to Previous Test\" to the heading provided above; otherwise set it to an empty string.
-        - Respond in the requested language: {language_text} (supported: EN, TH). Keep JSON keys in English.
-        - LANGUAGE RULE: All value strings (not keys) must be written in {language_text}. If TH, use natural Thai phrasing; if EN, use English.
-        - Return ONLY valid JSON (no code fences, no commentary).
-        - The "Recommended Course" array must describe each provided course and how it supports the weaknesses.
-        - Do not invent new courses or change their titles.
+        Requested language: {language_text}
         """
-    
-    
+    if len(languages) > 1:
+        prompt_suffix += BILINGUAL_OUTPUT_INSTRUCTION.format(
+            languages=language_text,
+            example=", ".join(f'"{lang}": {{...}}' for lang in languages),
+        )
+
     # === Call Gemini === #
     response = None
+    generated = False
     start = time.time()
     try:
-        response = client.models.generate_content(
-            model=GENERATION_MODEL,
-            contents=[{"parts": [{"text": prompt}]}],
-        )
-        raw_text = (response.text or "").strip()
+        if paragraph_stream is None:
+            response = get_context_cache().generate_content(
+                model=GENERATION_MODEL,
+                prefix=SUMMARY_PROMPT_PREFIX,
+                suffix=prompt_suffix,
+                label="agent5-summary",
+            )
+            raw_text = (response.text or "").strip()
+        else:
+            raw_text, response = _stream_summary(
+                prompt_suffix, paragraph_stream, language=languages[0] if len(languages) > 1 else None
+            )
         if not raw_text:
             raise ValueError("Empty response")
-        summary_json = _parse_llm_json(raw_text)
-        if not summary_json:
+        parsed = _parse_llm_json(raw_text)
+        if len(languages) == 1:
+            summaries = {languages[0]: parsed} if parsed else {}
+        else:
+            # A missing secondary language is filled in later by translation.
+            summaries = {lang: parsed[lang] for lang in languages if isinstance(parsed.get(lang), dict) and parsed[lang]}
+        if languages[0] not in summaries:
             raise ValueError("Unable to parse JSON")
+        generated = True
 
     except Exception:
         print("[WARN] LLM response invalid or missing JSON, falling back to default summary.")
-        summary_json = _fallback_summary(
-            weaknesses=weaknesses,
-            recommendations=recommendations,
-            test_result=test_result,
-            incorrect_summary=incorrect_summary,
-            history_result=history_result,
-            ranking_sentence=_ranking_sentence(participant_ranking),
-            domain_performance=domain_performance,
-            progress_heading=_progress_heading(test_result, history_result),
-            test_title=test_title,
-            language=language_text,
-        )
+        summaries = {
+            lang: _template_summary(
+                weaknesses=weaknesses,
+                recommendations=recommendations,
+                test_result=test_result,
+                history_result=history_result,
+                incorrect_summary=incorrect_summary,
+                participant_ranking=participant_ranking,
+                domain_performance=domain_performance,
+                language=lang,
+            )
+            for lang in languages
+        }
     finally:
         elapsed = time.time() - start
         input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
@@ -178,32 +467,234 @@ def generate_user_facing_response(
             input_tokens=input_tokens,
             output_tokens=output_tokens,
             runtime_seconds=elapsed,
+            details={
+                **prompt_size,
+                "cached_tokens": extract_cached_token_count(response) if response else None,
+                "languages": languages,
+            },
         )
 
-    # === Build simple recommendations JSON === #
-    rec_list = [
-        {
-            "course_id": cs.course.id,
-            "course_title": cs.course.lesson_title,
-            "target_weakness_id": cs.weakness_id,
-            "explanation": cs.reason or "",
-            "score": cs.score,
-            "course_link": cs.course.link,
-        }
-        for cs in recommendations
-    ]
+    return summaries, generated
 
-    summary_json, rec_list_filtered = _filter_recommendations_by_score(
-        summary_json, rec_list, recommendations, min_score=min_score
+
+def _template_summary(
+    weaknesses: List[Weakness],
+    recommendations: List[CourseScore],
+    test_result: Optional[Dict[str, Any]],
+    history_result: Optional[Dict[str, Any]],
+    incorrect_summary: Optional[Dict[str, Any]],
+    participant_ranking: Optional[float],
+    domain_performance: Optional[Dict[str, Any]],
+    language: str,
+) -> Dict[str, Any]:
+    """Deterministic summary in the requested language (no LLM call)."""
+    return _fallback_summary(
+        weaknesses=weaknesses,
+        recommendations=recommendations,
+        test_result=test_result,
+        incorrect_summary=incorrect_summary,
+        history_result=history_result,
+        ranking_sentence=_ranking_sentence(participant_ranking, language),
+        domain_performance=domain_performance,
+        progress_heading=_progress_heading(test_result, history_result, language),
+        test_title=_test_title(test_result, history_result),
+        language=language,
     )
-    summary_json = _append_links_to_summary(summary_json, rec_list_filtered)
-    user_facing_paragraph = _summary_to_paragraph(summary_json, rec_list_filtered)
 
-    return {
-        "summary": summary_json,
-        "user_facing_paragraph": user_facing_paragraph,
-        "recommendations": rec_list,
-    }
+
+def _polish_summary_field(
+    summary: Dict[str, Any],
+    weaknesses: List[Weakness],
+    language: str,
+    field: str = SUMMARY_POLISH_FIELD,
+) -> tuple[Dict[str, Any], bool]:
+    """
+    Hybrid mode: rewrite one narrative field of the template summary with a short LLM call.
+    Facts and numbers come from the template text; the template text is kept on any failure.
+    Returns (summary, whether the field was polished).
+    """
+    draft = summary.get(field)
+    if not isinstance(draft, str) or not draft:
+        return summary, False
+
+    weakness_lines = "\n".join(f"- {truncate_text(w.text, 48)}" for w in weaknesses[:5])
+    prompt_suffix = f"""
+        Field: {field}
+        Requested language: {language}
+
+        Weaknesses identified:
+        {weakness_lines}
+
+        Draft:
+        {draft}
+        """
+
+    response = None
+    polished_ok = False
+    start = time.time()
+    try:
+        response = get_context_cache().generate_content(
+            model=GENERATION_MODEL,
+            prefix=POLISH_PROMPT_PREFIX,
+            suffix=prompt_suffix,
+            label="agent5-polish",
+        )
+        polished = (response.text or "").strip().strip('"')
+        if polished:
+            summary = dict(summary)
+            summary[field] = polished
+            polished_ok = True
+    except Exception as exc:
+        print(f"[WARN] Summary polish failed, keeping template text: {exc}")
+    finally:
+        elapsed = time.time() - start
+        input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
+        log_token_usage(
+            usage="agent5: summary polish",
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            runtime_seconds=elapsed,
+            details={"field": field},
+        )
+    return summary, polished_ok
+
+
+def _translate_summary(summary: Dict[str, Any], language: str) -> tuple[Dict[str, Any], bool]:
+    """
+    Translate a finished summary into `language` with one short call (no input data is resent).
+    Returns (summary, whether it was translated); the input summary is returned on failure.
+    """
+    prompt_suffix = f"""
+        Target language: {language}
+
+        Report:
+        {json.dumps(summary, ensure_ascii=False, separators=(",", ":"))}
+        """
+
+    response = None
+    translated_ok = False
+    start = time.time()
+    try:
+        response = get_context_cache().generate_content(
+            model=GENERATION_MODEL,
+            prefix=TRANSLATE_PROMPT_PREFIX,
+            suffix=prompt_suffix,
+            label="agent5-translate",
+        )
+        translated = _parse_llm_json(response.text or "")
+        if translated:
+            # Keep the source structure: missing or mistyped fields stay untranslated.
+            summary = {
+                field: translated[field] if isinstance(translated.get(field), type(value)) else value
+                for field, value in summary.items()
+            }
+            translated_ok = True
+    except Exception as exc:
+        print(f"[WARN] Summary translation to {language} failed: {exc}")
+    finally:
+        elapsed = time.time() - start
+        input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
+        log_token_usage(
+            usage="agent5: summary translation",
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            runtime_seconds=elapsed,
+            details={"language": language},
+        )
+    return summary, translated_ok
+
+
+def _summary_cache_key(
+    weaknesses: List[Weakness],
+    recommendations: List[CourseScore],
+    test_result: Optional[Dict[str, Any]],
+    history_result: Optional[Dict[str, Any]],
+    incorrect_summary: Optional[Dict[str, Any]],
+    participant_ranking: Optional[float],
+    domain_performance: Optional[Dict[str, Any]],
+    language: str,
+    min_score: float,
+    summary_mode: str,
+) -> str:
+    """
+    Canonical key over everything the summary depends on. Weakness ids are fresh per run, so
+    weaknesses are keyed by text and recommendations by (course id, weakness position, score).
+    The prompt text is part of the key so prompt edits never serve stale summaries.
+    """
+    position = {w.id: i for i, w in enumerate(weaknesses)}
+    return stable_hash(
+        [(normalize_text(w.text), round(float(w.importance), 4)) for w in weaknesses],
+        [(cs.course.id, position.get(cs.weakness_id), round(float(cs.score), 4)) for cs in recommendations],
+        strip_empty(test_result or {}),
+        strip_empty(history_result or {}),
+        strip_empty(incorrect_summary or {}),
+        participant_ranking,
+        strip_empty(domain_performance or {}),
+        language,
+        round(float(min_score), 4),
+        summary_mode,
+        GENERATION_MODEL,
+        stable_hash(SUMMARY_PROMPT_PREFIX, POLISH_PROMPT_PREFIX, TRANSLATE_PROMPT_PREFIX, SUMMARY_POLISH_FIELD),
+    )
+
+
+def _stream_summary(
+    prompt_suffix: str,
+    paragraph_stream: "_ParagraphStream",
+    language: Optional[str] = None,
+) -> tuple[str, Any]:
+    """
+    Stream the summary prompt; returns (full text, last chunk carrying usage metadata).
+    For a bilingual response (`language` set) the top-level members are per-language summaries
+    and the fields of `language` are emitted once its summary is complete.
+    """
+    parser = JsonObjectStreamParser()
+    usage_chunk = None
+    for chunk in get_context_cache().generate_content_stream(
+        model=GENERATION_MODEL,
+        prefix=SUMMARY_PROMPT_PREFIX,
+        suffix=prompt_suffix,
+        label="agent5-summary",
+    ):
+        if getattr(chunk, "usage_metadata", None) is not None:
+            usage_chunk = chunk
+        for field, value in parser.feed(getattr(chunk, "text", None) or ""):
+            if language is None:
+                paragraph_stream.add_field(field, value)
+            elif field == language and isinstance(value, dict):
+                for summary_field, summary_value in value.items():
+                    paragraph_stream.add_field(summary_field, summary_value)
+    return parser.text.strip(), usage_chunk
+
+
+class _ParagraphStream:
+    """Emit summary fields and, in paragraph order, the matching `user_facing_paragraph` parts."""
+
+    def __init__(self, on_event: Callable[[str, Dict[str, Any]], None]) -> None:
+        self.on_event = on_event
+        self.fields: Dict[str, Any] = {}
+        self.next_index = 0
+        self.emitted_text = False
+
+    def add_field(self, field: str, value: Any) -> None:
+        self.fields[field] = value
+        self.on_event("summary_field", {"field": field, "value": value})
+        # The course list is only final after score filtering and link annotation.
+        while self.next_index < len(_PARAGRAPH_FIELDS) - 1 and _PARAGRAPH_FIELDS[self.next_index] in self.fields:
+            field_name = _PARAGRAPH_FIELDS[self.next_index]
+            self._emit(_paragraph_part(field_name, self.fields[field_name]))
+            self.next_index += 1
+
+    def finish(self, summary: Dict[str, Any]) -> None:
+        for field_name in _PARAGRAPH_FIELDS[self.next_index:]:
+            self._emit(_paragraph_part(field_name, (summary or {}).get(field_name)))
+        self.next_index = len(_PARAGRAPH_FIELDS)
+
+    def _emit(self, part: str) -> None:
+        if not part:
+            return
+        self.on_event("paragraph_delta", {"text": (" " if self.emitted_text else "") + part})
+        self.emitted_text = True
 
 
 def _parse_llm_json(raw_text: str) -> Dict[str, Any]:
@@ -233,33 +724,36 @@ def _fallback_summary(
     lang = (language or "EN").strip().upper()
     current_perf_parts = []
     if test_result:
-        current_perf_parts.append(_summarize_test_result(test_result, incorrect_summary))
+        current_perf_parts.append(_summarize_test_result(test_result, incorrect_summary, lang))
     if history_result:
-        history_sentence = _summarize_history(history_result)
+        history_sentence = _summarize_history(history_result, lang)
         if history_sentence:
             current_perf_parts.append(history_sentence)
     if ranking_sentence:
         current_perf_parts.append(ranking_sentence)
 
-    current_perf = (
-        " ".join(p for p in current_perf_parts if p) or
+    default_perf = (
+        "เราได้ทบทวนผลการสอบล่าสุดของคุณและพบทักษะที่ควรได้รับการพัฒนาเพิ่มเติม."
+        if lang == "TH" else
         "We reviewed your recent performance and identified specific skills that would "
         "benefit from additional focus."
     )
+    current_perf = " ".join(p for p in current_perf_parts if p) or default_perf
 
     if weaknesses:
         weakness_titles = ", ".join(w.text for w in weaknesses[:3])
     else:
-        weakness_titles = "the assessed skills"
+        weakness_titles = "ทักษะที่ประเมิน" if lang == "TH" else "the assessed skills"
 
+    weakness_text = {w.id: w.text for w in weaknesses}
     rec_sentences = [
-        f"{cs.course.lesson_title} targets weakness {cs.weakness_id}."
+        _course_sentence(cs.course.lesson_title, weakness_text.get(cs.weakness_id) or cs.weakness_id, lang)
         for cs in recommendations
     ]
     if not rec_sentences:
-        rec_sentences = ["No course recommendations were generated."]
+        rec_sentences = ["ไม่มีคอร์สแนะนำสำหรับครั้งนี้." if lang == "TH" else "No course recommendations were generated."]
 
-    domain_comparison = _domain_improvement_summaries(domain_performance)
+    domain_comparison = _domain_improvement_summaries(domain_performance, lang)
 
     area_text = (
         f"Priority focus areas include {weakness_titles}. Strengthening these abilities "
@@ -313,68 +807,87 @@ def _congrats_summary(
 def _summarize_test_result(
     test_result: Dict[str, Any],
     incorrect_summary: Optional[Dict[str, Any]] = None,
+    language: str = "EN",
 ) -> str:
-    title = test_result.get("testTitle") or "this test"
+    th = (language or "EN").strip().upper() == "TH"
+    title = test_result.get("testTitle") or ("แบบทดสอบนี้" if th else "this test")
     attempt = _to_int(test_result.get("attemptNumber"))
     total_attempts = _to_int(test_result.get("totalAttempts"))
     attempt_clause = ""
     if attempt:
         if total_attempts and total_attempts >= attempt:
-            attempt_clause = f" (attempt {attempt} of {total_attempts})"
+            attempt_clause = f" (ครั้งที่ {attempt} จาก {total_attempts})" if th else f" (attempt {attempt} of {total_attempts})"
         else:
-            attempt_clause = f" (attempt {attempt})"
+            attempt_clause = f" (ครั้งที่ {attempt})" if th else f" (attempt {attempt})"
 
     score = _to_int(test_result.get("earnedScore"))
     total_score = _to_int(test_result.get("totalScore"))
     status = test_result.get("status")
 
     score_clause = None
+    scored = "ได้คะแนน" if th else "scored"
     if score is not None and total_score:
         percent = (score / total_score) * 100
-        score_clause = f"scored {score}/{total_score} ({percent:.0f}%)"
+        score_clause = f"{scored} {score}/{total_score} ({percent:.0f}%)"
     elif score is not None:
-        score_clause = f"scored {score}"
+        score_clause = f"{scored} {score}"
 
-    parts: List[str] = [f"In {title}{attempt_clause}"]
+    parts: List[str] = [f"ในแบบทดสอบ {title}{attempt_clause}" if th else f"In {title}{attempt_clause}"]
     if score_clause:
         parts.append(score_clause)
     if status:
-        parts.append(f"status: {status}")
+        parts.append(f"สถานะ: {status}" if th else f"status: {status}")
 
     if incorrect_summary:
         total_q = _to_int(incorrect_summary.get("total_questions_in_test"))
         incorrect_q = _to_int(incorrect_summary.get("total_incorrect_questions"))
         if total_q:
             if incorrect_q is None:
-                parts.append(f"{total_q} questions assessed.")
+                parts.append(f"ประเมินทั้งหมด {total_q} ข้อ." if th else f"{total_q} questions assessed.")
             else:
                 accuracy = None
                 if incorrect_q is not None:
                     accuracy = (max(total_q - incorrect_q, 0) / total_q) * 100
-                parts.append(
-                    f"{total_q} questions with {incorrect_q} incorrect"
-                    + (f" ({accuracy:.0f}% correct)" if accuracy is not None else "")
-                )
+                if th:
+                    parts.append(
+                        f"ทั้งหมด {total_q} ข้อ ตอบผิด {incorrect_q} ข้อ"
+                        + (f" (ถูก {accuracy:.0f}%)" if accuracy is not None else "")
+                    )
+                else:
+                    parts.append(
+                        f"{total_q} questions with {incorrect_q} incorrect"
+                        + (f" ({accuracy:.0f}% correct)" if accuracy is not None else "")
+                    )
 
     return "; ".join(parts) + "."
 
 
-def _summarize_history(history_result: Dict[str, Any]) -> str:
+def _summarize_history(history_result: Dict[str, Any], language: str = "EN") -> str:
+    th = (language or "EN").strip().upper() == "TH"
     attempt = _to_int(history_result.get("attemptNumber"))
     score = _to_int(history_result.get("earnedScore"))
     total_score = _to_int(history_result.get("totalScore"))
 
     if score is None or total_score is None:
         if attempt:
-            return f"Previous attempt {attempt} is on record."
+            return f"มีผลการสอบครั้งที่ {attempt} ก่อนหน้านี้ในระบบ." if th else f"Previous attempt {attempt} is on record."
         return ""
 
     percent = (score / total_score) * 100 if total_score else None
-    attempt_text = f"attempt {attempt} " if attempt else ""
     percent_text = f" ({percent:.0f}%)" if percent is not None else ""
+    if th:
+        attempt_text = f" (ครั้งที่ {attempt})" if attempt else ""
+        return f"การสอบครั้งก่อน{attempt_text} ได้คะแนน {score}/{total_score}{percent_text}."
+    attempt_text = f"attempt {attempt} " if attempt else ""
     return f"Previous {attempt_text}scored {score}/{total_score}{percent_text}."
 
 
+def _course_sentence(course_title: str, weakness: str, language: str = "EN") -> str:
+    if (language or "EN").strip().upper() == "TH":
+        return f'{course_title} ช่วยพัฒนาจุดที่ควรปรับปรุง "{weakness}".'
+    return f'{course_title} targets the weakness "{weakness}".'
+
+
 def _to_int(value: Any) -> Optional[int]:
     try:
         return int(value)
@@ -382,11 +895,13 @@ def _to_int(value: Any) -> Optional[int]:
         return None
 
 
-def _ranking_sentence(participant_ranking: Optional[float]) -> str:
+def _ranking_sentence(participant_ranking: Optional[float], language: str = "EN") -> str:
     if participant_ranking is None:
         return ""
     try:
         pct = participant_ranking * 100 if participant_ranking <= 1 else participant_ranking
+        if (language or "EN").strip().upper() == "TH":
+            return f"อยู่ในกลุ่ม {pct:.1f}% แรกของผู้เข้าสอบ."
         return f"Ranked within the top {pct:.1f}% of participants."
     except Exception:
         return ""
@@ -403,7 +918,8 @@ def _ranking_value_for_prompt(participant_ranking: Optional[float]) -> str:
 
 
 def _domain_improvement_summaries(
-    domain_performance: Optional[Dict[str, Any]]
+    domain_performance: Optional[Dict[str, Any]],
+    language: str = "EN",
 ) -> List[str]:
     if not domain_performance:
         return []
@@ -424,6 +940,12 @@ def _domain_improvement_summaries(
         if curr_acc is None or hist_acc is None:
             continue
         delta = (curr_acc - hist_acc) * 100
+        if (language or "EN").strip().upper() == "TH":
+            direction = "ดีขึ้น" if delta >= 0 else "ลดลง"
+            summaries.append(
+                f"{domain}: {direction} {delta:+.1f}% (จาก {hist_acc*100:.1f}% เป็น {curr_acc*100:.1f}%)"
+            )
+            continue
         direction = "Improved" if delta >= 0 else "Declined"
         summaries.append(
             f"{domain}: {direction} by {delta:+.1f}% (from {hist_acc*100:.1f}% to {curr_acc*100:.1f}%)"
@@ -468,28 +990,31 @@ def _summary_to_paragraph(summary: Dict[str, Any], rec_list: List[Dict[str, Any]
     if not summary:
         return ""
 
-    title = summary.get("Test Title") or ""
-    perf = summary.get("Current Performance") or ""
-    area = summary.get("Area to be Improved") or ""
-    domain_cmp = summary.get("Domain Comparison") or []
-    progress = summary.get("Progress Compared to Previous Test") or ""
-    recs = summary.get("Recommended Course") or []
-
-    parts: List[str] = []
-    if title:
-        parts.append(f"[{title}]")
-    if perf:
-        parts.append(perf)
-    if area:
-        parts.append(area)
-    if progress:
-        parts.append(progress)
-    if domain_cmp:
-        parts.append("Domain notes: " + "; ".join(domain_cmp))
-    if recs:
-        parts.append("Recommended courses: " + "; ".join(recs))
-
-    return " ".join(parts).strip()
+    parts = [_paragraph_part(field, summary.get(field)) for field in _PARAGRAPH_FIELDS]
+    return " ".join(part for part in parts if part).strip()
+
+
+# Summary fields in the order they appear in `user_facing_paragraph`.
+_PARAGRAPH_FIELDS = (
+    "Test Title",
+    "Current Performance",
+    "Area to be Improved",
+    "Progress Compared to Previous Test",
+    "Domain Comparison",
+    "Recommended Course",
+)
+
+
+def _paragraph_part(field: str, value: Any) -> str:
+    if not value:
+        return ""
+    if field == "Test Title":
+        return f"[{value}]"
+    if field == "Domain Comparison":
+        return "Domain notes: " + "; ".join(value)
+    if field == "Recommended Course":
+        return "Recommended courses: " + "; ".join(value)
+    return str(value)
 
 
 def _append_links_to_summary(summary: Dict[str, Any], rec_list: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -544,12 +1069,16 @@ def _filter_recommendations_by_score(
 def _progress_heading(
     test_result: Optional[Dict[str, Any]],
     history_result: Optional[Dict[str, Any]],
+    language: str = "EN",
 ) -> str:
     if not history_result:
         return ""
+    th = (language or "EN").strip().upper() == "TH"
     title = _test_title(test_result, history_result)
     if not title:
-        title = "previous test"
+        title = "การสอบครั้งก่อน" if th else "previous test"
+    if th:
+        return f"ความก้าวหน้าเมื่อเทียบกับการสอบครั้งก่อน ({title}):"
     return f"Progress Compared to Previous Test ({title}):"
 
 
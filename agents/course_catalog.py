@@ -0,0 +1,187 @@
+# agents/course_catalog.py
+"""
+Resident course catalog shared by the online agents.
+
+`course.csv` is parsed once into compact slotted records (repeated strings interned so
+categories, levels and skills share storage) plus an index by id. The long free-text
+columns (`description`, `content_title`) are kept out of the records and only read from
+disk the first time a prompt actually needs them. A BM25 index over the title, skill and
+description columns is built during the same load pass. The catalog reloads itself when
+the CSV changes on disk.
+"""
+from __future__ import annotations
+
+import csv
+import hashlib
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from agents.lexical_index import BM25Index
+from config import COURSE_CSV_PATH, COURSE_CATALOG_REFRESH_SECONDS
+
+LONG_TEXT_FIELDS = ("description", "content_title")
+
+
+class CourseRecord:
+    """Compact per-course record holding only the short columns used on the hot path."""
+
+    __slots__ = (
+        "id",
+        "lesson_title",
+        "skill_name",
+        "level",
+        "category_name",
+        "sub_category",
+        "short_description",
+        "university",
+        "link",
+        "status",
+    )
+
+    def __init__(self, **fields: str) -> None:
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name) or "")
+
+    def to_metadata(self) -> Dict[str, Any]:
+        """Small metadata dict for `Course.metadata` (no long text columns)."""
+        return {
+            "skill_name": self.skill_name,
+            "level": self.level,
+            "category_name": self.category_name,
+            "subCatName": self.sub_category,
+            "university": self.university,
+            "status": self.status,
+        }
+
+
+class CourseCatalog:
+    """Immutable snapshot of the course CSV: compact records, BM25 index, lazy long-text lookup."""
+
+    def __init__(
+        self,
+        csv_path: Path,
+        records: Dict[str, CourseRecord],
+        version: str,
+        lexical_index: BM25Index,
+    ) -> None:
+        self.csv_path = csv_path
+        self.version = version
+        self.lexical_index = lexical_index
+        self._records = records
+        self._long_text: Optional[Dict[str, Dict[str, str]]] = None
+        self._long_text_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[CourseRecord]:
+        return iter(self._records.values())
+
+    def get(self, course_id: str) -> Optional[CourseRecord]:
+        return self._records.get(course_id)
+
+    def ids(self) -> List[str]:
+        return list(self._records.keys())
+
+    def get_long_text(self, course_id: str, field: str = "description") -> str:
+        """Return a long text column, reading all long columns from disk on first use."""
+        if field not in LONG_TEXT_FIELDS:
+            raise KeyError(f"Unknown long text field: {field}")
+        return self._load_long_text().get(course_id, {}).get(field, "")
+
+    def _load_long_text(self) -> Dict[str, Dict[str, str]]:
+        with self._long_text_lock:
+            if self._long_text is None:
+                self._long_text = {
+                    course_id: {field: row.get(field) or "" for field in LONG_TEXT_FIELDS}
+                    for course_id, row in _iter_csv_rows(self.csv_path)
+                }
+            return self._long_text
+
+
+_catalog: Optional[CourseCatalog] = None
+_catalog_lock = threading.Lock()
+_last_checked = 0.0
+
+
+def get_course_catalog(force_refresh: bool = False) -> CourseCatalog:
+    """
+    Return the resident catalog, reloading it if the CSV changed since the last load.
+    The file is stat'ed at most once every COURSE_CATALOG_REFRESH_SECONDS.
+    """
+    global _catalog, _last_checked
+    with _catalog_lock:
+        now = time.monotonic()
+        if (
+            _catalog is not None
+            and not force_refresh
+            and now - _last_checked < COURSE_CATALOG_REFRESH_SECONDS
+        ):
+            return _catalog
+        _last_checked = now
+        version = _file_version(COURSE_CSV_PATH)
+        if _catalog is None or force_refresh or _catalog.version != version:
+            _catalog = _load_catalog(COURSE_CSV_PATH, version)
+            print(f"[Catalog] Loaded {len(_catalog)} courses (version {version}).")
+        return _catalog
+
+
+def _load_catalog(csv_path: Path, version: str) -> CourseCatalog:
+    records: Dict[str, CourseRecord] = {}
+    lexical_index = BM25Index()
+    for course_id, row in _iter_csv_rows(csv_path):
+        # Long description text is tokenized here but not retained on the record.
+        lexical_index.add(
+            course_id,
+            [
+                (row.get("lesson_title") or "", 3),
+                (row.get("skill_name") or "", 2),
+                (row.get("short_description") or "", 1),
+                (row.get("description") or "", 1),
+            ],
+        )
+        records[course_id] = CourseRecord(
+            id=course_id,
+            lesson_title=row.get("lesson_title") or "Untitled course",
+            skill_name=_intern(row.get("skill_name")),
+            level=_intern(row.get("level")),
+            category_name=_intern(row.get("category_name")),
+            sub_category=_intern(row.get("subCatName")),
+            short_description=row.get("short_description"),
+            university=_intern(row.get("university")),
+            link=row.get("link") or row.get("course_url"),
+            status=_intern(row.get("status")),
+        )
+    return CourseCatalog(
+        csv_path=csv_path,
+        records=records,
+        version=version,
+        lexical_index=lexical_index.finalize(),
+    )
+
+
+def _iter_csv_rows(csv_path: Path) -> Iterator[tuple[str, Dict[str, str]]]:
+    if not csv_path.exists():
+        raise FileNotFoundError(f"Course CSV not found at {csv_path}")
+    with csv_path.open("r", encoding="utf-8") as handle:
+        reader = csv.DictReader(handle)
+        for row in reader:
+            course_id = row.get("id")
+            if not course_id:
+                continue
+            yield course_id, row
+
+
+def _file_version(csv_path: Path) -> str:
+    if not csv_path.exists():
+        raise FileNotFoundError(f"Course CSV not found at {csv_path}")
+    stat = csv_path.stat()
+    raw = f"{csv_path.resolve()}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def _intern(value: Optional[str]) -> str:
+    return sys.intern(value) if value else ""
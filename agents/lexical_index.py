@@ -0,0 +1,86 @@
+# agents/lexical_index.py
+"""
+In-process BM25 inverted index over the course catalog.
+Built once per catalog load; answers keyword queries ("SQL joins", "passive voice")
+in microseconds without a network round trip.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from config import BM25_K1, BM25_B
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it of on or that the this to with "
+    "how what when why your you their they not no".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords or single characters."""
+    return [
+        tok
+        for tok in _TOKEN_RE.findall((text or "").lower())
+        if len(tok) > 1 and tok not in _STOPWORDS
+    ]
+
+
+class BM25Index:
+    """Okapi BM25 over pre-tokenized documents; postings are kept as (doc_idx, tf) lists."""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B) -> None:
+        self.k1 = k1
+        self.b = b
+        self._doc_ids: List[str] = []
+        self._doc_len: List[int] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._idf: Dict[str, float] = {}
+        self._avg_len = 0.0
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def add(self, doc_id: str, fields: Iterable[Tuple[str, int]]) -> None:
+        """Add a document from (text, weight) pairs; weight repeats a field's term counts."""
+        counts: Dict[str, int] = {}
+        length = 0
+        for text, weight in fields:
+            for tok in tokenize(text):
+                counts[tok] = counts.get(tok, 0) + weight
+                length += weight
+        doc_idx = len(self._doc_ids)
+        self._doc_ids.append(doc_id)
+        self._doc_len.append(length)
+        for tok, tf in counts.items():
+            self._postings.setdefault(tok, []).append((doc_idx, tf))
+
+    def finalize(self) -> "BM25Index":
+        """Compute idf and average length once all documents are added."""
+        n_docs = len(self._doc_ids)
+        self._avg_len = (sum(self._doc_len) / n_docs) if n_docs else 0.0
+        self._idf = {
+            tok: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for tok, postings in self._postings.items()
+        }
+        return self
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        """Return up to `limit` (doc_id, bm25_score) pairs, best first."""
+        if not self._doc_ids or limit <= 0:
+            return []
+        scores: Dict[int, float] = {}
+        avg_len = self._avg_len or 1.0
+        for tok in set(tokenize(query)):
+            postings = self._postings.get(tok)
+            if not postings:
+                continue
+            idf = self._idf[tok]
+            for doc_idx, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_idx] / avg_len)
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self._doc_ids[doc_idx], score) for doc_idx, score in top]
@@ -0,0 +1,241 @@
+# agents/question_diagnosis.py
+"""
+Per-question diagnosis memo for Agent 3.
+
+A diagnosis explains why a student picks a particular wrong answer to a particular question.
+It depends only on (questionId, wrong-answer set), not on the student, so popular questions are
+diagnosed once and reused. Diagnoses can be precomputed offline in bulk over Question.csv /
+Answer.csv (see `build_diagnosis_store`); online, only never-seen cases are sent to Gemini and the
+cached diagnoses are aggregated locally into the Agent 3 weakness format.
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from config import (
+    client,
+    GENERATION_MODEL,
+    CACHE_DIR,
+    QUESTION_PATH,
+    ANSWER_PATH,
+    DIAGNOSIS_STORE_TTL_SECONDS,
+    DIAGNOSIS_STORE_MAX_ENTRIES,
+    DIAGNOSIS_BATCH_SIZE,
+)
+from pipeline.cache import TTLCache, normalize_text, stable_hash
+from pipeline.prompt_builder import compact_json
+from pipeline.run_logging import log_token_usage, extract_token_counts
+
+_diagnosis_store = TTLCache(
+    name="question_diagnosis",
+    maxsize=DIAGNOSIS_STORE_MAX_ENTRIES,
+    ttl_seconds=DIAGNOSIS_STORE_TTL_SECONDS,
+    disk_dir=CACHE_DIR / "question_diagnosis",
+)
+
+
+def diagnosis_key(question_id: Any, wrong_answers: List[Any], model_name: str = GENERATION_MODEL) -> str:
+    return f"{question_id}:{stable_hash(sorted(str(a) for a in wrong_answers), model_name)}"
+
+
+def wrong_answers_for_case(case: Dict[str, Any]) -> List[Any]:
+    """Student answers that are not among the correct answers (the set that drives the diagnosis)."""
+    correct = {str(a) for a in case.get("correctAnswers") or []}
+    return sorted({str(a) for a in case.get("studentAnswers") or [] if str(a) not in correct})
+
+
+def diagnose_cases(
+    incorrect_cases: List[Dict[str, Any]],
+    model_name: str = GENERATION_MODEL,
+    usage: str = "agent3: question diagnosis",
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Return {questionId: diagnosis} for every case, calling Gemini only for cases whose
+    (questionId, wrong-answer set) has never been diagnosed.
+    """
+    diagnoses: Dict[str, Dict[str, Any]] = {}
+    unseen: List[Dict[str, Any]] = []
+    for case in incorrect_cases:
+        qid = str(case.get("questionId"))
+        hit = _diagnosis_store.get(diagnosis_key(qid, wrong_answers_for_case(case), model_name))
+        if hit is not None:
+            diagnoses[qid] = hit
+        else:
+            unseen.append(case)
+
+    print(f"[Diagnosis] {len(diagnoses)} cached, {len(unseen)} new cases.")
+    for start in range(0, len(unseen), DIAGNOSIS_BATCH_SIZE):
+        batch = unseen[start:start + DIAGNOSIS_BATCH_SIZE]
+        diagnoses.update(_diagnose_with_llm(batch, model_name, usage))
+    return diagnoses
+
+
+def undiagnosed_cases(
+    incorrect_cases: List[Dict[str, Any]],
+    diagnoses: Dict[str, Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """Cases without a usable diagnosis (e.g. their diagnosis batch failed)."""
+    return [
+        case for case in incorrect_cases
+        if not (diagnoses.get(str(case.get("questionId"))) or {}).get("weakness")
+    ]
+
+
+def aggregate_diagnoses(
+    incorrect_cases: List[Dict[str, Any]],
+    diagnoses: Dict[str, Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Group per-question diagnoses by weakness name into the Agent 3 output shape.
+    Cases without a diagnosis are left out; check `undiagnosed_cases` first.
+    """
+    grouped: Dict[str, Dict[str, Any]] = {}
+    for case in incorrect_cases:
+        qid = str(case.get("questionId"))
+        diagnosis = diagnoses.get(qid)
+        if not diagnosis or not diagnosis.get("weakness"):
+            continue
+        key = normalize_text(diagnosis["weakness"])
+        entry = grouped.get(key)
+        if entry is None:
+            entry = grouped[key] = {
+                "weakness": diagnosis["weakness"],
+                "pattern_type": diagnosis.get("pattern_type") or "other",
+                "description": diagnosis.get("description") or "",
+                "evidence_question_ids": [],
+                "frequency": 0,
+            }
+        entry["evidence_question_ids"].append(case.get("questionId"))
+        entry["frequency"] += 1
+    return sorted(grouped.values(), key=lambda w: w["frequency"], reverse=True)
+
+
+def _diagnose_with_llm(
+    cases: List[Dict[str, Any]],
+    model_name: str,
+    usage: str,
+) -> Dict[str, Dict[str, Any]]:
+    # Cases are aliased c1..cN so two wrong choices of the same question map back unambiguously.
+    payload = [
+        {
+            "caseId": f"c{i}",
+            "questionText": case.get("questionText"),
+            "explanation": case.get("explanation"),
+            "wrongAnswers": wrong_answers_for_case(case),
+            "correctAnswers": case.get("correctAnswers"),
+        }
+        for i, case in enumerate(cases, start=1)
+    ]
+    prompt = f"""
+        You are a diagnostic engine for assessment tests across many domains.
+
+        For EACH case below, the student chose the listed wrong answer(s) to the question.
+        Diagnose the specific, reusable weakness that explains the choice
+        (not just "Grammar" or "Math"). Use the SAME weakness name for questions
+        that share the same underlying pattern.
+
+        Output format (JSON ONLY, one object per case):
+        [
+        {{
+            "caseId": "<caseId>",
+            "weakness": "short name (1 sentence max, specific to the pattern)",
+            "pattern_type": "language | numeracy | logical_reasoning | reading_comprehension | domain_knowledge | test_strategy | other",
+            "description": "1–2 sentences explaining why this error happens."
+        }}
+        ]
+
+        Cases:
+        {compact_json(payload)}
+        """
+
+    response = None
+    start = time.time()
+    try:
+        response = client.models.generate_content(
+            model=model_name,
+            contents=[{"parts": [{"text": prompt}]}],
+        )
+        raw = (response.text or "").replace("```json", "").replace("```", "").strip()
+        items = json.loads(raw)
+    except Exception as exc:
+        print(f"[WARN] Question diagnosis failed for {len(cases)} cases: {exc}")
+        return {}
+    finally:
+        elapsed = time.time() - start
+        input_tokens, output_tokens = extract_token_counts(response) if response else (None, None)
+        log_token_usage(
+            usage=usage,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            runtime_seconds=elapsed,
+            details={"cases": len(cases)},
+        )
+
+    by_alias = {f"c{i}": case for i, case in enumerate(cases, start=1)}
+    diagnoses: Dict[str, Dict[str, Any]] = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        case = by_alias.get(str(item.get("caseId")))
+        if case is None or not item.get("weakness"):
+            continue
+        qid = str(case.get("questionId"))
+        diagnosis = {
+            "weakness": item["weakness"],
+            "pattern_type": item.get("pattern_type") or "other",
+            "description": item.get("description") or "",
+        }
+        _diagnosis_store.set(diagnosis_key(qid, wrong_answers_for_case(case), model_name), diagnosis)
+        diagnoses[qid] = diagnosis
+    return diagnoses
+
+
+def build_diagnosis_store(
+    question_path: str = QUESTION_PATH,
+    answer_path: str = ANSWER_PATH,
+    model_name: str = GENERATION_MODEL,
+    limit: Optional[int] = None,
+) -> int:
+    """
+    Offline bulk build: diagnose every (question, single wrong choice) pair in the question bank
+    that is not already in the store. Returns the number of new diagnoses written.
+    """
+    df_q = pd.read_csv(question_path)
+    df_a = pd.read_csv(answer_path)
+    correct_lookup = df_a[df_a["isCorrect"] == True].groupby("questionId")["value"].apply(list).to_dict()
+
+    cases: List[Dict[str, Any]] = []
+    questions = df_q.set_index("id")
+    for _, answer in df_a[df_a["isCorrect"] != True].iterrows():
+        qid = answer["questionId"]
+        if qid not in questions.index:
+            continue
+        case = {
+            "questionId": qid,
+            "questionText": questions.at[qid, "question"],
+            "explanation": questions.at[qid, "explanation"] if "explanation" in questions.columns else None,
+            "studentAnswers": [answer["value"]],
+            "correctAnswers": correct_lookup.get(qid, []),
+        }
+        if _diagnosis_store.get(diagnosis_key(qid, wrong_answers_for_case(case), model_name)) is None:
+            cases.append(case)
+        if limit is not None and len(cases) >= limit:
+            break
+
+    written = 0
+    for start in range(0, len(cases), DIAGNOSIS_BATCH_SIZE):
+        batch = cases[start:start + DIAGNOSIS_BATCH_SIZE]
+        before = _diagnosis_store.get_stats()["sets"]
+        _diagnose_with_llm(batch, model_name, "offline: question diagnosis")
+        written += _diagnosis_store.get_stats()["sets"] - before
+        print(f"[Diagnosis] {written} diagnoses written...")
+    return written
+
+
+if __name__ == "__main__":
+    total = build_diagnosis_store()
+    print(f"Diagnosis store build complete: {total} new diagnoses.")
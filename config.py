@@ -7,13 +7,23 @@ from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 from pathlib import Path
 
+from pipeline.model_governor import govern_client
+
 load_dotenv()
 
 MAX_COURSES = 5
 PARTICIPANT_RANKING: Optional[float] = None  # Fractional ranking (0.317 => top 31.7%). Optional.
 DEFAULT_LANGUAGE = "EN"  # Output language for final summary (EN or TH)
-COURSE_RERANK_ENABLED = True  # Optional LLM reranking after vector search (set True to enable)
+COURSE_RERANK_ENABLED = True  # Optional LLM reranking after vector search (True, False or "auto")
 MIN_RECOMMENDATION_SCORE = float(os.getenv("MIN_RECOMMENDATION_SCORE", 0.5))
+# Agent 5 summary: llm (one Gemini call) | template (local, no LLM) | hybrid (template + one polished field)
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "llm")
+SUMMARY_POLISH_FIELD = os.getenv("SUMMARY_POLISH_FIELD", "Current Performance")
+SUMMARY_LANGUAGES = ("EN", "TH")
+# Alternate-language summary stored with each run: off | bilingual (both languages from one call) | translate
+SUMMARY_ALT_LANGUAGE_MODE = os.getenv("SUMMARY_ALT_LANGUAGE_MODE", "off")
+# Stream agent 3 output and start agent 4 retrieval for each weakness as soon as it is parsed
+PIPELINE_STREAMING = os.getenv("PIPELINE_STREAMING", "false").lower() == "true"
 
 # ==== CSV PATHS ====
 dataset = "_data/exam_result"
@@ -51,7 +61,8 @@ GENERATION_MODEL = "gemini-2.5-flash"
 API_KEY = os.getenv("GOOGLE_API_KEY")
 if not API_KEY:
     raise RuntimeError("GOOGLE_API_KEY is missing!")
-client = genai.Client(api_key=API_KEY)
+# Generation and embedding calls made through this client are paced by the model governor.
+client = govern_client(genai.Client(api_key=API_KEY))
 
 # Default model names
 DEFAULT_EMBEDDING_MODEL = "text-embedding-004"
@@ -95,6 +106,8 @@ OUTPUT_DIR = Path("_data") / "bigdata_query"
 
 # Local course CSV used for prototyping RAG flows.
 COURSE_CSV_PATH = Path("_data") / "courses" / "course.csv"
+# How often the resident course catalog re-checks course.csv for changes.
+COURSE_CATALOG_REFRESH_SECONDS = float(os.getenv("COURSE_CATALOG_REFRESH_SECONDS", 60))
 
 # Vertex AI defaults
 DEFAULT_LOCATION = "asia-southeast1"
@@ -110,6 +123,140 @@ GCS_VECTOR_PREFIX = "vectors/courses"
 DEFAULT_SHARD_SIZE = 100  # documents per JSONL shard
 BATCH_SIZE = 32  # embedding batch size
 
+# Cross-request micro-batching for online embedding calls (0 ms window disables coalescing)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", 15))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", 100))  # embed_content accepts up to 100 texts
+
+# Cross-request micro-batching for Matching Engine find_neighbors queries
+VECTOR_SEARCH_BATCH_WINDOW_MS = float(os.getenv("VECTOR_SEARCH_BATCH_WINDOW_MS", 15))
+VECTOR_SEARCH_BATCH_MAX_QUERIES = int(os.getenv("VECTOR_SEARCH_BATCH_MAX_QUERIES", 64))
+
+# Both micro-batchers: a batch-class call queued this long then ranks as interactive
+MICRO_BATCH_AGING_SECONDS = float(os.getenv("MICRO_BATCH_AGING_SECONDS", 2))
+
+# Model-call governor: per-model quotas shared by all agents (rpm/tpm 0 = unlimited)
+MODEL_GOVERNOR_ENABLED = os.getenv("MODEL_GOVERNOR_ENABLED", "true").lower() == "true"
+MODEL_DEFAULT_LIMITS = {
+    "rpm": int(os.getenv("MODEL_DEFAULT_RPM", 0)),
+    "tpm": int(os.getenv("MODEL_DEFAULT_TPM", 0)),
+    "max_concurrent": int(os.getenv("MODEL_DEFAULT_MAX_CONCURRENT", 16)),
+}
+MODEL_LIMITS = {
+    GENERATION_MODEL: {
+        "rpm": int(os.getenv("GEMINI_RPM", 1_000)),
+        "tpm": int(os.getenv("GEMINI_TPM", 1_000_000)),
+        "max_concurrent": int(os.getenv("GEMINI_MAX_CONCURRENT", 32)),
+    },
+    EMBEDDING_MODEL_NAME: {
+        "rpm": int(os.getenv("EMBEDDING_RPM", 1_500)),
+        "tpm": int(os.getenv("EMBEDDING_TPM", 1_000_000)),
+        "max_concurrent": int(os.getenv("EMBEDDING_MAX_CONCURRENT", 16)),
+    },
+}
+# Waiting interactive calls are always granted first; a batch call waiting this long competes as
+# interactive so it cannot starve (0 = never, batch calls then time out after MAX_WAIT_SECONDS)
+MODEL_GOVERNOR_BATCH_AGING_SECONDS = float(os.getenv("MODEL_GOVERNOR_BATCH_AGING_SECONDS", 30))
+MODEL_GOVERNOR_MAX_WAIT_SECONDS = float(os.getenv("MODEL_GOVERNOR_MAX_WAIT_SECONDS", 60))
+MODEL_GOVERNOR_RATE_LIMIT_PAUSE_SECONDS = float(os.getenv("MODEL_GOVERNOR_RATE_LIMIT_PAUSE_SECONDS", 5))
+MODEL_GOVERNOR_OUTPUT_TOKENS = int(os.getenv("MODEL_GOVERNOR_OUTPUT_TOKENS", 512))  # reserved per generation call
+
+# Final course selection (agent 4)
+MIN_COURSES_PER_WEAKNESS = int(os.getenv("MIN_COURSES_PER_WEAKNESS", 1))  # guaranteed picks per weakness
+MAX_COURSES_PER_WEAKNESS = int(os.getenv("MAX_COURSES_PER_WEAKNESS", 0))  # 0 = no per-weakness cap
+COURSE_SELECTION_DIVERSITY = os.getenv("COURSE_SELECTION_DIVERSITY", "none")  # none | mmr
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))  # 1.0 = pure relevance, 0.0 = pure diversity
+
+# Course retrieval (agent 4): vector | hybrid (BM25 + vector, RRF-fused) | lexical (BM25 only)
+# hybrid scores are scaled RRF values, so re-tune MIN_RECOMMENDATION_SCORE before opting in
+COURSE_RETRIEVAL_MODE = os.getenv("COURSE_RETRIEVAL_MODE", "vector")
+VECTOR_SEARCH_TIMEOUT_SECONDS = float(os.getenv("VECTOR_SEARCH_TIMEOUT_SECONDS", 8))  # hybrid only: then fall back to lexical
+RRF_K = 60  # reciprocal-rank-fusion damping constant
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_SCORE_PIVOT = 4.0  # BM25 score mapped to 0.5 when converting lexical hits to [0, 1]
+
+# LLM rerank (agent 4): batched = one call for all weaknesses | per_weakness = one call each
+RERANK_MODE = os.getenv("RERANK_MODE", "batched")
+RERANK_MAX_CONCURRENCY = int(os.getenv("RERANK_MAX_CONCURRENCY", 4))  # parallel per-weakness rerank calls
+RERANK_DEADLINE_SECONDS = float(os.getenv("RERANK_DEADLINE_SECONDS", 20))  # overall budget for those calls
+# rerank_courses="auto": only rerank weaknesses whose vector ranking is ambiguous
+RERANK_AUTO_MARGIN = float(os.getenv("RERANK_AUTO_MARGIN", 0.03))  # top-1 vs top-2 score gap
+RERANK_AUTO_THRESHOLD_BAND = float(os.getenv("RERANK_AUTO_THRESHOLD_BAND", 0.05))  # |top - min_score|
+
+# ==== Caches ====
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "_cache"))  # root for optional on-disk cache tiers
+RERANK_CACHE_TTL_SECONDS = float(os.getenv("RERANK_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", 50_000))
+RERANK_CACHE_DISK_ENABLED = os.getenv("RERANK_CACHE_DISK_ENABLED", "false").lower() == "true"
+WEAKNESS_CACHE_TTL_SECONDS = float(os.getenv("WEAKNESS_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+WEAKNESS_CACHE_MAX_ENTRIES = int(os.getenv("WEAKNESS_CACHE_MAX_ENTRIES", 5_000))
+WEAKNESS_CACHE_DISK_ENABLED = os.getenv("WEAKNESS_CACHE_DISK_ENABLED", "false").lower() == "true"  # opt-in: persists student-derived output under CACHE_DIR
+SUMMARY_CACHE_TTL_SECONDS = float(os.getenv("SUMMARY_CACHE_TTL_SECONDS", 24 * 3600))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", 10_000))
+SUMMARY_CACHE_DISK_ENABLED = os.getenv("SUMMARY_CACHE_DISK_ENABLED", "false").lower() == "true"
+
+# Whole-report cache: per exam attempt + request parameters + course catalog version
+REPORT_CACHE_ENABLED = os.getenv("REPORT_CACHE_ENABLED", "true").lower() == "true"
+REPORT_CACHE_TTL_SECONDS = float(os.getenv("REPORT_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", 10_000))
+# API: responses of finished requests replayed by correlation id
+COMPLETED_REQUEST_TTL_SECONDS = float(os.getenv("COMPLETED_REQUEST_TTL_SECONDS", 3600))
+COMPLETED_REQUEST_MAX_ENTRIES = int(os.getenv("COMPLETED_REQUEST_MAX_ENTRIES", 5_000))
+# API: asynchronous pipeline jobs (bounded worker pool + queue)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", 100))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 3600))
+JOB_MAX_RETAINED = int(os.getenv("JOB_MAX_RETAINED", 1_000))
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", 10))
+JOB_CALLBACK_RETRIES = int(os.getenv("JOB_CALLBACK_RETRIES", 3))
+JOB_ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("JOB_ADMISSION_MAX_WAIT_SECONDS", 900))  # jobs queue behind interactive runs
+JOB_CALLBACK_WORKERS = int(os.getenv("JOB_CALLBACK_WORKERS", 2))  # callbacks are sent off the job workers
+# Hosts callback_url may point at (comma-separated; "*.example.com" matches subdomains). Empty = callbacks disabled.
+JOB_CALLBACK_ALLOWED_HOSTS = tuple(
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
+# API admission control per endpoint: concurrent pipelines, waiting requests, max wait before 429
+ADMISSION_LIMITS = {
+    "sync": {
+        "max_concurrent": int(os.getenv("ADMISSION_SYNC_MAX_CONCURRENT", 8)),
+        "max_queue": int(os.getenv("ADMISSION_SYNC_MAX_QUEUE", 16)),
+        "max_wait_seconds": float(os.getenv("ADMISSION_SYNC_MAX_WAIT_SECONDS", 10)),
+    },
+    "stream": {
+        "max_concurrent": int(os.getenv("ADMISSION_STREAM_MAX_CONCURRENT", 4)),
+        "max_queue": int(os.getenv("ADMISSION_STREAM_MAX_QUEUE", 8)),
+        "max_wait_seconds": float(os.getenv("ADMISSION_STREAM_MAX_WAIT_SECONDS", 5)),
+    },
+}
+# Shed new requests while more calls than this wait in the embedding/vector-search batchers (0 = off)
+ADMISSION_MAX_UPSTREAM_QUEUE = int(os.getenv("ADMISSION_MAX_UPSTREAM_QUEUE", 0))
+
+# Agent 3 per-question diagnosis memo (always disk-backed so it can be built offline in bulk)
+AGENT3_DIAGNOSIS_MEMO_ENABLED = os.getenv("AGENT3_DIAGNOSIS_MEMO_ENABLED", "false").lower() == "true"
+DIAGNOSIS_STORE_TTL_SECONDS = float(os.getenv("DIAGNOSIS_STORE_TTL_SECONDS", 180 * 24 * 3600))
+DIAGNOSIS_STORE_MAX_ENTRIES = int(os.getenv("DIAGNOSIS_STORE_MAX_ENTRIES", 100_000))
+DIAGNOSIS_BATCH_SIZE = int(os.getenv("DIAGNOSIS_BATCH_SIZE", 25))  # cases per diagnosis prompt
+
+# Agent 3 map-reduce extraction for large exams
+AGENT3_MAP_REDUCE_THRESHOLD = int(os.getenv("AGENT3_MAP_REDUCE_THRESHOLD", 50))  # incorrect cases; 0 disables
+AGENT3_MAP_REDUCE_PARTITION = os.getenv("AGENT3_MAP_REDUCE_PARTITION", "domain")  # domain | chunk
+AGENT3_MAP_CHUNK_SIZE = int(os.getenv("AGENT3_MAP_CHUNK_SIZE", 25))  # max cases per map call
+AGENT3_MAP_MAX_CONCURRENCY = int(os.getenv("AGENT3_MAP_MAX_CONCURRENCY", 4))
+AGENT3_REDUCE_MODE = os.getenv("AGENT3_REDUCE_MODE", "embedding")  # embedding | llm
+AGENT3_REDUCE_SIMILARITY = float(os.getenv("AGENT3_REDUCE_SIMILARITY", 0.88))  # cosine merge threshold
+
+# Prompt token budgets for the data sections (estimated locally; long text fields are truncated to fit)
+AGENT3_CASES_TOKEN_BUDGET = int(os.getenv("AGENT3_CASES_TOKEN_BUDGET", 12_000))
+AGENT5_DATA_TOKEN_BUDGET = int(os.getenv("AGENT5_DATA_TOKEN_BUDGET", 3_000))
+RERANK_TITLE_MAX_TOKENS = 32
+
+# Explicit Gemini context caching of the static prompt prefixes
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = float(os.getenv("CONTEXT_CACHE_TTL_SECONDS", 3600))
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = float(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", 300))  # extend TTL when this close to expiry
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 1024))  # provider minimum; smaller prefixes go inline
+CONTEXT_CACHE_RETRY_SECONDS = float(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", 300))  # back-off after a failed create
+
 # Vertex AI Matching Engine index defaults
 INDEX_NAME = "courses-index"
 INDEX_DISPLAY_NAME = "Courses Index"
@@ -1,10 +1,15 @@
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Callable, Dict, Literal
+from contextlib import asynccontextmanager
+import json
 import os
+import queue
 import uuid
 import threading
+import time
 
 from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Response
-from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 from google.api_core.exceptions import GoogleAPIError
 
 from config import (
@@ -15,12 +20,96 @@ from config import (
     DEFAULT_LANGUAGE,
     COURSE_RERANK_ENABLED,
     MIN_RECOMMENDATION_SCORE,
+    SUMMARY_MODE,
+    COMPLETED_REQUEST_TTL_SECONDS,
+    COMPLETED_REQUEST_MAX_ENTRIES,
+    JOB_WORKERS,
+    JOB_QUEUE_MAX,
+    JOB_RETENTION_SECONDS,
+    JOB_MAX_RETAINED,
+    JOB_CALLBACK_TIMEOUT_SECONDS,
+    JOB_CALLBACK_RETRIES,
+    JOB_CALLBACK_WORKERS,
+    JOB_ADMISSION_MAX_WAIT_SECONDS,
+    JOB_CALLBACK_ALLOWED_HOSTS,
+    ADMISSION_LIMITS,
+    ADMISSION_MAX_UPSTREAM_QUEUE,
 )
 from pipeline.run_pipeline import run_full_pipeline
+from pipeline.cache import TTLCache, get_cache_stats, stable_hash
+from pipeline.prompt_builder import get_prompt_size_stats
+from pipeline.context_cache import get_context_cache_stats, shutdown_context_cache
+from pipeline.report_cache import get_report_cache_stats
+from pipeline.single_flight import SingleFlight
+from pipeline.jobs import CallbackURLRejected, JobConflict, JobManager, JobQueueFull, validate_callback_url
+from pipeline.admission import AdmissionController, AdmissionRejected
+from pipeline.model_governor import get_model_governor_stats
+from pipeline.priority import (
+    BATCH,
+    INTERACTIVE,
+    PRIORITY_CLASSES,
+    get_priority_latency_stats,
+    priority_scope,
+    record_latency,
+)
+from agents.agent4_course_recommendation import (
+    get_embedding_batcher_stats,
+    get_vector_search_batcher_stats,
+    get_auto_rerank_stats,
+)
 
-_active_correlation_ids: set[str] = set()
+# correlation id -> [request fingerprint, requests holding it]
+_active_correlation_ids: dict[str, list[Any]] = {}
 _corr_lock = threading.Lock()
+# Responses of finished requests, replayed when a client retries with the same correlation id.
+_completed_requests = TTLCache(
+    name="completed_requests",
+    maxsize=COMPLETED_REQUEST_MAX_ENTRIES,
+    ttl_seconds=COMPLETED_REQUEST_TTL_SECONDS,
+)
+# Concurrent requests with identical bodies and priority share one pipeline execution.
+_pipeline_flights = SingleFlight("pipeline")
+
+
+def _upstream_queue_depth() -> int:
+    """Calls waiting in the shared embedding and vector-search batchers."""
+    return get_embedding_batcher_stats()["queued_calls"] + get_vector_search_batcher_stats()["queued_calls"]
+
+
+# Pipeline concurrency caps per endpoint. Jobs run under the "sync" cap so batch jobs queue behind
+# interactive requests; their number is bounded by the job pool, so they wait instead of being shed.
+_admission = {
+    endpoint: AdmissionController(
+        name=endpoint,
+        upstream_depth=_upstream_queue_depth,
+        max_upstream_depth=ADMISSION_MAX_UPSTREAM_QUEUE,
+        **limits,
+    )
+    for endpoint, limits in ADMISSION_LIMITS.items()
+}
+
+
+def _describe_job_error(exc: Exception) -> Dict[str, Any]:
+    if isinstance(exc, AdmissionRejected):
+        return {"code": "OVERLOADED", "message": f"Not admitted within {JOB_ADMISSION_MAX_WAIT_SECONDS:g}s: {exc}"}
+    if isinstance(exc, GoogleAPIError):
+        return {"code": "UPSTREAM_UNAVAILABLE", "message": f"Upstream dependency unavailable: {exc}"}
+    return {"code": "INTERNAL_ERROR", "message": f"Failed to run pipeline: {exc}"}
+
+
+_jobs = JobManager(
+    workers=JOB_WORKERS,
+    max_queue=JOB_QUEUE_MAX,
+    retention_seconds=JOB_RETENTION_SECONDS,
+    max_retained=JOB_MAX_RETAINED,
+    callback_timeout_seconds=JOB_CALLBACK_TIMEOUT_SECONDS,
+    callback_retries=JOB_CALLBACK_RETRIES,
+    callback_workers=JOB_CALLBACK_WORKERS,
+    callback_allowed_hosts=JOB_CALLBACK_ALLOWED_HOSTS,
+    describe_error=_describe_job_error,
+)
 API_BEARER_TOKEN = os.getenv("API_BEARER_TOKEN")
+SSE_HEARTBEAT_SECONDS = 15  # comment line sent while idle so proxies keep the stream open
 
 
 class PipelineRequest(BaseModel):
@@ -39,9 +128,12 @@ class PipelineRequest(BaseModel):
         default=DEFAULT_LANGUAGE,
         description="Output language for the final summary (e.g., EN or TH).",
     )
-    rerank_courses: bool = Field(
+    rerank_courses: bool | Literal["auto"] = Field(
         default=COURSE_RERANK_ENABLED,
-        description="Enable LLM reranking of vector-search course recommendations (slower).",
+        description=(
+            "Enable LLM reranking of vector-search course recommendations (slower). "
+            "'auto' reranks only weaknesses whose vector scores are ambiguous."
+        ),
     )
     min_score: float = Field(
         default=MIN_RECOMMENDATION_SCORE,
@@ -49,12 +141,44 @@ class PipelineRequest(BaseModel):
         le=1,
         description="Minimum course score to include in user-facing summary.",
     )
+    summary_mode: Literal["llm", "template", "hybrid"] = Field(
+        default=SUMMARY_MODE,
+        description=(
+            "How the summary is written: 'llm' (one Gemini call), 'template' (rendered locally, "
+            "no LLM call) or 'hybrid' (template with one narrative field polished by Gemini)."
+        ),
+    )
+
+
+class JobRequest(PipelineRequest):
+    callback_url: str | None = Field(
+        default=None,
+        description=(
+            "Optional https URL that receives a POST with the final job state when the job finishes. "
+            "Its host must be listed in JOB_CALLBACK_ALLOWED_HOSTS and resolve to a public address."
+        ),
+    )
+
+    @field_validator("callback_url")
+    @classmethod
+    def _check_callback_url(cls, value: str | None) -> str | None:
+        if value:
+            validate_callback_url(value, JOB_CALLBACK_ALLOWED_HOSTS)
+        return value
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    shutdown_context_cache()
+    _jobs.shutdown()
 
 
 app = FastAPI(
     title="Test Analysis & Course Recommendation API",
     version="0.1.0",
     description="Run the analysis pipeline via HTTP endpoints.",
+    lifespan=_lifespan,
 )
 router_v1 = APIRouter(prefix="/api/v1", tags=["v1"])
 
@@ -65,9 +189,11 @@ def require_headers(
     x_correlation_id: str | None = Header(None, alias="X-Correlation-Id", include_in_schema=False),
     content_type: str | None = Header(None, alias="Content-Type", include_in_schema=False),
     authorization: str | None = Header(None, alias="Authorization", include_in_schema=False),
+    x_request_priority: str | None = Header(None, alias="X-Request-Priority", include_in_schema=False),
 ) -> Dict[str, str]:
     """
     Enforce required API headers and propagate correlation id.
+    `priority` is the requested priority class, empty when the endpoint default applies.
     """
     correlation_id = x_correlation_id or f"corr_{uuid.uuid4()}"
     response.headers["X-Correlation-Id"] = correlation_id
@@ -112,7 +238,20 @@ def require_headers(
                 headers={"X-Correlation-Id": correlation_id, "X-API-Version": version},
             )
 
-    return {"correlation_id": correlation_id}
+    priority = (x_request_priority or "").strip().lower()
+    if priority and priority not in PRIORITY_CLASSES:
+        detail = {
+            "code": "INVALID_FIELD_VALUE",
+            "message": f"X-Request-Priority must be one of {', '.join(PRIORITY_CLASSES)}, got: {x_request_priority}",
+            "correlation_id": correlation_id,
+        }
+        raise HTTPException(
+            status_code=400,
+            detail=detail,
+            headers={"X-Correlation-Id": correlation_id, "X-API-Version": version},
+        )
+
+    return {"correlation_id": correlation_id, "priority": priority}
 
 
 @app.get("/health")
@@ -126,6 +265,139 @@ def health() -> Dict[str, str]:
     return health_check
 
 
+@app.get("/metrics")
+def metrics(context: Dict[str, str] = Depends(require_headers)) -> Dict[str, Any]:
+    """Process-level performance counters (batching, caches, queues); same auth as the API."""
+    return {
+        "embedding_batcher": get_embedding_batcher_stats(),
+        "vector_search_batcher": get_vector_search_batcher_stats(),
+        "caches": get_cache_stats(),
+        "auto_rerank": get_auto_rerank_stats(),
+        "prompt_sizes": get_prompt_size_stats(),
+        "context_cache": get_context_cache_stats(),
+        "report_cache": get_report_cache_stats(),
+        "single_flight": _pipeline_flights.get_stats(),
+        "jobs": _jobs.get_stats(),
+        "admission": {endpoint: controller.get_stats() for endpoint, controller in _admission.items()},
+        "model_governor": get_model_governor_stats(),
+        "request_latency": get_priority_latency_stats(),
+    }
+
+
+def _request_fingerprint(request: PipelineRequest) -> str:
+    return stable_hash(request.model_dump())
+
+
+def _conflict(correlation_id: str, version: str, message: str) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail={
+            "code": "CONFLICT",
+            "message": message,
+            "correlation_id": correlation_id,
+        },
+        headers={"X-Correlation-Id": correlation_id, "X-API-Version": version},
+    )
+
+
+def _claim_correlation_id(correlation_id: str, version: str, fingerprint: str) -> None:
+    """
+    Enforce idempotency guard: a correlation id in flight may only be reused for the same
+    request body (the retry then joins the running execution).
+    """
+    with _corr_lock:
+        active = _active_correlation_ids.get(correlation_id)
+        if active is None:
+            _active_correlation_ids[correlation_id] = [fingerprint, 1]
+        elif active[0] == fingerprint:
+            active[1] += 1
+        else:
+            raise _conflict(
+                correlation_id, version,
+                "Request with this correlation id is already processing a different request body.",
+            )
+
+
+def _release_correlation_id(correlation_id: str) -> None:
+    with _corr_lock:
+        active = _active_correlation_ids.get(correlation_id)
+        if active is not None:
+            active[1] -= 1
+            if active[1] <= 0:
+                del _active_correlation_ids[correlation_id]
+
+
+def _completed_response(correlation_id: str, version: str, fingerprint: str) -> Dict[str, Any] | None:
+    """Stored {status_code, body} of a finished request with this correlation id, if any."""
+    stored = _completed_requests.get(correlation_id)
+    if stored is None:
+        return None
+    if stored["fingerprint"] != fingerprint:
+        raise _conflict(
+            correlation_id, version,
+            "This correlation id was already used for a different request body.",
+        )
+    return stored
+
+
+def _overloaded(correlation_id: str, version: str, exc: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={
+            "code": "OVERLOADED",
+            "message": f"Too many pipeline runs in progress ({exc.reason}); retry later.",
+            "correlation_id": correlation_id,
+        },
+        headers={
+            "X-Correlation-Id": correlation_id,
+            "X-API-Version": version,
+            "Retry-After": str(exc.retry_after_seconds),
+        },
+    )
+
+
+def _request_priority(context: Dict[str, str], response: Response, default: str) -> str:
+    priority = context.get("priority") or default
+    response.headers["X-Request-Priority"] = priority
+    return priority
+
+
+def _admitted_run(endpoint: str, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    with _admission[endpoint].admit():
+        return fn()
+
+
+def _store_completed_response(correlation_id: str, fingerprint: str, status_code: int, body: Dict[str, Any]) -> None:
+    _completed_requests.set(correlation_id, {"fingerprint": fingerprint, "status_code": status_code, "body": body})
+
+
+def _run_pipeline_request(
+    request: PipelineRequest,
+    on_event: Callable[[str, Dict[str, Any]], None] | None = None,
+) -> Dict[str, Any]:
+    return run_full_pipeline(
+        test_id=request.test_id,
+        student_id=request.student_id,
+        max_courses=request.max_courses,
+        participant_ranking=request.participant_ranking,
+        language=request.language,
+        rerank_courses=request.rerank_courses,
+        min_score=request.min_score,
+        summary_mode=request.summary_mode,
+        on_event=on_event,
+    )
+
+
+def _pipeline_status_code(result: Dict[str, Any]) -> int:
+    """Map known pipeline statuses to HTTP codes."""
+    status = result.get("status")
+    if status == "agent1_error":
+        return 404
+    elif status == "agent2_error":
+        return 404
+    return 200
+
+
 @router_v1.post(
     "/test-analysis-recommendations",
     summary="Execute test analysis and course recommendation pipeline (v1)",
@@ -138,56 +410,37 @@ def run_pipeline_v1(
 ) -> Dict[str, Any]:
     """
     Execute the LLM pipeline using the supplied parameters.
+    Identical concurrent requests share one execution, and a retry with the correlation id of a
+    finished request gets the stored response back.
     """
+    started = time.perf_counter()
     correlation_id = context["correlation_id"]
-    # Enforce idempotency guard: reject duplicates while in-flight.
-    with _corr_lock:
-        if correlation_id in _active_correlation_ids:
-            raise HTTPException(
-                status_code=409,
-                detail={
-                    "code": "CONFLICT",
-                    "message": "Request with this correlation id is already processing.",
-                    "correlation_id": correlation_id,
-                },
-                headers={"X-Correlation-Id": correlation_id, "X-API-Version": response.headers.get("X-API-Version", "1")},
-            )
-        _active_correlation_ids.add(correlation_id)
+    version = response.headers.get("X-API-Version", "1")
+    priority = _request_priority(context, response, INTERACTIVE)
+    fingerprint = _request_fingerprint(request)
+    stored = _completed_response(correlation_id, version, fingerprint)
+    if stored is not None:
+        response.status_code = stored["status_code"]
+        response.headers["X-Idempotent-Replay"] = "true"
+        return stored["body"]
+    _claim_correlation_id(correlation_id, version, fingerprint)
 
     status_code = 200
     try:
-        result = run_full_pipeline(
-            test_id=request.test_id,
-            student_id=request.student_id,
-            max_courses=request.max_courses,
-            participant_ranking=request.participant_ranking,
-            language=request.language,
-            rerank_courses=request.rerank_courses,
-            min_score=request.min_score,
-        )
-        # Map known pipeline statuses to HTTP codes.
-        status = result.get("status")
-        if status == "agent1_error":
-            status_code = 404
-        elif status == "no_course_recommendations":
-            status_code = 200
-        elif status == "agent2_error":
-            status_code = 404
-        elif status == "no_incorrect_questions":
-            status_code = 200
-        elif status == "no_weaknesses":
-            status_code = 200
-        else:
-            status_code = 200
+        # Only the execution that actually runs the pipeline takes an admission slot. Requests of
+        # different classes do not coalesce, so an interactive request never waits on batch work.
+        with priority_scope(priority):
+            result, _ = _pipeline_flights.do(
+                (fingerprint, priority), lambda: _admitted_run("sync", lambda: _run_pipeline_request(request))
+            )
+        status_code = _pipeline_status_code(result)
 
     except HTTPException:
         # Pass through pre-built HTTP exceptions.
-        with _corr_lock:
-            _active_correlation_ids.discard(correlation_id)
         raise
+    except AdmissionRejected as exc:
+        raise _overloaded(correlation_id, version, exc) from exc
     except GoogleAPIError as exc:
-        with _corr_lock:
-            _active_correlation_ids.discard(correlation_id)
         raise HTTPException(
             status_code=502,
             detail={
@@ -198,8 +451,6 @@ def run_pipeline_v1(
             headers={"X-Correlation-Id": correlation_id, "X-API-Version": response.headers.get("X-API-Version", "1")},
         ) from exc
     except Exception as exc:  # pragma: no cover - defensive guardrail
-        with _corr_lock:
-            _active_correlation_ids.discard(correlation_id)
         raise HTTPException(
             status_code=500,
             detail={
@@ -210,11 +461,223 @@ def run_pipeline_v1(
             headers={"X-Correlation-Id": correlation_id, "X-API-Version": response.headers.get("X-API-Version", "1")},
         ) from exc
     finally:
-        with _corr_lock:
-            _active_correlation_ids.discard(correlation_id)
+        _release_correlation_id(correlation_id)
 
+    body = {"correlation_id": correlation_id, "data": result}
+    _store_completed_response(correlation_id, fingerprint, status_code, body)
+    record_latency(priority, "sync", time.perf_counter() - started)
     response.status_code = status_code
-    return {"correlation_id": correlation_id, "data": result}
+    return body
+
+
+@router_v1.post(
+    "/test-analysis-recommendations/stream",
+    summary="Execute the pipeline and stream progress as Server-Sent Events (v1)",
+    description=(
+        "Same pipeline and request body as POST /test-analysis-recommendations, streamed as "
+        "text/event-stream: a `stage` event per completed agent, `summary_field` / `paragraph_delta` "
+        "events while the summary is generated, then a final `result` (or `error`) event."
+    ),
+    response_class=StreamingResponse,
+)
+def run_pipeline_stream_v1(
+    request: PipelineRequest,
+    response: Response,
+    context: Dict[str, str] = Depends(require_headers),
+) -> StreamingResponse:
+    started = time.perf_counter()
+    correlation_id = context["correlation_id"]
+    version = response.headers.get("X-API-Version", "1")
+    priority = _request_priority(context, response, INTERACTIVE)
+    fingerprint = _request_fingerprint(request)
+    events: "queue.Queue[tuple[str, Dict[str, Any]] | None]" = queue.Queue()
+
+    stored = _completed_response(correlation_id, version, fingerprint)
+    if stored is not None:
+        # Replay: the stream carries only the final result of the finished request.
+        events.put(("result", {**stored["body"], "status_code": stored["status_code"]}))
+        events.put(None)
+        return StreamingResponse(
+            _sse_events(events),
+            media_type="text/event-stream",
+            headers={
+                "X-Correlation-Id": correlation_id,
+                "X-API-Version": version,
+                "X-Idempotent-Replay": "true",
+                "X-Request-Priority": priority,
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            },
+        )
+    _claim_correlation_id(correlation_id, version, fingerprint)
+    # Admission (including the queue wait) happens before the stream opens so overload is a plain 429.
+    try:
+        admitted_at = _admission["stream"].acquire(priority)
+    except AdmissionRejected as exc:
+        _release_correlation_id(correlation_id)
+        raise _overloaded(correlation_id, version, exc) from exc
+
+    def _run() -> None:
+        # The pipeline keeps running if the client disconnects; the correlation id is released when it ends.
+        # Progress events belong to one run, so streamed requests are not coalesced.
+        try:
+            with priority_scope(priority):
+                result = _run_pipeline_request(request, on_event=lambda event, data: events.put((event, data)))
+            status_code = _pipeline_status_code(result)
+            _store_completed_response(
+                correlation_id, fingerprint, status_code, {"correlation_id": correlation_id, "data": result}
+            )
+            record_latency(priority, "stream", time.perf_counter() - started)
+            events.put(("result", {
+                "correlation_id": correlation_id,
+                "status_code": status_code,
+                "data": result,
+            }))
+        except GoogleAPIError as exc:
+            events.put(("error", {
+                "code": "UPSTREAM_UNAVAILABLE",
+                "message": f"Upstream dependency unavailable: {exc}",
+                "correlation_id": correlation_id,
+            }))
+        except Exception as exc:  # pragma: no cover - defensive guardrail
+            events.put(("error", {
+                "code": "INTERNAL_ERROR",
+                "message": f"Failed to run pipeline: {exc}",
+                "correlation_id": correlation_id,
+            }))
+        finally:
+            _admission["stream"].release(admitted_at)
+            _release_correlation_id(correlation_id)
+            events.put(None)
+
+    threading.Thread(target=_run, name=f"sse-{correlation_id}", daemon=True).start()
+
+    return StreamingResponse(
+        _sse_events(events),
+        media_type="text/event-stream",
+        headers={
+            "X-Correlation-Id": correlation_id,
+            "X-API-Version": version,
+            "X-Request-Priority": priority,
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@router_v1.post(
+    "/test-analysis-recommendations/jobs",
+    summary="Submit the pipeline as an asynchronous job (v1)",
+    description=(
+        "Queues the pipeline on the job worker pool and returns 202 with a job id immediately. "
+        "Poll GET /test-analysis-recommendations/jobs/{job_id}, or pass `callback_url` to receive "
+        "the final job state by POST. Jobs run at batch priority unless X-Request-Priority says otherwise."
+    ),
+    status_code=202,
+)
+def submit_pipeline_job_v1(
+    request: JobRequest,
+    response: Response,
+    context: Dict[str, str] = Depends(require_headers),
+) -> Dict[str, Any]:
+    submitted = time.perf_counter()
+    correlation_id = context["correlation_id"]
+    version = response.headers.get("X-API-Version", "1")
+    priority = _request_priority(context, response, BATCH)
+    pipeline_request = PipelineRequest(**request.model_dump(exclude={"callback_url"}))
+
+    def _run(on_event: Callable[[str, Dict[str, Any]], None]) -> Dict[str, Any]:
+        # Runs on a job worker under the job's priority class.
+        admission = _admission["sync"]
+        admitted_at = admission.acquire(max_wait_seconds=JOB_ADMISSION_MAX_WAIT_SECONDS, bounded=False)
+        try:
+            result = _run_pipeline_request(pipeline_request, on_event=on_event)
+        finally:
+            admission.release(admitted_at)
+        record_latency(priority, "jobs", time.perf_counter() - submitted)
+        return {"status_code": _pipeline_status_code(result), "data": result}
+
+    try:
+        job = _jobs.submit(
+            _run,
+            correlation_id=correlation_id,
+            callback_url=request.callback_url,
+            priority=priority,
+            fingerprint=_request_fingerprint(request),
+        )
+    except CallbackURLRejected as exc:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "INVALID_FIELD_VALUE",
+                "message": str(exc),
+                "correlation_id": correlation_id,
+            },
+            headers={"X-Correlation-Id": correlation_id, "X-API-Version": version},
+        ) from exc
+    except JobConflict as exc:
+        raise _conflict(
+            correlation_id, version,
+            "This correlation id already owns a job for a different request body.",
+        ) from exc
+    except JobQueueFull as exc:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "code": "QUEUE_FULL",
+                "message": f"Job queue is full: {exc}",
+                "correlation_id": correlation_id,
+            },
+            headers={"X-Correlation-Id": correlation_id, "X-API-Version": version, "Retry-After": "30"},
+        ) from exc
+
+    response.headers["Location"] = f"{router_v1.prefix}/test-analysis-recommendations/jobs/{job.job_id}"
+    return {
+        "correlation_id": correlation_id,
+        "job_id": job.job_id,
+        "priority": job.priority,
+        "status": job.status,
+        "status_url": response.headers["Location"],
+    }
+
+
+@router_v1.get(
+    "/test-analysis-recommendations/jobs/{job_id}",
+    summary="Get the status of an asynchronous pipeline job (v1)",
+    description="Returns the job status, the stage outputs completed so far and, once finished, the result or error.",
+)
+def get_pipeline_job_v1(
+    job_id: str,
+    response: Response,
+    context: Dict[str, str] = Depends(require_headers),
+) -> Dict[str, Any]:
+    job = _jobs.get(job_id)
+    if job is None:
+        correlation_id = context["correlation_id"]
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "code": "NOT_FOUND",
+                "message": f"Unknown or expired job id: {job_id}",
+                "correlation_id": correlation_id,
+            },
+            headers={"X-Correlation-Id": correlation_id, "X-API-Version": response.headers.get("X-API-Version", "1")},
+        )
+    return job.to_dict()
+
+
+def _sse_events(events: "queue.Queue[tuple[str, Dict[str, Any]] | None]"):
+    """Serialize queued (event, data) pairs as SSE frames until the None sentinel."""
+    while True:
+        try:
+            item = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+        except queue.Empty:
+            yield ": keep-alive\n\n"
+            continue
+        if item is None:
+            return
+        event, data = item
+        yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
 
 
 app.include_router(router_v1)
@@ -0,0 +1,193 @@
+"""
+Admission control and load shedding for pipeline runs.
+
+`AdmissionController` caps how many pipelines run at once for one endpoint. Requests beyond
+the cap wait in a bounded queue for at most `max_wait_seconds`; anything else is rejected
+immediately with `AdmissionRejected`, which carries a Retry-After estimate derived from recent
+run durations. An optional upstream-depth probe (e.g. calls queued in the embedding and
+vector-search micro-batchers) sheds new work while the shared backends are backlogged.
+The queue is ordered by priority class (interactive before batch, FIFO within a class); only
+waiters of the same or a more urgent class count toward a request's queue limit, so queued
+batch work never gets an interactive request rejected. Batch requests are shed at half the
+upstream backlog that interactive ones tolerate. Callers that bound their own concurrency (the
+job pool) can acquire unbounded: they skip shedding and wait up to their own limit.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+from pipeline.priority import BATCH, PRIORITY_CLASSES, current_priority
+
+
+class AdmissionRejected(Exception):
+    """Request not admitted; `reason` is queue_full, timeout or upstream_backlog."""
+
+    def __init__(self, name: str, reason: str, retry_after_seconds: int) -> None:
+        super().__init__(f"{name}: request rejected ({reason}), retry after {retry_after_seconds}s")
+        self.name = name
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+
+class AdmissionController:
+    """Concurrency cap + bounded, priority-ordered wait queue for one endpoint."""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        max_queue: int,
+        max_wait_seconds: float,
+        upstream_depth: Optional[Callable[[], int]] = None,
+        max_upstream_depth: int = 0,
+    ) -> None:
+        self.name = name
+        self.max_concurrent = max(int(max_concurrent), 1)
+        self.max_queue = max(int(max_queue), 0)
+        self.max_wait_seconds = max(float(max_wait_seconds), 0.0)
+        self._upstream_depth = upstream_depth
+        self.max_upstream_depth = int(max_upstream_depth)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiters: Dict[str, Deque[object]] = {p: deque() for p in PRIORITY_CLASSES}
+        self._avg_run_seconds = 0.0
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "rejected_upstream_backlog": 0,
+            "queue_wait_ms_sum": 0.0,
+            "queue_wait_ms_max": 0.0,
+            "max_queue_depth": 0,
+        }
+        self._class_stats = {p: {"admitted": 0, "queue_wait_ms_sum": 0.0, "queue_wait_ms_max": 0.0} for p in PRIORITY_CLASSES}
+
+    @contextmanager
+    def admit(self, priority: Optional[str] = None) -> Iterator[None]:
+        admitted_at = self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
+
+    def acquire(
+        self,
+        priority: Optional[str] = None,
+        max_wait_seconds: Optional[float] = None,
+        bounded: bool = True,
+    ) -> float:
+        """
+        Block until admitted (returns the admission time) or raise AdmissionRejected.
+        `priority` defaults to the priority class of the current request. `bounded=False` skips
+        the queue and upstream-backlog limits; `max_wait_seconds` overrides the queue wait.
+        """
+        priority = priority if priority in PRIORITY_CLASSES else current_priority()
+        max_wait = self.max_wait_seconds if max_wait_seconds is None else max(float(max_wait_seconds), 0.0)
+        if bounded and self.max_upstream_depth > 0 and self._upstream_depth is not None:
+            limit = self.max_upstream_depth // 2 if priority == BATCH else self.max_upstream_depth
+            depth = self._upstream_depth()
+            if depth > limit:
+                with self._cond:
+                    self._reject("upstream_backlog")
+
+        with self._cond:
+            if self._in_flight < self.max_concurrent and not self._queue_depth():
+                return self._enter(priority, 0.0)
+            if bounded and self._queue_depth(priority) >= self.max_queue:
+                self._reject("queue_full")
+
+            ticket = object()
+            waiters = self._waiters[priority]
+            waiters.append(ticket)
+            self._stats["queued"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue_depth())
+            started = time.perf_counter()
+            deadline = started + max_wait
+            while not (self._next_ticket() is ticket and self._in_flight < self.max_concurrent):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    waiters.remove(ticket)
+                    self._cond.notify_all()
+                    self._reject("timeout")
+                self._cond.wait(timeout=remaining)
+            waiters.popleft()
+            self._cond.notify_all()
+            return self._enter(priority, time.perf_counter() - started)
+
+    def release(self, admitted_at: float) -> None:
+        held = time.perf_counter() - admitted_at
+        with self._cond:
+            self._in_flight -= 1
+            # Exponentially weighted run time, used for Retry-After estimates.
+            self._avg_run_seconds = held if not self._avg_run_seconds else 0.8 * self._avg_run_seconds + 0.2 * held
+            self._cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            class_stats = {p: dict(values) for p, values in self._class_stats.items()}
+            queued_by_class = {p: len(waiters) for p, waiters in self._waiters.items()}
+            in_flight = self._in_flight
+            avg_run = self._avg_run_seconds
+        wait_sum = stats.pop("queue_wait_ms_sum")
+        return {
+            "name": self.name,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait_seconds,
+            "in_flight": in_flight,
+            "queue_depth": sum(queued_by_class.values()),
+            "avg_run_seconds": round(avg_run, 3),
+            "avg_queue_wait_ms": round(wait_sum / (stats["queued"] or 1), 3),
+            **stats,
+            "queue_wait_ms_max": round(stats["queue_wait_ms_max"], 3),
+            "classes": {
+                p: {
+                    "queue_depth": queued_by_class[p],
+                    "admitted": values["admitted"],
+                    "avg_queue_wait_ms": round(values["queue_wait_ms_sum"] / (values["admitted"] or 1), 3),
+                    "queue_wait_ms_max": round(values["queue_wait_ms_max"], 3),
+                }
+                for p, values in class_stats.items()
+            },
+        }
+
+    # ----------------------------------------------------------------
+    # Internals (called with the condition held)
+    # ----------------------------------------------------------------
+    def _queue_depth(self, priority: Optional[str] = None) -> int:
+        """Waiters of `priority` or a more urgent class (all waiters without `priority`)."""
+        classes = PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority) + 1] if priority else PRIORITY_CLASSES
+        return sum(len(self._waiters[p]) for p in classes)
+
+    def _next_ticket(self) -> Optional[object]:
+        """Oldest waiter of the most urgent class that has any."""
+        for priority in PRIORITY_CLASSES:
+            if self._waiters[priority]:
+                return self._waiters[priority][0]
+        return None
+
+    def _enter(self, priority: str, waited_seconds: float) -> float:
+        self._in_flight += 1
+        self._stats["admitted"] += 1
+        wait_ms = waited_seconds * 1000
+        self._stats["queue_wait_ms_sum"] += wait_ms
+        self._stats["queue_wait_ms_max"] = max(self._stats["queue_wait_ms_max"], wait_ms)
+        class_stats = self._class_stats[priority]
+        class_stats["admitted"] += 1
+        class_stats["queue_wait_ms_sum"] += wait_ms
+        class_stats["queue_wait_ms_max"] = max(class_stats["queue_wait_ms_max"], wait_ms)
+        return time.perf_counter()
+
+    def _reject(self, reason: str) -> None:
+        self._stats[f"rejected_{reason}"] += 1
+        # Time for the runs ahead (in flight + queued) to drain through the concurrency cap.
+        ahead = self._in_flight + self._queue_depth()
+        estimate = (self._avg_run_seconds or 1.0) * ahead / self.max_concurrent
+        raise AdmissionRejected(self.name, reason, max(1, math.ceil(estimate)))
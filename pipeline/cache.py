@@ -0,0 +1,161 @@
+"""
+Small process-local caches shared by the agents.
+An in-memory LRU tier with TTL, optionally backed by an on-disk JSON tier so entries
+survive restarts and can be shared by workers on the same host. Values must be JSON-serializable.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_MISSING = object()
+_registry: List["TTLCache"] = []
+_registry_lock = threading.Lock()
+
+
+def stable_hash(*parts: Any) -> str:
+    """SHA-256 over a canonical JSON encoding (sorted keys, compact separators)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of free text used in cache keys."""
+    return " ".join((text or "").lower().split())
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTL and an optional disk tier."""
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl_seconds: float,
+        disk_dir: Optional[Path] = None,
+    ) -> None:
+        self.name = name
+        self.maxsize = max(int(maxsize), 1)
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expired": 0}
+        with _registry_lock:
+            _registry.append(self)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is _MISSING:
+                self._stats["misses"] += 1
+                return default
+            self._stats["disk_hits"] += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        stored_at = time.time()
+        with self._lock:
+            self._put(key, stored_at, value)
+            self._stats["sets"] += 1
+        self._disk_set(key, stored_at, value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        path = self._disk_path(key)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            size = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        return {
+            "name": self.name,
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_tier": str(self.disk_dir) if self.disk_dir else None,
+            **stats,
+            "hit_rate": round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None,
+        }
+
+    # ----------------------------------------------------------------
+    # Internals
+    # ----------------------------------------------------------------
+    def _put(self, key: str, stored_at: float, value: Any) -> None:
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> Optional[Path]:
+        if self.disk_dir is None:
+            return None
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.disk_dir / digest[:2] / f"{digest}.json"
+
+    def _disk_get(self, key: str, now: float) -> Any:
+        path = self._disk_path(key)
+        if path is None or not path.exists():
+            return _MISSING
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+            stored_at = float(payload["stored_at"])
+            value = payload["value"]
+        except Exception:
+            return _MISSING
+        if now - stored_at > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return _MISSING
+        # Promote to the memory tier, keeping the original timestamp so TTL still applies.
+        with self._lock:
+            self._put(key, stored_at, value)
+        return value
+
+    def _disk_set(self, key: str, stored_at: float, value: Any) -> None:
+        path = self._disk_path(key)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(
+                json.dumps({"stored_at": stored_at, "value": value}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            tmp.replace(path)
+        except Exception as exc:
+            print(f"[WARN] Cache '{self.name}' disk write failed: {exc}")
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats for every cache created in this process, keyed by cache name."""
+    with _registry_lock:
+        caches = list(_registry)
+    return {cache.name: cache.get_stats() for cache in caches}
@@ -0,0 +1,327 @@
+"""
+Explicit context caching for the static instruction prefixes of the LLM prompts.
+
+Each prompt is split into a stable prefix (instructions, output format, rules) and a
+per-request suffix (the data). `ContextCacheClient` uploads every distinct (model, prefix)
+pair once as provider-side cached content, refreshes its TTL shortly before it expires,
+and sends only the suffix on each request. Prefixes under the provider's minimum cacheable
+size (estimated locally, so no cache is ever created for them), disabled caching, or any
+cache failure fall back to sending the prefix inline, where the provider's implicit prefix
+caching can still apply.
+
+The provider sits behind a small backend interface (create / refresh / delete / generate /
+generate_stream); `GeminiContextCacheBackend` talks to `client.caches`.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from pipeline.cache import stable_hash
+from pipeline.prompt_builder import estimate_tokens
+
+_CACHE_MISS_MARKERS = ("not found", "404", "expired", "cachedcontent", "cached content", "cached_content")
+
+
+class GeminiContextCacheBackend:
+    """Backend over the google-genai `client.caches` API."""
+
+    def __init__(self, genai_client: Any) -> None:
+        self.client = genai_client
+
+    def create(self, model: str, prefix: str, ttl_seconds: float, display_name: str) -> Tuple[str, float]:
+        from google.genai import types
+
+        cached = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=display_name,
+                contents=[types.Content(role="user", parts=[types.Part(text=prefix)])],
+                ttl=f"{int(ttl_seconds)}s",
+            ),
+        )
+        return cached.name, _expire_timestamp(getattr(cached, "expire_time", None), ttl_seconds)
+
+    def refresh(self, name: str, ttl_seconds: float) -> float:
+        from google.genai import types
+
+        cached = self.client.caches.update(
+            name=name,
+            config=types.UpdateCachedContentConfig(ttl=f"{int(ttl_seconds)}s"),
+        )
+        return _expire_timestamp(getattr(cached, "expire_time", None), ttl_seconds)
+
+    def delete(self, name: str) -> None:
+        self.client.caches.delete(name=name)
+
+    def generate(self, model: str, text: str, cached_content: Optional[str] = None) -> Any:
+        kwargs: Dict[str, Any] = {}
+        if cached_content:
+            from google.genai import types
+
+            kwargs["config"] = types.GenerateContentConfig(cached_content=cached_content)
+        return self.client.models.generate_content(
+            model=model,
+            contents=[{"role": "user", "parts": [{"text": text}]}],
+            **kwargs,
+        )
+
+    def generate_stream(self, model: str, text: str, cached_content: Optional[str] = None) -> Iterator[Any]:
+        kwargs: Dict[str, Any] = {}
+        if cached_content:
+            from google.genai import types
+
+            kwargs["config"] = types.GenerateContentConfig(cached_content=cached_content)
+        return iter(
+            self.client.models.generate_content_stream(
+                model=model,
+                contents=[{"role": "user", "parts": [{"text": text}]}],
+                **kwargs,
+            )
+        )
+
+
+class _CacheEntry:
+    __slots__ = ("name", "expire_at", "label")
+
+    def __init__(self, name: str, expire_at: float, label: str) -> None:
+        self.name = name
+        self.expire_at = expire_at
+        self.label = label
+
+
+class ContextCacheClient:
+    """Serve prompts as (cached prefix, inline suffix), managing the cache lifecycle."""
+
+    def __init__(
+        self,
+        backend: Any,
+        enabled: bool = True,
+        ttl_seconds: float = 3600,
+        refresh_margin_seconds: float = 300,
+        min_prefix_tokens: int = 1024,
+        retry_after_seconds: float = 300,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.backend = backend
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.min_prefix_tokens = min_prefix_tokens
+        self.retry_after_seconds = retry_after_seconds
+        self.clock = clock
+        self._entries: Dict[str, _CacheEntry] = {}
+        self._failed_until: Dict[str, float] = {}
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "cached_calls": 0,
+            "inline_calls": 0,
+            "creates": 0,
+            "refreshes": 0,
+            "deletes": 0,
+            "create_failures": 0,
+            "stale_fallbacks": 0,
+            "below_min_prefix_calls": 0,
+        }
+        # Estimated prefix size per label that was too small to cache, for tuning the prompts.
+        self._below_min: Dict[str, int] = {}
+
+    def generate_content(self, model: str, prefix: str, suffix: str, label: str = "prompt") -> Any:
+        """Generate with `prefix` served from the context cache when possible."""
+        key = stable_hash(model, prefix)
+        name = self._acquire(key, model, prefix, label)
+        if name is not None:
+            try:
+                response = self.backend.generate(model, suffix, cached_content=name)
+                self._bump("cached_calls")
+                return response
+            except Exception as exc:
+                if not _is_cache_miss(exc):
+                    raise
+                # Expired or evicted on the provider side: forget it and send the prefix inline once.
+                print(f"[WARN] Context cache '{label}' unavailable ({exc}); sending prompt inline.")
+                self._forget(key, name)
+                self._bump("stale_fallbacks")
+        response = self.backend.generate(model, prefix + suffix)
+        self._bump("inline_calls")
+        return response
+
+    def generate_content_stream(self, model: str, prefix: str, suffix: str, label: str = "prompt") -> Iterator[Any]:
+        """Streaming variant of `generate_content`; yields provider response chunks."""
+        key = stable_hash(model, prefix)
+        name = self._acquire(key, model, prefix, label)
+        if name is not None:
+            try:
+                stream = self.backend.generate_stream(model, suffix, cached_content=name)
+                # A missing/expired cache surfaces on the first chunk, before anything was yielded.
+                first = next(stream, None)
+            except Exception as exc:
+                if not _is_cache_miss(exc):
+                    raise
+                print(f"[WARN] Context cache '{label}' unavailable ({exc}); sending prompt inline.")
+                self._forget(key, name)
+                self._bump("stale_fallbacks")
+            else:
+                self._bump("cached_calls")
+                if first is not None:
+                    yield first
+                yield from stream
+                return
+        self._bump("inline_calls")
+        yield from self.backend.generate_stream(model, prefix + suffix)
+
+    def expire(self, model: str, prefix: str) -> None:
+        """Delete the cached content for one prefix (e.g. after the instructions change)."""
+        key = stable_hash(model, prefix)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._delete(entry)
+
+    def expire_all(self) -> None:
+        """Delete every cached content this client created."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._delete(entry)
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        with self._lock:
+            stats = dict(self._stats)
+            live = [
+                {"label": e.label, "name": e.name, "expires_in_seconds": round(e.expire_at - now, 1)}
+                for e in self._entries.values()
+            ]
+            below_min = dict(self._below_min)
+        return {
+            "enabled": self.enabled,
+            "min_prefix_tokens": self.min_prefix_tokens,
+            **stats,
+            "below_min_prefix_tokens": below_min,
+            "caches": live,
+        }
+
+    # ----------------------------------------------------------------
+    # Lifecycle internals
+    # ----------------------------------------------------------------
+    def _acquire(self, key: str, model: str, prefix: str, label: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        prefix_tokens = estimate_tokens(prefix)
+        if prefix_tokens < self.min_prefix_tokens:
+            # The provider rejects cached contents below its minimum size; don't even try.
+            with self._lock:
+                self._stats["below_min_prefix_calls"] += 1
+                self._below_min[label] = prefix_tokens
+            return None
+        with self._lock:
+            if self._failed_until.get(key, 0.0) > self.clock():
+                return None
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One create/refresh per prefix at a time; concurrent callers wait and reuse it.
+        with key_lock:
+            now = self.clock()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and entry.expire_at - now > self.refresh_margin_seconds:
+                return entry.name
+            if entry is not None and entry.expire_at > now:
+                try:
+                    entry.expire_at = self.backend.refresh(entry.name, self.ttl_seconds)
+                    self._bump("refreshes")
+                    return entry.name
+                except Exception as exc:
+                    print(f"[WARN] Context cache '{label}' refresh failed ({exc}); recreating.")
+                    self._forget(key, entry.name)
+            try:
+                name, expire_at = self.backend.create(
+                    model, prefix, self.ttl_seconds, display_name=f"{label}-{key[:12]}"
+                )
+            except Exception as exc:
+                print(f"[WARN] Context cache '{label}' create failed: {exc}")
+                with self._lock:
+                    self._failed_until[key] = now + self.retry_after_seconds
+                    self._stats["create_failures"] += 1
+                return None
+            with self._lock:
+                self._entries[key] = _CacheEntry(name, expire_at, label)
+                self._failed_until.pop(key, None)
+                self._stats["creates"] += 1
+            return name
+
+    def _forget(self, key: str, name: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.name == name:
+                del self._entries[key]
+
+    def _delete(self, entry: _CacheEntry) -> None:
+        try:
+            self.backend.delete(entry.name)
+            self._bump("deletes")
+        except Exception as exc:
+            print(f"[WARN] Context cache '{entry.label}' delete failed: {exc}")
+
+    def _bump(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+
+_context_cache: Optional[ContextCacheClient] = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache() -> ContextCacheClient:
+    """Process-wide client over the Gemini client from config.py."""
+    global _context_cache
+    with _context_cache_lock:
+        if _context_cache is None:
+            from config import (
+                client,
+                CONTEXT_CACHE_ENABLED,
+                CONTEXT_CACHE_TTL_SECONDS,
+                CONTEXT_CACHE_REFRESH_MARGIN_SECONDS,
+                CONTEXT_CACHE_MIN_TOKENS,
+                CONTEXT_CACHE_RETRY_SECONDS,
+            )
+
+            _context_cache = ContextCacheClient(
+                GeminiContextCacheBackend(client),
+                enabled=CONTEXT_CACHE_ENABLED,
+                ttl_seconds=CONTEXT_CACHE_TTL_SECONDS,
+                refresh_margin_seconds=CONTEXT_CACHE_REFRESH_MARGIN_SECONDS,
+                min_prefix_tokens=CONTEXT_CACHE_MIN_TOKENS,
+                retry_after_seconds=CONTEXT_CACHE_RETRY_SECONDS,
+            )
+        return _context_cache
+
+
+def get_context_cache_stats() -> Dict[str, Any]:
+    with _context_cache_lock:
+        cache = _context_cache
+    return cache.get_stats() if cache is not None else {}
+
+
+def shutdown_context_cache() -> None:
+    """Delete provider-side caches on shutdown instead of leaving them to expire."""
+    with _context_cache_lock:
+        cache = _context_cache
+    if cache is not None:
+        cache.expire_all()
+
+
+def _expire_timestamp(expire_time: Any, ttl_seconds: float) -> float:
+    if isinstance(expire_time, datetime):
+        return expire_time.timestamp()
+    return time.time() + ttl_seconds
+
+
+def _is_cache_miss(exc: Exception) -> bool:
+    message = str(exc).lower()
+    return isinstance(exc, LookupError) or any(marker in message for marker in _CACHE_MISS_MARKERS)
@@ -0,0 +1,295 @@
+"""
+Asynchronous pipeline jobs.
+
+`JobManager` runs submitted callables on a fixed pool of worker threads behind a bounded
+queue, so a long multi-LLM run does not hold an HTTP connection open. Each job records its
+progress ("stage" events from `run_full_pipeline(on_event=...)`), its result or error, and can
+POST the final state to a callback URL. Callbacks go out from their own small pool, only over
+https to an allowlisted host that resolves to a public address. Finished jobs are kept for a retention period and
+evicted oldest-first beyond a maximum count. A free worker always starts the oldest queued job
+of the most urgent priority class, and runs it under that class.
+"""
+from __future__ import annotations
+
+import ipaddress
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from pipeline.priority import INTERACTIVE, PRIORITY_CLASSES, priority_scope
+
+JobFn = Callable[[Callable[[str, Dict[str, Any]], None]], Dict[str, Any]]
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised by `submit` when all workers are busy and the queue is at capacity."""
+
+
+class JobConflict(Exception):
+    """Raised by `submit` when a correlation id that owns a job is reused for a different request."""
+
+
+class CallbackURLRejected(ValueError):
+    """A callback URL that is not https, not on the host allowlist, or resolves to a non-public address."""
+
+
+def validate_callback_url(url: str, allowed_hosts: Iterable[str]) -> None:
+    """
+    Raise CallbackURLRejected unless `url` is https, its host is allowlisted ("*.example.com"
+    matches subdomains) and every address it resolves to is public.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme != "https" or not host:
+        raise CallbackURLRejected("callback_url must be an https URL.")
+    if parts.username or parts.password:
+        raise CallbackURLRejected("callback_url must not carry credentials.")
+    if not any(_host_matches(host, pattern) for pattern in allowed_hosts):
+        raise CallbackURLRejected(f"callback_url host {host} is not allowed.")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError) as exc:
+        raise CallbackURLRejected(f"callback_url host {host} does not resolve: {exc}") from exc
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise CallbackURLRejected(f"callback_url host {host} resolves to a non-public address.")
+
+
+def _host_matches(host: str, pattern: str) -> bool:
+    if pattern.startswith("*."):
+        return host.endswith(pattern[1:])
+    return host == pattern
+
+
+class Job:
+    __slots__ = (
+        "job_id", "correlation_id", "fingerprint", "priority", "status", "created_at", "started_at", "finished_at",
+        "stages", "result", "error", "callback_url", "callback_status", "_lock",
+    )
+
+    def __init__(
+        self,
+        correlation_id: str,
+        callback_url: Optional[str],
+        priority: str = INTERACTIVE,
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        self.job_id = f"job_{uuid.uuid4().hex}"
+        self.correlation_id = correlation_id
+        self.fingerprint = fingerprint
+        self.priority = priority
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.stages: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.callback_url = callback_url
+        self.callback_status: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "correlation_id": self.correlation_id,
+                "priority": self.priority,
+                "status": self.status,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "stages": list(self.stages),
+                "result": self.result,
+                "error": self.error,
+                "callback_status": self.callback_status,
+            }
+
+
+class JobManager:
+    """Bounded worker pool + queue for pipeline jobs, with an in-memory job store."""
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queue: int = 100,
+        retention_seconds: float = 3600.0,
+        max_retained: int = 1000,
+        callback_timeout_seconds: float = 10.0,
+        callback_retries: int = 3,
+        callback_workers: int = 2,
+        callback_allowed_hosts: Iterable[str] = (),
+        describe_error: Callable[[Exception], Dict[str, Any]] | None = None,
+    ) -> None:
+        self.workers = max(int(workers), 1)
+        self.max_queue = max(int(max_queue), 0)
+        self.retention_seconds = retention_seconds
+        self.max_retained = max(int(max_retained), 1)
+        self.callback_timeout_seconds = callback_timeout_seconds
+        self.callback_retries = max(int(callback_retries), 1)
+        self.callback_allowed_hosts = tuple(callback_allowed_hosts)
+        self._describe_error = describe_error or (lambda exc: {"code": "INTERNAL_ERROR", "message": str(exc)})
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pipeline-job")
+        # Slow callback receivers must not hold job workers that the slot accounting counts as free.
+        self._callback_executor = ThreadPoolExecutor(
+            max_workers=max(int(callback_workers), 1), thread_name_prefix="job-callback"
+        )
+        # Queued + running jobs never exceed workers + max_queue.
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._by_correlation_id: Dict[str, str] = {}
+        # Jobs waiting for a worker; each executor task runs whichever job is most urgent by then.
+        self._queued: Dict[str, Deque[Tuple[Job, JobFn]]] = {p: deque() for p in PRIORITY_CLASSES}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0, "callbacks_failed": 0}
+
+    def submit(
+        self,
+        fn: JobFn,
+        correlation_id: str,
+        callback_url: Optional[str] = None,
+        priority: str = INTERACTIVE,
+        fingerprint: Optional[str] = None,
+    ) -> Job:
+        """
+        Queue `fn(on_event)` at `priority`; returns the job. A correlation id that already owns a
+        job returns that job instead of starting another, provided `fingerprint` (a hash of the
+        request) matches; otherwise JobConflict is raised. Raises JobQueueFull when the queue is
+        at capacity and CallbackURLRejected for a callback URL that may not be called.
+        """
+        if callback_url:
+            validate_callback_url(callback_url, self.callback_allowed_hosts)
+        with self._lock:
+            self._evict_expired()
+            existing = self._jobs.get(self._by_correlation_id.get(correlation_id, ""))
+            if existing is not None:
+                if existing.fingerprint != fingerprint:
+                    raise JobConflict(f"Correlation id {correlation_id} already owns job {existing.job_id}.")
+                return existing
+            if not self._slots.acquire(blocking=False):
+                self._stats["rejected"] += 1
+                raise JobQueueFull(f"{self.workers} workers busy and {self.max_queue} jobs queued.")
+            job = Job(correlation_id, callback_url, priority, fingerprint)
+            self._jobs[job.job_id] = job
+            self._by_correlation_id[correlation_id] = job.job_id
+            self._queued[priority].append((job, fn))
+            self._stats["submitted"] += 1
+        self._executor.submit(self._run_next)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            statuses = [job.status for job in self._jobs.values()]
+            queued_by_class = {p: len(queued) for p, queued in self._queued.items()}
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": statuses.count(QUEUED),
+            "queued_by_class": queued_by_class,
+            "running": statuses.count(RUNNING),
+            "retained": len(statuses),
+            **stats,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._callback_executor.shutdown(wait=False, cancel_futures=True)
+
+    # ----------------------------------------------------------------
+    # Internals
+    # ----------------------------------------------------------------
+    def _run_next(self) -> None:
+        with self._lock:
+            job, fn = next(self._queued[p] for p in PRIORITY_CLASSES if self._queued[p]).popleft()
+        with priority_scope(job.priority):
+            self._run(job, fn)
+
+    def _run(self, job: Job, fn: JobFn) -> None:
+        with job._lock:
+            job.status = RUNNING
+            job.started_at = time.time()
+
+        def _on_event(event: str, data: Dict[str, Any]) -> None:
+            if event == "stage":
+                with job._lock:
+                    job.stages.append(data)
+
+        try:
+            result = fn(_on_event)
+            with job._lock:
+                job.result = result
+                job.status = SUCCEEDED
+        except Exception as exc:
+            with job._lock:
+                job.error = self._describe_error(exc)
+                job.status = FAILED
+        finally:
+            with job._lock:
+                job.finished_at = time.time()
+            self._slots.release()
+            with self._lock:
+                self._stats[job.status] += 1
+        if job.callback_url:
+            self._callback_executor.submit(self._send_callback, job)
+
+    def _send_callback(self, job: Job) -> None:
+        payload = job.to_dict()
+        for attempt in range(1, self.callback_retries + 1):
+            try:
+                # Re-checked per attempt: the host may resolve differently than at submit time.
+                validate_callback_url(job.callback_url, self.callback_allowed_hosts)
+                resp = requests.post(
+                    job.callback_url,
+                    json=payload,
+                    timeout=self.callback_timeout_seconds,
+                    allow_redirects=False,
+                )
+                if resp.status_code >= 300:  # redirects are not followed, so they count as failures
+                    raise requests.HTTPError(f"callback returned HTTP {resp.status_code}", response=resp)
+                with job._lock:
+                    job.callback_status = f"delivered ({resp.status_code})"
+                return
+            except CallbackURLRejected as exc:
+                print(f"[WARN] Job {job.job_id} callback not sent: {exc}")
+                break
+            except Exception as exc:
+                print(f"[WARN] Job {job.job_id} callback attempt {attempt} failed: {exc}")
+                if attempt < self.callback_retries:
+                    time.sleep(min(2 ** (attempt - 1), 10))
+        with job._lock:
+            job.callback_status = "failed"
+        with self._lock:
+            self._stats["callbacks_failed"] += 1
+
+    def _evict_expired(self) -> None:
+        """Drop finished jobs past retention, then the oldest finished ones beyond max_retained."""
+        now = time.time()
+        finished = [
+            job for job in self._jobs.values()
+            if job.finished_at is not None
+        ]
+        overflow = len(self._jobs) - self.max_retained
+        for job in finished:
+            if now - job.finished_at > self.retention_seconds or overflow > 0:
+                overflow -= 1
+                self._jobs.pop(job.job_id, None)
+                if self._by_correlation_id.get(job.correlation_id) == job.job_id:
+                    del self._by_correlation_id[job.correlation_id]
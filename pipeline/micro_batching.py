@@ -0,0 +1,253 @@
+"""
+Process-wide micro-batching helpers.
+Concurrent callers submit small payloads; a background worker coalesces calls that arrive
+within a short window (or until a max batch size) into one upstream request and fans the
+results back out to each caller.
+
+Calls remember the priority class of the request that made them: when several batches are
+ready, the one carrying interactive calls is dispatched first, interactive calls fill a batch
+before batch-class calls, and batches are only taken off the queue once a worker is free, so
+later interactive calls still overtake batch work that is waiting. A call that has waited longer
+than `aging_seconds` competes as interactive, so batch work cannot starve under steady traffic.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Sequence
+
+from pipeline.priority import PRIORITY_CLASSES, current_priority, highest_priority, priority_scope
+
+BatchFn = Callable[[Hashable, List[Any]], List[Any]]
+
+
+class _PendingCall:
+    __slots__ = ("key", "items", "future", "enqueued_at", "priority")
+
+    def __init__(self, key: Hashable, items: List[Any]) -> None:
+        self.key = key
+        self.items = items
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.priority = current_priority()
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent `submit` calls that share a key into a single `batch_fn(key, items)` call.
+
+    `batch_fn` must return one result per item, in order. A single call is never split across
+    batches, so `batch_fn` should handle inputs larger than `max_batch_size` itself.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_fn: BatchFn,
+        window_ms: float = 10.0,
+        max_batch_size: int = 100,
+        max_concurrent_batches: int = 4,
+        aging_seconds: float = 2.0,
+    ) -> None:
+        self.name = name
+        self._batch_fn = batch_fn
+        self._window = max(window_ms, 0.0) / 1000.0
+        self._max_batch_size = max(int(max_batch_size), 1)
+        self._aging = max(float(aging_seconds), 0.0)
+        self._pending: Dict[Hashable, List[_PendingCall]] = {}
+        self._cond = threading.Condition()
+        self._worker: threading.Thread | None = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(int(max_concurrent_batches), 1),
+            thread_name_prefix=f"micro-batch-{name}",
+        )
+        # A batch is only formed once a worker can run it; until then its calls stay reorderable.
+        self._free_workers = threading.Semaphore(max(int(max_concurrent_batches), 1))
+        self._stats = {
+            "calls": 0,
+            "items": 0,
+            "batches": 0,
+            "fill_ratio_sum": 0.0,
+            "queue_delay_ms_sum": 0.0,
+            "queue_delay_ms_max": 0.0,
+            "errors": 0,
+            "aged_calls": 0,
+            "per_class": {p: {"calls": 0, "queue_delay_ms_sum": 0.0, "queue_delay_ms_max": 0.0} for p in PRIORITY_CLASSES},
+        }
+
+    def submit(self, items: Sequence[Any], key: Hashable = None) -> List[Any]:
+        """Queue items for the next batch with this key and block until their results are ready."""
+        items = list(items)
+        if not items:
+            return []
+        if self._window <= 0:
+            # Batching disabled: call straight through but keep the metrics comparable.
+            call = _PendingCall(key, items)
+            self._run_batch(key, [call])
+            return call.future.result()
+
+        call = _PendingCall(key, items)
+        with self._cond:
+            self._ensure_worker()
+            self._pending.setdefault(key, []).append(call)
+            self._cond.notify_all()
+        return call.future.result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return batch fill and queueing-delay metrics since process start."""
+        with self._cond:
+            stats = dict(self._stats)
+            per_class = {p: dict(values) for p, values in stats.pop("per_class").items()}
+            queued_by_class = {p: 0 for p in PRIORITY_CLASSES}
+            for calls in self._pending.values():
+                for call in calls:
+                    queued_by_class[call.priority] += 1
+            queued = sum(queued_by_class.values())
+        batches = stats["batches"] or 1
+        calls = stats["calls"] or 1
+        return {
+            "name": self.name,
+            "window_ms": round(self._window * 1000, 3),
+            "max_batch_size": self._max_batch_size,
+            "calls": stats["calls"],
+            "items": stats["items"],
+            "batches": stats["batches"],
+            "errors": stats["errors"],
+            "aged_calls": stats["aged_calls"],
+            "queued_calls": queued,
+            "avg_items_per_batch": round(stats["items"] / batches, 3),
+            "avg_calls_per_batch": round(stats["calls"] / batches, 3),
+            "avg_fill_ratio": round(stats["fill_ratio_sum"] / batches, 4),
+            "avg_queue_delay_ms": round(stats["queue_delay_ms_sum"] / calls, 3),
+            "max_queue_delay_ms": round(stats["queue_delay_ms_max"], 3),
+            "classes": {
+                p: {
+                    "queued_calls": queued_by_class[p],
+                    "calls": values["calls"],
+                    "avg_queue_delay_ms": round(values["queue_delay_ms_sum"] / (values["calls"] or 1), 3),
+                    "max_queue_delay_ms": round(values["queue_delay_ms_max"], 3),
+                }
+                for p, values in per_class.items()
+            },
+        }
+
+    # ----------------------------------------------------------------
+    # Worker
+    # ----------------------------------------------------------------
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._loop,
+                name=f"micro-batcher-{self.name}",
+                daemon=True,
+            )
+            self._worker.start()
+
+    def _loop(self) -> None:
+        while True:
+            self._free_workers.acquire()
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                ready = self._next_ready_batch()
+            if ready is None:
+                self._free_workers.release()
+                continue
+            key, calls = ready
+            self._executor.submit(self._run_batch_and_free_worker, key, calls)
+
+    def _next_ready_batch(self) -> tuple[Hashable, List[_PendingCall]] | None:
+        """
+        Wait (holding the condition) until some key's batch is full or its window expired.
+        Among ready keys, the one holding the most urgent priority class goes first.
+        """
+        while True:
+            now = time.perf_counter()
+            earliest_deadline = None
+            ready_key: Hashable = None
+            ready_rank = len(PRIORITY_CLASSES)  # stays here while no key is ready (None is a valid key)
+            for key, calls in self._pending.items():
+                size = sum(len(c.items) for c in calls)
+                # Calls are re-sorted by class in `_take`, so the oldest call may not be first.
+                deadline = min(c.enqueued_at for c in calls) + self._window
+                if size >= self._max_batch_size or now >= deadline:
+                    rank = min(self._rank(c, now) for c in calls)
+                    if rank < ready_rank:
+                        ready_key, ready_rank = key, rank
+                elif earliest_deadline is None or deadline < earliest_deadline:
+                    earliest_deadline = deadline
+            if ready_rank < len(PRIORITY_CLASSES):
+                return ready_key, self._take(ready_key)
+            if earliest_deadline is None:
+                return None
+            self._cond.wait(timeout=max(earliest_deadline - now, 0.0))
+
+    def _rank(self, call: _PendingCall, now: float) -> int:
+        """Index of the class `call` competes as; aged calls rank with the top class."""
+        if self._aging > 0 and now - call.enqueued_at >= self._aging:
+            return 0
+        return PRIORITY_CLASSES.index(call.priority)
+
+    def _take(self, key: Hashable) -> List[_PendingCall]:
+        # Interactive (and aged) calls fill the batch first, oldest first within a rank.
+        now = time.perf_counter()
+        calls = sorted(self._pending[key], key=lambda c: (self._rank(c, now), c.enqueued_at))
+        self._pending[key] = calls
+        taken: List[_PendingCall] = []
+        size = 0
+        while calls and (not taken or size + len(calls[0].items) <= self._max_batch_size):
+            call = calls.pop(0)
+            if call.priority != PRIORITY_CLASSES[0] and self._rank(call, now) == 0:
+                self._stats["aged_calls"] += 1
+            taken.append(call)
+            size += len(call.items)
+        if not calls:
+            del self._pending[key]
+        return taken
+
+    def _run_batch_and_free_worker(self, key: Hashable, calls: List[_PendingCall]) -> None:
+        try:
+            self._run_batch(key, calls)
+        finally:
+            self._free_workers.release()
+
+    def _run_batch(self, key: Hashable, calls: List[_PendingCall]) -> None:
+        started = time.perf_counter()
+        flat: List[Any] = [item for call in calls for item in call.items]
+        self._record(calls, len(flat), started)
+        try:
+            # The upstream call (e.g. through the model governor) runs at the batch's most urgent class.
+            with priority_scope(highest_priority(call.priority for call in calls)):
+                results = self._batch_fn(key, flat)
+            if len(results) != len(flat):
+                raise RuntimeError(
+                    f"{self.name} batch returned {len(results)} results for {len(flat)} items"
+                )
+        except Exception as exc:
+            with self._cond:
+                self._stats["errors"] += 1
+            for call in calls:
+                call.future.set_exception(exc)
+            return
+
+        offset = 0
+        for call in calls:
+            call.future.set_result(results[offset:offset + len(call.items)])
+            offset += len(call.items)
+
+    def _record(self, calls: List[_PendingCall], size: int, started: float) -> None:
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["calls"] += len(calls)
+            self._stats["items"] += size
+            self._stats["fill_ratio_sum"] += min(size / self._max_batch_size, 1.0)
+            for call in calls:
+                delay_ms = (started - call.enqueued_at) * 1000
+                self._stats["queue_delay_ms_sum"] += delay_ms
+                if delay_ms > self._stats["queue_delay_ms_max"]:
+                    self._stats["queue_delay_ms_max"] = delay_ms
+                per_class = self._stats["per_class"][call.priority]
+                per_class["calls"] += 1
+                per_class["queue_delay_ms_sum"] += delay_ms
+                per_class["queue_delay_ms_max"] = max(per_class["queue_delay_ms_max"], delay_ms)
@@ -0,0 +1,406 @@
+"""
+Process-wide governor for Gemini generation and embedding calls.
+
+Every model call waits for a grant from the lane of its model. A lane enforces:
+- requests per minute and tokens per minute (token buckets refilled continuously),
+- a cap on concurrent calls,
+- strict priority between classes (see `pipeline.priority`), FIFO within a class: a waiting
+  interactive call is always granted before a waiting batch call, except that a batch call
+  waiting longer than `batch_aging_seconds` competes as interactive (starvation guard).
+Token use is estimated before the call (prompt estimate + expected output) and reconciled with
+the provider's usage metadata afterwards. A provider 429 pauses the lane briefly instead of
+letting every waiting caller hit the quota again.
+
+`govern_client(client)` wraps a google-genai client so that `client.models.generate_content`,
+`generate_content_stream` and `embed_content` go through the governor; everything else
+(e.g. `client.caches`) is passed through untouched.
+"""
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+from pipeline.priority import PRIORITY_CLASSES, current_priority
+from pipeline.prompt_builder import estimate_tokens
+
+_RATE_LIMIT_MARKERS = ("429", "resource_exhausted", "resource exhausted", "rate limit", "quota")
+
+
+class ModelQuotaTimeout(RuntimeError):
+    """A model call waited longer than the governor's max wait for quota."""
+
+
+class _TokenBucket:
+    """Continuously refilled bucket holding at most one minute of quota (rate 0 = unlimited)."""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float]) -> None:
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._rate = self.capacity / 60.0
+        self._clock = clock
+        self._updated = clock()
+
+    def refill(self) -> None:
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_seconds(self, amount: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        # A single call larger than the whole bucket only has to wait for a full bucket.
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self._rate, 0.0) if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        # `amount` is negative when a call used fewer tokens than reserved; never refund past full.
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level - amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "enqueued_at")
+
+    def __init__(self, priority: str, tokens: int, enqueued_at: float) -> None:
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued_at = enqueued_at
+
+
+class _ModelLane:
+    def __init__(self, model: str, rpm: int, tpm: int, max_concurrent: int, clock: Callable[[], float]) -> None:
+        self.model = model
+        self.requests = _TokenBucket(rpm, clock)
+        self.tokens = _TokenBucket(tpm, clock)
+        self.max_concurrent = max(int(max_concurrent), 1)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITY_CLASSES}
+        self.stats: Dict[str, Any] = {
+            "calls": 0,
+            "rate_limited": 0,
+            "timeouts": 0,
+            "aged_grants": 0,
+            "estimated_tokens": 0,
+            "actual_tokens": 0,
+            "per_class": {p: {"grants": 0, "wait_ms_sum": 0.0, "wait_ms_max": 0.0} for p in PRIORITY_CLASSES},
+        }
+
+
+class ModelGovernor:
+    """Per-model RPM/TPM/concurrency limits with strict priority (plus aging) across classes."""
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, int]],
+        default_limits: Dict[str, int],
+        batch_aging_seconds: float = 30.0,
+        max_wait_seconds: float = 60.0,
+        rate_limit_pause_seconds: float = 5.0,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.limits = limits
+        self.default_limits = default_limits
+        self.batch_aging_seconds = max(float(batch_aging_seconds), 0.0)
+        self.max_wait_seconds = max_wait_seconds
+        self.rate_limit_pause_seconds = rate_limit_pause_seconds
+        self.enabled = enabled
+        self._clock = clock
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, model: str, estimated_tokens: int, priority: Optional[str] = None) -> None:
+        """Block until the call may start; raises ModelQuotaTimeout after max_wait_seconds."""
+        if not self.enabled:
+            return
+        priority = priority if priority in PRIORITY_CLASSES else current_priority()
+        with self._cond:
+            lane = self._lane(model)
+            queue = lane.queues[priority]
+            waiter = _Waiter(priority, max(int(estimated_tokens), 1), self._clock())
+            queue.append(waiter)
+            deadline = waiter.enqueued_at + self.max_wait_seconds
+            while True:
+                delay = self._grant_delay(lane, waiter)
+                if delay == 0.0:
+                    break
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    queue.remove(waiter)
+                    lane.stats["timeouts"] += 1
+                    self._cond.notify_all()
+                    raise ModelQuotaTimeout(
+                        f"{model}: no quota within {self.max_wait_seconds:g}s ({priority} call)"
+                    )
+                self._cond.wait(timeout=min(delay, remaining) if delay > 0 else remaining)
+
+            queue.popleft()
+            lane.requests.take(1)
+            lane.tokens.take(waiter.tokens)
+            lane.in_flight += 1
+            if priority != PRIORITY_CLASSES[0] and self._aged(waiter):
+                lane.stats["aged_grants"] += 1
+            waited_ms = (self._clock() - waiter.enqueued_at) * 1000
+            per_class = lane.stats["per_class"][priority]
+            per_class["grants"] += 1
+            per_class["wait_ms_sum"] += waited_ms
+            per_class["wait_ms_max"] = max(per_class["wait_ms_max"], waited_ms)
+            lane.stats["calls"] += 1
+            lane.stats["estimated_tokens"] += waiter.tokens
+            self._cond.notify_all()
+
+    def release(self, model: str, estimated_tokens: int, actual_tokens: Optional[int] = None, error: Optional[BaseException] = None) -> None:
+        """End a call: free its slot, correct the token bucket, pause the lane on a provider 429."""
+        if not self.enabled:
+            return
+        with self._cond:
+            lane = self._lane(model)
+            lane.in_flight = max(lane.in_flight - 1, 0)
+            if actual_tokens is not None:
+                # Bring the bucket up to date first, or the correction is applied to a stale level.
+                lane.tokens.refill()
+                lane.tokens.take(actual_tokens - max(int(estimated_tokens), 1))
+                lane.stats["actual_tokens"] += actual_tokens
+            if error is not None and _is_rate_limited(error):
+                lane.stats["rate_limited"] += 1
+                lane.paused_until = max(lane.paused_until, self._clock() + self.rate_limit_pause_seconds)
+                print(f"[WARN] {model} rate limited upstream; pausing new calls for {self.rate_limit_pause_seconds:g}s.")
+            self._cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            report: Dict[str, Any] = {}
+            for model, lane in self._lanes.items():
+                lane.requests.refill()
+                lane.tokens.refill()
+                per_class = {}
+                for p, stats in lane.stats["per_class"].items():
+                    grants = stats["grants"] or 1
+                    per_class[p] = {
+                        "queued": len(lane.queues[p]),
+                        "grants": stats["grants"],
+                        "avg_wait_ms": round(stats["wait_ms_sum"] / grants, 3),
+                        "max_wait_ms": round(stats["wait_ms_max"], 3),
+                    }
+                report[model] = {
+                    "rpm_limit": lane.requests.capacity or None,
+                    "tpm_limit": lane.tokens.capacity or None,
+                    "requests_available": round(lane.requests.level, 1) if lane.requests.capacity else None,
+                    "tokens_available": round(lane.tokens.level, 1) if lane.tokens.capacity else None,
+                    "max_concurrent": lane.max_concurrent,
+                    "in_flight": lane.in_flight,
+                    "calls": lane.stats["calls"],
+                    "rate_limited": lane.stats["rate_limited"],
+                    "timeouts": lane.stats["timeouts"],
+                    "aged_grants": lane.stats["aged_grants"],
+                    "estimated_tokens": lane.stats["estimated_tokens"],
+                    "actual_tokens": lane.stats["actual_tokens"],
+                    "classes": per_class,
+                }
+            return {"enabled": self.enabled, "models": report}
+
+    # ----------------------------------------------------------------
+    # Internals (called with the condition held)
+    # ----------------------------------------------------------------
+    def _lane(self, model: str) -> _ModelLane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            limits = {**self.default_limits, **self.limits.get(model, {})}
+            lane = self._lanes[model] = _ModelLane(
+                model, limits["rpm"], limits["tpm"], limits["max_concurrent"], self._clock
+            )
+        return lane
+
+    def _aged(self, waiter: _Waiter) -> bool:
+        return self.batch_aging_seconds > 0 and self._clock() - waiter.enqueued_at >= self.batch_aging_seconds
+
+    def _grant_delay(self, lane: _ModelLane, waiter: _Waiter) -> float:
+        """0.0 if `waiter` may start now, else seconds to wait (-1.0 = until notified)."""
+        heads = [lane.queues[p][0] for p in PRIORITY_CLASSES if lane.queues[p]]
+        # Strict priority; aged lower-class calls rank with the top class, oldest first.
+        head = min(
+            heads,
+            key=lambda w: (0 if w.priority == PRIORITY_CLASSES[0] or self._aged(w) else 1, w.enqueued_at),
+        )
+        if head is not waiter:
+            aging = waiter.priority != PRIORITY_CLASSES[0] and self.batch_aging_seconds > 0
+            if aging and lane.queues[waiter.priority][0] is waiter:
+                # Wake up when this call ages, even if no grant or release notifies first.
+                return max(waiter.enqueued_at + self.batch_aging_seconds - self._clock(), 0.001)
+            return -1.0
+        if lane.in_flight >= lane.max_concurrent:
+            return -1.0
+        now = self._clock()
+        if now < lane.paused_until:
+            return lane.paused_until - now
+        lane.requests.refill()
+        lane.tokens.refill()
+        delay = max(lane.requests.wait_seconds(1), lane.tokens.wait_seconds(waiter.tokens))
+        return delay if delay > 0 else 0.0
+
+
+class _GovernedModels:
+    """Drop-in for `client.models` that runs generation and embedding calls through the governor."""
+
+    def __init__(self, models: Any, governor: Callable[[], ModelGovernor], output_tokens_estimate: Callable[[], int]) -> None:
+        self._models = models
+        self._governor = governor
+        self._output_tokens_estimate = output_tokens_estimate
+
+    def generate_content(self, *, model: str, contents: Any, **kwargs: Any) -> Any:
+        governor = self._governor()
+        estimate = _estimate_content_tokens(contents) + self._output_tokens_estimate()
+        governor.acquire(model, estimate)
+        response = None
+        error = None
+        try:
+            response = self._models.generate_content(model=model, contents=contents, **kwargs)
+            return response
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            governor.release(model, estimate, _usage_tokens(response), error)
+
+    def generate_content_stream(self, *, model: str, contents: Any, **kwargs: Any) -> Iterator[Any]:
+        """
+        Lazy: the slot is acquired (and the upstream stream opened) on the first `next()`, so a
+        stream that is never iterated holds nothing. Priority is taken from the calling request.
+        """
+        governor = self._governor()
+        estimate = _estimate_content_tokens(contents) + self._output_tokens_estimate()
+        opener = functools.partial(self._models.generate_content_stream, model=model, contents=contents, **kwargs)
+        return _governed_stream(opener, governor, model, estimate, current_priority())
+
+    def embed_content(self, *, model: str, contents: Any, **kwargs: Any) -> Any:
+        governor = self._governor()
+        estimate = _estimate_content_tokens(contents)
+        governor.acquire(model, estimate)
+        error = None
+        try:
+            return self._models.embed_content(model=model, contents=contents, **kwargs)
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            # Embedding responses carry no usage metadata; the estimate stands.
+            governor.release(model, estimate, None, error)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._models, name)
+
+
+class GovernedClient:
+    """Wrapper around a google-genai client whose `models` calls are governed."""
+
+    def __init__(self, inner: Any) -> None:
+        self._inner = inner
+        self.models = _GovernedModels(inner.models, get_model_governor, _output_tokens_estimate)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._inner, name)
+
+
+def govern_client(client: Any) -> GovernedClient:
+    return client if isinstance(client, GovernedClient) else GovernedClient(client)
+
+
+def _governed_stream(
+    opener: Callable[[], Any],
+    governor: ModelGovernor,
+    model: str,
+    estimate: int,
+    priority: str,
+) -> Iterator[Any]:
+    """
+    Acquire on first iteration and hold the slot until the stream is exhausted, fails or is
+    closed (explicitly or when the generator is collected); reconcile with the last usage seen.
+    """
+    governor.acquire(model, estimate, priority)
+    last = None
+    error = None
+    try:
+        for chunk in opener():
+            if getattr(chunk, "usage_metadata", None) is not None:
+                last = chunk
+            yield chunk
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        governor.release(model, estimate, _usage_tokens(last), error)
+
+
+def _estimate_content_tokens(contents: Any) -> int:
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    if isinstance(contents, dict):
+        return sum(_estimate_content_tokens(p.get("text", "")) for p in contents.get("parts") or [] if isinstance(p, dict))
+    if isinstance(contents, (list, tuple)):
+        return sum(_estimate_content_tokens(c) for c in contents)
+    parts = getattr(contents, "parts", None)
+    if parts:
+        return sum(estimate_tokens(getattr(p, "text", None) or "") for p in parts)
+    return 0
+
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None) if response is not None else None
+    if usage is None:
+        return None
+    total = getattr(usage, "total_token_count", None)
+    if total is None:
+        total = (getattr(usage, "prompt_token_count", None) or 0) + (getattr(usage, "candidates_token_count", None) or 0)
+    return int(total) if total else None
+
+
+def _is_rate_limited(error: BaseException) -> bool:
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in _RATE_LIMIT_MARKERS)
+
+
+_governor: Optional[ModelGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_model_governor() -> ModelGovernor:
+    """Process-wide governor configured from config.py."""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            from config import (
+                MODEL_GOVERNOR_ENABLED,
+                MODEL_LIMITS,
+                MODEL_DEFAULT_LIMITS,
+                MODEL_GOVERNOR_BATCH_AGING_SECONDS,
+                MODEL_GOVERNOR_MAX_WAIT_SECONDS,
+                MODEL_GOVERNOR_RATE_LIMIT_PAUSE_SECONDS,
+            )
+
+            _governor = ModelGovernor(
+                limits=MODEL_LIMITS,
+                default_limits=MODEL_DEFAULT_LIMITS,
+                batch_aging_seconds=MODEL_GOVERNOR_BATCH_AGING_SECONDS,
+                max_wait_seconds=MODEL_GOVERNOR_MAX_WAIT_SECONDS,
+                rate_limit_pause_seconds=MODEL_GOVERNOR_RATE_LIMIT_PAUSE_SECONDS,
+                enabled=MODEL_GOVERNOR_ENABLED,
+            )
+        return _governor
+
+
+def get_model_governor_stats() -> Dict[str, Any]:
+    with _governor_lock:
+        governor = _governor
+    return governor.get_stats() if governor is not None else {}
+
+
+def _output_tokens_estimate() -> int:
+    from config import MODEL_GOVERNOR_OUTPUT_TOKENS
+
+    return MODEL_GOVERNOR_OUTPUT_TOKENS
@@ -0,0 +1,98 @@
+"""
+Request priority classes.
+The priority of the request being served travels in a context variable, so shared
+schedulers (the model-call governor, the micro-batchers, admission and job queues) can order
+waiting work without threading a parameter through every agent. Work handed to a thread pool
+must be wrapped with `with_current_priority` because pool threads do not inherit the context
+(the wrapper carries the whole context, including the run's token log).
+"""
+from __future__ import annotations
+
+import contextvars
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, TypeVar
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITY_CLASSES = (INTERACTIVE, BATCH)  # highest first
+
+_current_priority: contextvars.ContextVar[str] = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+T = TypeVar("T")
+
+_LATENCY_SAMPLES = 1000  # recent requests kept per (class, endpoint) for percentiles
+_latency_lock = threading.Lock()
+_latencies: Dict[tuple[str, str], Dict[str, Any]] = {}
+
+
+def current_priority() -> str:
+    return _current_priority.get()
+
+
+def highest_priority(priorities: Iterable[str]) -> str:
+    """The most urgent class among `priorities` (batch if empty)."""
+    present = set(priorities)
+    return next((p for p in PRIORITY_CLASSES if p in present), PRIORITY_CLASSES[-1])
+
+
+@contextmanager
+def priority_scope(priority: str) -> Iterator[None]:
+    """Run the enclosed block (and model calls made from it) under `priority`."""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def with_current_priority(fn: Callable[..., T]) -> Callable[..., T]:
+    """Bind the caller's context (priority, run token log) to `fn`, for work on another thread."""
+    context = contextvars.copy_context()
+
+    def _run(*args: Any, **kwargs: Any) -> T:
+        # A context can only be entered by one thread at a time, so each call runs in its own copy.
+        return context.copy().run(fn, *args, **kwargs)
+
+    return _run
+
+
+def record_latency(priority: str, endpoint: str, seconds: float) -> None:
+    """Record one end-to-end request latency (queueing included) for `priority` on `endpoint`."""
+    with _latency_lock:
+        entry = _latencies.get((priority, endpoint))
+        if entry is None:
+            entry = {"count": 0, "sum": 0.0, "max": 0.0, "recent": deque(maxlen=_LATENCY_SAMPLES)}
+            _latencies[(priority, endpoint)] = entry
+        entry["count"] += 1
+        entry["sum"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        entry["recent"].append(seconds)
+
+
+def get_priority_latency_stats() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Per class and endpoint: request count, mean/max and p50/p95 over recent requests (ms)."""
+    with _latency_lock:
+        snapshot = {
+            key: (entry["count"], entry["sum"], entry["max"], sorted(entry["recent"]))
+            for key, entry in _latencies.items()
+        }
+    stats: Dict[str, Dict[str, Dict[str, Any]]] = {p: {} for p in PRIORITY_CLASSES}
+    for (priority, endpoint), (count, total, longest, recent) in snapshot.items():
+        stats[priority][endpoint] = {
+            "requests": count,
+            "avg_ms": round(total / count * 1000, 3),
+            "p50_ms": round(_percentile(recent, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(recent, 0.95) * 1000, 3),
+            "max_ms": round(longest * 1000, 3),
+        }
+    return stats
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
@@ -0,0 +1,139 @@
+"""
+Shared prompt-building helpers for the LLM agents.
+Compact JSON serialization (no indentation, nulls/empties and duplicate list items stripped),
+per-field truncation under a token budget, a local token estimator, and per-agent
+before/after prompt-size counters.
+"""
+from __future__ import annotations
+
+import json
+import math
+import threading
+from typing import Any, Dict, Iterable, List
+
+_ELLIPSIS = "…"
+_size_lock = threading.Lock()
+_size_stats: Dict[str, Dict[str, float]] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate: ~4 characters per token for ASCII text and ~1.5 for
+    non-ASCII scripts such as Thai, which tokenize much more densely.
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_chars = len(text) - non_ascii
+    return math.ceil(ascii_chars / 4 + non_ascii / 1.5)
+
+
+def strip_empty(obj: Any) -> Any:
+    """Recursively drop None/NaN/empty values and duplicate list items."""
+    if isinstance(obj, dict):
+        cleaned = {k: strip_empty(v) for k, v in obj.items()}
+        return {k: v for k, v in cleaned.items() if not _is_empty(v)}
+    if isinstance(obj, (list, tuple)):
+        seen: set[str] = set()
+        items: List[Any] = []
+        for item in obj:
+            item = strip_empty(item)
+            if _is_empty(item):
+                continue
+            marker = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+            if marker in seen:
+                continue
+            seen.add(marker)
+            items.append(item)
+        return items
+    return obj
+
+
+def compact_json(obj: Any) -> str:
+    """Serialize without whitespace after stripping nulls, empties and duplicates."""
+    return json.dumps(strip_empty(obj), ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Cut text so its estimated size stays within `max_tokens`."""
+    if not isinstance(text, str) or estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + _ELLIPSIS
+
+
+def fit_records_to_budget(
+    records: List[Dict[str, Any]],
+    truncatable_fields: Iterable[str],
+    budget_tokens: int,
+    min_field_tokens: int = 16,
+) -> List[Dict[str, Any]]:
+    """
+    Shrink the given free-text fields across all records (halving a shared per-field cap)
+    until the compact serialization fits `budget_tokens` or the cap reaches `min_field_tokens`.
+    Other fields are never touched.
+    """
+    fields = list(truncatable_fields)
+    records = [strip_empty(r) for r in records]
+    if estimate_tokens(compact_json(records)) <= budget_tokens:
+        return records
+
+    longest = max(
+        (estimate_tokens(r.get(f, "")) for r in records for f in fields if isinstance(r.get(f), str)),
+        default=0,
+    )
+    cap = max(longest // 2, min_field_tokens)
+    while True:
+        fitted = [
+            {k: truncate_text(v, cap) if k in fields else v for k, v in r.items()}
+            for r in records
+        ]
+        if cap <= min_field_tokens or estimate_tokens(compact_json(fitted)) <= budget_tokens:
+            return fitted
+        cap = max(cap // 2, min_field_tokens)
+
+
+def record_prompt_size(agent: str, before_text: str, after_text: str) -> Dict[str, int]:
+    """Track estimated prompt tokens before/after compaction; returns this call's numbers."""
+    before = estimate_tokens(before_text)
+    after = estimate_tokens(after_text)
+    with _size_lock:
+        stats = _size_stats.setdefault(agent, {"calls": 0, "before_tokens": 0, "after_tokens": 0})
+        stats["calls"] += 1
+        stats["before_tokens"] += before
+        stats["after_tokens"] += after
+    return {"prompt_tokens_est_before": before, "prompt_tokens_est_after": after}
+
+
+def get_prompt_size_stats() -> Dict[str, Dict[str, Any]]:
+    """Per-agent average estimated prompt size before and after compaction."""
+    with _size_lock:
+        snapshot = {agent: dict(stats) for agent, stats in _size_stats.items()}
+    report: Dict[str, Dict[str, Any]] = {}
+    for agent, stats in snapshot.items():
+        calls = stats["calls"] or 1
+        before = stats["before_tokens"]
+        after = stats["after_tokens"]
+        report[agent] = {
+            "calls": int(stats["calls"]),
+            "avg_tokens_before": round(before / calls, 1),
+            "avg_tokens_after": round(after / calls, 1),
+            "reduction_pct": round((1 - after / before) * 100, 1) if before else None,
+        }
+    return report
+
+
+def _is_empty(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    if isinstance(value, (str, list, tuple, dict)) and len(value) == 0:
+        return True
+    return False
@@ -0,0 +1,120 @@
+"""
+Whole-report cache for `run_full_pipeline`.
+
+A report only changes when the student makes a new attempt or the course catalog changes, so
+finished pipeline outputs are stored per exam attempt (`current_test_result.id`), request
+parameters and catalog version, with one output per summary language. Agent 1 still runs on
+every request: it is a local data read, and it is what detects a newer attempt. When it reports
+a different attempt id for a (student, test) than the one seen last, every report stored for
+the previous attempt is dropped.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pipeline.cache import TTLCache, stable_hash
+
+
+class ReportCache:
+    """Pipeline outputs keyed by attempt + parameters + catalog version, invalidated per attempt."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._reports = TTLCache(name="pipeline_reports", maxsize=maxsize, ttl_seconds=ttl_seconds)
+        # (student, test) -> (latest attempt id, report keys stored for it); LRU-bounded like the reports.
+        self._attempts: "OrderedDict[Tuple[str, str], Tuple[str, List[str]]]" = OrderedDict()
+        self._max_attempts = max(int(maxsize), 1)
+        self._lock = threading.Lock()
+        self._stats = {"new_attempts": 0, "invalidated_reports": 0, "stale_writes_skipped": 0}
+
+    @staticmethod
+    def report_key(exam_result_id: Any, catalog_version: Optional[str], **params: Any) -> str:
+        """Key over everything except the language, which selects an output inside the entry."""
+        return stable_hash(str(exam_result_id), catalog_version, {k: str(v) for k, v in params.items()})
+
+    def observe_attempt(self, student_id: Any, test_id: Any, exam_result_id: Any) -> bool:
+        """Record the latest attempt seen by agent 1; returns True if an older attempt was invalidated."""
+        if not self.enabled:
+            return False
+        owner = (str(student_id), str(test_id))
+        attempt = str(exam_result_id)
+        with self._lock:
+            previous = self._attempts.get(owner)
+            if previous is not None and previous[0] == attempt:
+                self._attempts.move_to_end(owner)
+                return False
+            self._attempts[owner] = (attempt, [])
+            self._attempts.move_to_end(owner)
+            while len(self._attempts) > self._max_attempts:
+                self._attempts.popitem(last=False)
+            if previous is None:
+                return False
+            stale_keys = previous[1]
+            self._stats["new_attempts"] += 1
+            self._stats["invalidated_reports"] += len(stale_keys)
+        for key in stale_keys:
+            self._reports.delete(key)
+        print(f"[ReportCache] New attempt {attempt} for {owner}; dropped {len(stale_keys)} cached reports.")
+        return True
+
+    def get(self, key: str, language: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        outputs = self._reports.get(key)
+        return outputs.get(language) if outputs else None
+
+    def put(
+        self,
+        student_id: Any,
+        test_id: Any,
+        exam_result_id: Any,
+        key: str,
+        outputs: Dict[str, Dict[str, Any]],
+    ) -> None:
+        """Store {language: output}; skipped if a newer attempt was observed while the run was in flight."""
+        if not self.enabled or not outputs:
+            return
+        owner = (str(student_id), str(test_id))
+        with self._lock:
+            tracked = self._attempts.get(owner)
+            if tracked is None or tracked[0] != str(exam_result_id):
+                self._stats["stale_writes_skipped"] += 1
+                return
+            if key not in tracked[1]:
+                tracked[1].append(key)
+        merged = dict(self._reports.get(key) or {})
+        merged.update(outputs)
+        self._reports.set(key, merged)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            tracked = len(self._attempts)
+        return {"enabled": self.enabled, "tracked_attempts": tracked, **stats, **self._reports.get_stats()}
+
+
+_report_cache: Optional[ReportCache] = None
+_report_cache_lock = threading.Lock()
+
+
+def get_report_cache() -> ReportCache:
+    """Process-wide report cache configured from config.py."""
+    global _report_cache
+    with _report_cache_lock:
+        if _report_cache is None:
+            from config import REPORT_CACHE_ENABLED, REPORT_CACHE_TTL_SECONDS, REPORT_CACHE_MAX_ENTRIES
+
+            _report_cache = ReportCache(
+                maxsize=REPORT_CACHE_MAX_ENTRIES,
+                ttl_seconds=REPORT_CACHE_TTL_SECONDS,
+                enabled=REPORT_CACHE_ENABLED,
+            )
+        return _report_cache
+
+
+def get_report_cache_stats() -> Dict[str, Any]:
+    with _report_cache_lock:
+        cache = _report_cache
+    return cache.get_stats() if cache is not None else {}
@@ -1,18 +1,23 @@
 """
 Lightweight run-scoped logging helpers for token usage.
 Agents append token stats here; pipeline reads once per run and writes to run_log.json.
+Each run's log lives in a context variable, so concurrent runs keep separate logs; work handed
+to a thread pool must be wrapped with `pipeline.priority.with_current_priority` to log into it.
 """
 from __future__ import annotations
 
+import contextvars
 import json
 from typing import Any, Dict, List
 
-_token_entries: List[Dict[str, Any]] = []
+_token_entries: contextvars.ContextVar[List[Dict[str, Any]] | None] = contextvars.ContextVar(
+    "token_entries", default=None
+)
 
 
 def reset_token_log() -> None:
-    """Clear token log for a new pipeline run."""
-    _token_entries.clear()
+    """Start an empty token log for the pipeline run in the current context."""
+    _token_entries.set([])
 
 
 def log_token_usage(
@@ -20,6 +25,7 @@ def log_token_usage(
     input_tokens: int | None,
     output_tokens: int | None,
     runtime_seconds: float | None,
+    details: Dict[str, Any] | None = None,
 ) -> None:
     entry = {
         "usage": usage,
@@ -27,7 +33,11 @@ def log_token_usage(
         "output_token": output_tokens if output_tokens is not None else 0,
         "runtime": round(runtime_seconds or 0.0, 4),
     }
-    _token_entries.append(entry)
+    if details:
+        entry["details"] = details
+    entries = _token_entries.get()
+    if entries is not None:  # calls made outside a pipeline run are not recorded
+        entries.append(entry)
 
 
 def extract_token_counts(response: Any) -> tuple[int | None, int | None]:
@@ -52,9 +62,19 @@ def extract_token_counts(response: Any) -> tuple[int | None, int | None]:
     return input_tokens, output_tokens
 
 
+def extract_cached_token_count(response: Any) -> int | None:
+    """Prompt tokens served from Gemini's prefix cache, when the response reports them."""
+    usage_meta = getattr(response, "usage_metadata", None)
+    if usage_meta is None and isinstance(response, dict):
+        usage_meta = response.get("usage_metadata")
+    if usage_meta is None:
+        return None
+    return _get_value(usage_meta, ["cached_content_token_count", "cached_tokens"])
+
+
 def get_token_entries() -> List[Dict[str, Any]]:
     """Return a shallow copy of the token log entries for the current run."""
-    return list(_token_entries)
+    return list(_token_entries.get() or [])
 
 
 def _get_value(usage_meta: Any, possible_keys: list[str]) -> int | None:
@@ -1,12 +1,14 @@
 # pipeline/run_pipeline.py
 import os
+import copy
 import time
 from functools import wraps
 import sys
 import json
+import threading
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Callable, Dict
 
 # --- Ensure project root is on sys.path (works both locally & in Docker) ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -16,8 +18,8 @@ if PROJECT_ROOT not in sys.path:
 
 from agents.agent1_test_context import get_student_test_history
 from agents.agent2_incorrect_questions import get_incorrect_question_cases
-from agents.agent3_weakness_extraction import extract_weaknesses_and_patterns
-from agents.agent4_course_recommendation import recommend_courses_for_student
+from agents.agent3_weakness_extraction import extract_weaknesses_and_patterns, stream_weaknesses_and_patterns
+from agents.agent4_course_recommendation import prefetch_candidates, recommend_courses_for_student
 from agents.agent5_user_facing_response import generate_user_facing_response
 
 from config import (
@@ -32,11 +34,16 @@ from config import (
     PARTICIPANT_RANKING,
     RUN_LOG_PATH,
     MIN_RECOMMENDATION_SCORE,
+    PIPELINE_STREAMING,
+    SUMMARY_MODE,
+    SUMMARY_ALT_LANGUAGE_MODE,
     Course,
     CourseScore,
     Weakness,
 )
-from pipeline.run_logging import reset_token_log, get_token_entries
+from agents.course_catalog import get_course_catalog
+from pipeline.report_cache import get_report_cache
+from pipeline.run_logging import reset_token_log, get_token_entries, log_token_usage
 
 def log_call(func):
     """Decorator that reports runtime for each function."""
@@ -62,10 +69,33 @@ def run_full_pipeline(
     max_courses: int = 5,
     participant_ranking: float | None = None,
     language: str = "EN",
-    rerank_courses: bool = True,
+    rerank_courses: bool | str = True,
     min_score: float = 0.5,
+    streaming: bool = PIPELINE_STREAMING,
+    summary_mode: str = SUMMARY_MODE,
+    on_event: Callable[[str, Dict[str, Any]], None] | None = None,
+    alt_language_mode: str = SUMMARY_ALT_LANGUAGE_MODE,
 ) -> Dict[str, Any]:
+    """
+    Run agents 1-5 for one student/test. `on_event(event, data)` is an optional progress hook:
+    a "stage" event carries each agent's JSON-safe output as soon as it completes, and agent 5
+    additionally streams "summary_field" / "paragraph_delta" events while it generates.
+
+    Finished reports are cached per exam attempt, parameters and course catalog version; a
+    repeat request runs only agent 1 (to detect a newer attempt, which invalidates the cache).
+    With `alt_language_mode` other than "off", agent 5 also writes the other summary language
+    and both outputs are cached, so the same request in the other language skips agents 2-5.
+    """
     reset_token_log()
+    language_code = (language or "EN").strip().upper()
+
+    def _stage_done(stage: str, started: float, output: Any) -> None:
+        if on_event is not None:
+            on_event("stage", {
+                "stage": stage,
+                "elapsed_seconds": round(time.perf_counter() - started, 3),
+                "output": _simplify_for_json(output),
+            })
 
     # ---------------- Agent 1 ----------------
     t_agent1 = time.perf_counter()
@@ -82,6 +112,34 @@ def run_full_pipeline(
             "message": "No current test for this student/test_id.",
         }
     print(f"Agent 1 completed successfully in {time.perf_counter() - t_agent1:.2f}s")
+    _stage_done("agent1", t_agent1, agent1_out)
+
+    # ---------------- Report cache ----------------
+    report_cache = get_report_cache()
+    exam_result_id = agent1_out["current_test_result"].get("id")
+    report_key = None
+    if report_cache.enabled and exam_result_id is not None:
+        report_cache.observe_attempt(student_id, test_id, exam_result_id)
+        report_key = report_cache.report_key(
+            exam_result_id,
+            _catalog_version(),
+            max_courses=max_courses,
+            participant_ranking=participant_ranking,
+            rerank_courses=rerank_courses,
+            min_score=min_score,
+            summary_mode=summary_mode,
+        )
+        cached_report = report_cache.get(report_key, language_code)
+        if cached_report is not None:
+            print(f"[Cache] Report for attempt {exam_result_id} ({language_code}) served from cache.")
+            log_token_usage(
+                usage="pipeline: report (cache hit)",
+                input_tokens=0,
+                output_tokens=0,
+                runtime_seconds=time.perf_counter() - t_agent1,
+                details={"exam_result_id": exam_result_id, "language": language_code},
+            )
+            return copy.deepcopy(cached_report)
 
     # ---------------- Agent 2 ----------------
     t_agent2 = time.perf_counter()
@@ -103,6 +161,7 @@ def run_full_pipeline(
     incorrect_cases = agent2_out["incorrect_questions"]
     all_correct = not incorrect_cases
     print(f"Agent 2 completed successfully in {time.perf_counter() - t_agent2:.2f}s")
+    _stage_done("agent2", t_agent2, agent2_out)
 
     weaknesses_llm = []
     course_rec_output = {"weaknesses": [], "recommendations": []}
@@ -110,7 +169,18 @@ def run_full_pipeline(
     if not all_correct:
         # ---------------- Agent 3 ----------------
         t_agent3 = time.perf_counter()
-        weaknesses_llm = extract_weaknesses_and_patterns(incorrect_cases)
+        prefetched = {}
+        if streaming:
+            # Agent 4 retrieval for each weakness starts while agent 3 is still generating.
+            def _prefetch(weakness: Dict[str, Any]) -> None:
+                weakness_id, future = prefetch_candidates(weakness, max_courses_pr_weakness=max_courses)
+                prefetched[weakness_id] = future
+                if on_event is not None:
+                    on_event("weakness", _simplify_for_json(weakness))
+
+            weaknesses_llm = stream_weaknesses_and_patterns(incorrect_cases, on_weakness=_prefetch)
+        else:
+            weaknesses_llm = extract_weaknesses_and_patterns(incorrect_cases)
         if not weaknesses_llm:
             return {
                 "status": "no_weaknesses",
@@ -119,6 +189,7 @@ def run_full_pipeline(
                 "weaknesses_raw": [],
             }  
         print(f"Agent 3:WeaknessExtraction completed successfully in {time.perf_counter() - t_agent3:.2f}s")
+        _stage_done("agent3", t_agent3, {"weaknesses": weaknesses_llm})
 
         # ---------------- Agent 4 ----------------
         t_agent4 = time.perf_counter()
@@ -129,8 +200,11 @@ def run_full_pipeline(
                 weaknesses_raw=weaknesses_llm,
                 max_courses_pr_weakness=max_courses,
                 rerank_enabled=rerank_courses,
+                min_score=min_score,
+                prefetched=prefetched,
             )
             print(f"Agent 4 completed vector search successfully in {time.perf_counter() - t_agent4:.2f}s")
+            _stage_done("agent4", t_agent4, course_rec_output)
         except Exception as e:
             print(e)
             print(f"[WARN] Vector search failed: {e}")
@@ -165,10 +239,14 @@ def run_full_pipeline(
         domain_performance=agent2_out.get("domain_performance"),
         language=language,
         min_score=min_score,
+        on_event=on_event,
+        summary_mode=summary_mode,
+        alt_language_mode=alt_language_mode,
     )
 
     print("Response in : ", language)
     print(f"Agent 5 completed successfully in {time.perf_counter() - t_agent5:.2f}s")
+    _stage_done("agent5", t_agent5, result)
 
     status_val = "ok" if not all_correct else "ok_all_correct"
     _write_run_log(
@@ -180,18 +258,43 @@ def run_full_pipeline(
         participant_ranking=participant_ranking,
         language=language,
         rerank_courses=rerank_courses,
+        streaming=streaming,
+        summary_mode=summary_mode,
+        alt_language_mode=alt_language_mode,
         final_response=result,
         min_score=min_score,
     )
 
+    if report_key is not None:
+        report_cache.put(student_id, test_id, exam_result_id, report_key, {
+            language_code: {"user_facing_paragraph": result.get("user_facing_paragraph", "")},
+            **{
+                lang: {"user_facing_paragraph": alt.get("user_facing_paragraph", "")}
+                for lang, alt in (result.get("alternate_languages") or {}).items()
+            },
+        })
+
     return {
         "user_facing_paragraph": result.get("user_facing_paragraph", ""),
     }
 
 
+def _catalog_version() -> str | None:
+    """Course catalog version for the report key (None if the catalog cannot be loaded)."""
+    try:
+        return get_course_catalog().version
+    except Exception as exc:
+        print(f"[WARN] Course catalog version unavailable for the report cache: {exc}")
+        return None
+
+
 # --------------------------------------------------------------------
 # Logging helpers
 # --------------------------------------------------------------------
+# Concurrent runs (server threads, job workers) rewrite the same file; serialize read-modify-write.
+_run_log_lock = threading.Lock()
+
+
 def _write_run_log(**payload: Any) -> None:
     """
     Append a JSON entry with run metadata, agent outputs, final response, and token log snapshot.
@@ -203,9 +306,10 @@ def _write_run_log(**payload: Any) -> None:
         "token_log": get_token_entries(),
     }
     run_entry = _simplify_for_json(run_entry_raw)
-    entries = _read_run_log_entries(log_file)
-    entries.append(run_entry)
-    log_file.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+    with _run_log_lock:
+        entries = _read_run_log_entries(log_file)
+        entries.append(run_entry)
+        log_file.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
 def _read_run_log_entries(log_file: Path) -> list[Any]:
@@ -0,0 +1,53 @@
+"""
+Single-flight request coalescing.
+Concurrent callers that ask for the same key share one execution: the first caller runs the
+function, the others wait for its result (or its exception) instead of running it again.
+Nothing is cached once the call finishes; the next caller starts a new execution.
+"""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls per key."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "shared": 0, "in_flight_max": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (result, shared); `shared` is True when another caller's execution was joined."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats["shared"] += 1
+                leader = False
+            else:
+                future = Future()
+                self._calls[key] = future
+                self._stats["executions"] += 1
+                self._stats["in_flight_max"] = max(self._stats["in_flight_max"], len(self._calls))
+                leader = True
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(fn())
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return future.result(), False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = len(self._calls)
+        return {"name": self.name, "in_flight": in_flight, **stats}
@@ -0,0 +1,122 @@
+"""
+Incremental parsers for streamed top-level JSON containers.
+
+LLM output arrives in arbitrary text chunks. The parsers track string / escape state and
+bracket depth, and return each top-level member as soon as it is complete, so downstream
+work can start before the whole document has been generated:
+- `JsonArrayStreamParser` yields array elements,
+- `JsonObjectStreamParser` yields (key, value) pairs of an object.
+Anything before the opening bracket (e.g. a ```json fence) is ignored.
+"""
+from __future__ import annotations
+
+import ast
+import json
+from typing import Any, List, Tuple
+
+
+class _TopLevelStreamScanner:
+    """Split a streamed container into its top-level members; subclasses parse each member."""
+
+    open_char = "["
+    close_char = "]"
+
+    def __init__(self) -> None:
+        self.text = ""  # full text received so far (for a non-incremental fallback)
+        self.elements_parsed = 0
+        self.elements_failed = 0
+        self._started = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member: List[str] = []
+
+    @property
+    def done(self) -> bool:
+        """True once the closing bracket of the top-level container has been seen."""
+        return self._done
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume a chunk; return the members completed within it."""
+        completed: List[Any] = []
+        if not chunk:
+            return completed
+        self.text += chunk
+        for ch in chunk:
+            if self._done:
+                break
+            if not self._started:
+                if ch == self.open_char:
+                    self._started = True
+                continue
+
+            if self._in_string:
+                self._member.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0:
+                if ch == self.close_char:
+                    self._flush(completed)
+                    self._done = True
+                    continue
+                if ch == ",":
+                    self._flush(completed)
+                    continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+            self._member.append(ch)
+            if self._depth == 0 and ch in "}]":
+                # A nested container just closed: the member is complete without waiting for ",".
+                self._flush(completed)
+        return completed
+
+    def _flush(self, completed: List[Any]) -> None:
+        raw = "".join(self._member).strip()
+        self._member = []
+        if not raw:
+            return
+        try:
+            value = self._parse_member(raw)
+        except Exception:
+            self.elements_failed += 1
+            return
+        self.elements_parsed += 1
+        completed.append(value)
+
+    def _parse_member(self, raw: str) -> Any:
+        raise NotImplementedError
+
+
+class JsonArrayStreamParser(_TopLevelStreamScanner):
+    """Yield complete elements of a top-level JSON array from streamed text chunks."""
+
+    def _parse_member(self, raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return ast.literal_eval(raw)
+
+
+class JsonObjectStreamParser(_TopLevelStreamScanner):
+    """Yield (key, value) pairs of a top-level JSON object from streamed text chunks."""
+
+    open_char = "{"
+    close_char = "}"
+
+    def _parse_member(self, raw: str) -> Tuple[str, Any]:
+        parsed = json.loads("{" + raw + "}")
+        if len(parsed) != 1:
+            raise ValueError(f"Expected one key/value pair, got {len(parsed)}")
+        return next(iter(parsed.items()))
@@ -0,0 +1,71 @@
+"""
+Shared test fixtures.
+config.py refuses to import without GOOGLE_API_KEY; a placeholder is enough because the tests
+never reach Gemini.
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Callable
+
+import pytest
+
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+
+
+@pytest.fixture
+def wait_until() -> Callable[..., None]:
+    """Poll `predicate` until it holds; fail the test after `timeout` seconds."""
+
+    def _wait(predicate: Callable[[], bool], timeout: float = 5.0, message: str = "condition") -> None:
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                pytest.fail(f"Timed out waiting for {message}.")
+            time.sleep(0.005)
+
+    return _wait
+
+
+COURSE_ROWS = [
+    {
+        "id": "c-sql",
+        "lesson_title": "SQL joins in practice",
+        "skill_name": "SQL",
+        "short_description": "Inner and outer joins.",
+        "description": "Combine tables with inner, left and full outer joins.",
+    },
+    {
+        "id": "c-grammar",
+        "lesson_title": "Passive voice",
+        "skill_name": "English grammar",
+        "short_description": "When to use the passive.",
+        "description": "Form the passive voice across tenses.",
+    },
+    {
+        "id": "c-fractions",
+        "lesson_title": "Fractions and ratios",
+        "skill_name": "Arithmetic",
+        "short_description": "Adding and comparing fractions.",
+        "description": "Equivalent fractions, ratios and a short note on SQL-free spreadsheets.",
+    },
+]
+
+
+@pytest.fixture
+def course_catalog(tmp_path):
+    """A three-course catalog loaded from a temporary course.csv."""
+    import csv
+
+    from agents.course_catalog import _load_catalog
+
+    path = tmp_path / "course.csv"
+    fields = ["id", "lesson_title", "content_title", "skill_name", "level", "category_name",
+              "subCatName", "status", "short_description", "description", "university", "link"]
+    with path.open("w", encoding="utf-8", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=fields)
+        writer.writeheader()
+        for row in COURSE_ROWS:
+            writer.writerow({**row, "link": f"https://courses.example.com/{row['id']}"})
+    return _load_catalog(path, "test-version")
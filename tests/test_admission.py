@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from pipeline.admission import AdmissionController, AdmissionRejected
+from pipeline.priority import BATCH, INTERACTIVE
+
+
+def _controller(**overrides) -> AdmissionController:
+    settings = {"name": "sync", "max_concurrent": 1, "max_queue": 2, "max_wait_seconds": 5.0}
+    settings.update(overrides)
+    return AdmissionController(**settings)
+
+
+def test_queue_full_is_rejected_with_retry_after():
+    controller = _controller(max_queue=0)
+    admitted_at = controller.acquire(INTERACTIVE)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(INTERACTIVE)
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after_seconds >= 1
+
+    controller.release(admitted_at)
+    controller.release(controller.acquire(INTERACTIVE))
+    stats = controller.get_stats()
+    assert stats["rejected_queue_full"] == 1
+    assert stats["admitted"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_queued_request_times_out():
+    controller = _controller(max_wait_seconds=0.05)
+    admitted_at = controller.acquire(INTERACTIVE)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(INTERACTIVE)
+    assert rejected.value.reason == "timeout"
+    assert controller.get_stats()["queue_depth"] == 0
+    controller.release(admitted_at)
+
+
+def test_interactive_waiters_are_admitted_before_earlier_batch_waiters(wait_until):
+    controller = _controller(max_queue=4)
+    admitted_at = controller.acquire(INTERACTIVE)
+    order = []
+    order_lock = threading.Lock()
+
+    def run(priority: str, label: str) -> None:
+        with controller.admit(priority):
+            with order_lock:
+                order.append(label)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(run, BATCH, "batch")]
+        wait_until(lambda: controller.get_stats()["queue_depth"] == 1, message="batch waiter")
+        futures += [pool.submit(run, INTERACTIVE, f"interactive-{i}") for i in range(2)]
+        wait_until(lambda: controller.get_stats()["queue_depth"] == 3, message="interactive waiters")
+        controller.release(admitted_at)
+        for future in futures:
+            future.result(timeout=5)
+
+    assert order == ["interactive-0", "interactive-1", "batch"]
+
+
+def test_batch_waiters_do_not_count_toward_interactive_queue_limit(wait_until):
+    controller = _controller(max_queue=1)
+    admitted_at = controller.acquire(INTERACTIVE)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        batch = pool.submit(lambda: controller.release(controller.acquire(BATCH)))
+        wait_until(lambda: controller.get_stats()["queue_depth"] == 1, message="batch waiter")
+        with pytest.raises(AdmissionRejected):
+            controller.acquire(BATCH)
+        interactive = pool.submit(lambda: controller.release(controller.acquire(INTERACTIVE)))
+        wait_until(lambda: controller.get_stats()["queue_depth"] == 2, message="interactive waiter")
+        controller.release(admitted_at)
+        interactive.result(timeout=5)
+        batch.result(timeout=5)
+
+
+def test_unbounded_acquire_skips_the_queue_limit(wait_until):
+    controller = _controller(max_queue=0)
+    admitted_at = controller.acquire(INTERACTIVE)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        job = pool.submit(lambda: controller.release(controller.acquire(BATCH, max_wait_seconds=5, bounded=False)))
+        wait_until(lambda: controller.get_stats()["queue_depth"] == 1, message="unbounded waiter")
+        controller.release(admitted_at)
+        job.result(timeout=5)
+    assert controller.get_stats()["rejected_queue_full"] == 0
+
+
+def test_sync_endpoint_returns_429_with_retry_after(monkeypatch):
+    import main
+
+    controller = _controller(max_queue=0)
+    monkeypatch.setitem(main._admission, "sync", controller)
+    monkeypatch.setattr(main, "API_BEARER_TOKEN", "")
+    monkeypatch.setattr(main, "run_full_pipeline", lambda **kwargs: pytest.fail("pipeline must not run"))
+    admitted_at = controller.acquire(INTERACTIVE)
+    try:
+        response = TestClient(main.app).post(
+            "/api/v1/test-analysis-recommendations",
+            json={},
+            headers={"X-Correlation-Id": "corr-overloaded"},
+        )
+    finally:
+        controller.release(admitted_at)
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.headers["X-Correlation-Id"] == "corr-overloaded"
+    assert response.json()["detail"]["code"] == "OVERLOADED"
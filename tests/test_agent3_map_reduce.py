@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import json
+import re
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import agents.agent3_weakness_extraction as agent3
+import agents.agent4_course_recommendation as agent4
+from agents.agent2_incorrect_questions import get_incorrect_question_cases
+from agents.agent3_weakness_extraction import _partition_cases
+from pipeline.cache import TTLCache
+
+
+def _write_exam(tmp_path):
+    """One attempt with two wrong answers; q2 has no domain in the question bank."""
+    paths = {name: tmp_path / f"{name}.csv" for name in ("question", "answer", "tq", "ta")}
+    pd.DataFrame([
+        {"id": "q1", "question": "2 + 2?", "domain": "Arithmetic", "explanation": "", "difficulty": 1, "score": 1},
+        {"id": "q2", "question": "Passive of 'he wrote'?", "domain": None, "explanation": "", "difficulty": 2, "score": 1},
+    ]).to_csv(paths["question"], index=False)
+    pd.DataFrame([
+        {"questionId": "q1", "isCorrect": True, "value": "4"},
+        {"questionId": "q2", "isCorrect": True, "value": "it was written"},
+    ]).to_csv(paths["answer"], index=False)
+    pd.DataFrame([
+        {"id": "tq1", "examResultId": "r1", "questionId": "q1"},
+        {"id": "tq2", "examResultId": "r1", "questionId": "q2"},
+    ]).to_csv(paths["tq"], index=False)
+    pd.DataFrame([
+        {"examResultQuestionId": "tq1", "isCorrect": False, "answerValue": "5"},
+        {"examResultQuestionId": "tq2", "isCorrect": False, "answerValue": "he was wrote"},
+    ]).to_csv(paths["ta"], index=False)
+    return paths
+
+
+def test_missing_domain_becomes_none_not_nan(tmp_path):
+    paths = _write_exam(tmp_path)
+    result = get_incorrect_question_cases(
+        {"input": {"test_id": "t1", "student_id": "s1"}, "current_test_result": {"id": "r1"}},
+        question_path=paths["question"],
+        answer_path=paths["answer"],
+        tq_path=paths["tq"],
+        ta_path=paths["ta"],
+    )
+    domains = {case["questionId"]: case["domain"] for case in result["incorrect_questions"]}
+    assert domains == {"q1": "Arithmetic", "q2": None}
+
+    partitions = _partition_cases(result["incorrect_questions"], "domain", chunk_size=10)
+    assert sorted(label for label, _ in partitions) == ["Arithmetic", "Unknown"]
+
+
+def test_partitions_are_chunked_per_domain():
+    cases = [{"domain": "A"}] * 5 + [{"domain": "B"}] * 2
+    partitions = _partition_cases(cases, "domain", chunk_size=2)
+    assert [(label, len(chunk)) for label, chunk in partitions] == [("A", 2), ("A", 2), ("A", 1), ("B", 2)]
+    assert [(label, len(chunk)) for label, chunk in _partition_cases(cases, "none", chunk_size=10)] == [("all", 7)]
+
+
+class PartitionLLM:
+    """Answers each map call with one weakness named after the partition's domain; `fail` domains raise."""
+
+    def __init__(self, names) -> None:
+        self.names = names
+        self.fail = set()
+        self.calls = []
+
+    def generate_content(self, model, prefix, suffix, label="prompt"):
+        domain = next(d for d in self.names if f'"domain":"{d}"' in suffix)
+        self.calls.append(domain)
+        if domain in self.fail:
+            raise RuntimeError("upstream error")
+        qids = sorted(set(re.findall(r'"questionId":"([^"]+)"', suffix)))
+        weakness = {"weakness": self.names[domain], "evidence_question_ids": qids, "frequency": len(qids)}
+        return SimpleNamespace(text=json.dumps([weakness]), usage_metadata=None)
+
+
+@pytest.fixture
+def map_llm(monkeypatch):
+    fake = PartitionLLM({"Algebra": "Sign errors", "Geometry": "Sign mistakes", "Grammar": "Passive voice"})
+    monkeypatch.setattr(agent3, "get_context_cache", lambda: fake)
+    monkeypatch.setattr(agent3, "_weakness_cache", TTLCache(name="agent3-map-test", maxsize=100, ttl_seconds=60))
+    # "Sign errors" and "Sign mistakes" embed to the same direction, "Passive voice" does not.
+    monkeypatch.setattr(
+        agent4, "embed_texts", lambda texts: [[1.0, 0.0] if text.startswith("Sign") else [0.0, 1.0] for text in texts]
+    )
+    return fake
+
+
+def _cases():
+    return [
+        {"questionId": f"{domain[:2].lower()}{i}", "domain": domain, "studentAnswers": ["x"]}
+        for domain in ("Algebra", "Geometry", "Grammar")
+        for i in range(2)
+    ]
+
+
+def test_partitions_are_extracted_separately_and_similar_weaknesses_merged(map_llm):
+    weaknesses = agent3.extract_weaknesses_and_patterns(_cases(), map_reduce_threshold=6)
+
+    assert sorted(map_llm.calls) == ["Algebra", "Geometry", "Grammar"]
+    assert [(w["weakness"], w["evidence_question_ids"], w["frequency"]) for w in weaknesses] == [
+        ("Sign errors", ["al0", "al1", "ge0", "ge1"], 4),
+        ("Passive voice", ["gr0", "gr1"], 2),
+    ]
+
+
+def test_a_failed_partition_keeps_the_rest_but_is_not_cached(map_llm):
+    map_llm.fail = {"Grammar"}
+    weaknesses = agent3.extract_weaknesses_and_patterns(_cases(), map_reduce_threshold=6)
+    assert [w["weakness"][:4] for w in weaknesses] == ["Sign"]
+
+    map_llm.fail = set()
+    weaknesses = agent3.extract_weaknesses_and_patterns(_cases(), map_reduce_threshold=6)
+    assert len(map_llm.calls) == 6
+    assert {w["weakness"][:4] for w in weaknesses} == {"Sign", "Pass"}
+
+
+def test_all_partitions_failing_raises(map_llm):
+    map_llm.fail = {"Algebra", "Geometry", "Grammar"}
+    with pytest.raises(RuntimeError):
+        agent3.extract_weaknesses_and_patterns(_cases(), map_reduce_threshold=6)
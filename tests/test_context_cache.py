@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline.context_cache import ContextCacheClient
+
+SMALL_PREFIX = "Score each course. "          # ~5 tokens
+LARGE_PREFIX = "Rules for the report. " * 200  # ~1100 tokens
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeCacheBackend:
+    """In-memory provider: caches expire on the shared clock and unknown names raise a cache miss."""
+
+    def __init__(self, clock: FakeClock) -> None:
+        self.clock = clock
+        self.caches = {}
+        self.calls = []
+        self.creates = 0
+        self.refreshes = 0
+        self.deleted = []
+        self.fail_create = False
+
+    def create(self, model, prefix, ttl_seconds, display_name):
+        if self.fail_create:
+            raise RuntimeError("quota exceeded")
+        self.creates += 1
+        name = f"cachedContents/{self.creates}"
+        self.caches[name] = {"prefix": prefix, "expire_at": self.clock() + ttl_seconds}
+        return name, self.caches[name]["expire_at"]
+
+    def refresh(self, name, ttl_seconds):
+        self.refreshes += 1
+        self.caches[name]["expire_at"] = self.clock() + ttl_seconds
+        return self.caches[name]["expire_at"]
+
+    def delete(self, name):
+        self.deleted.append(name)
+        self.caches.pop(name, None)
+
+    def generate(self, model, text, cached_content=None):
+        prompt = self._resolve(cached_content) + text
+        self.calls.append({"cached_content": cached_content, "text": text})
+        return SimpleNamespace(text=f"answer:{len(prompt)}")
+
+    def generate_stream(self, model, text, cached_content=None):
+        prompt = self._resolve(cached_content) + text
+        self.calls.append({"cached_content": cached_content, "text": text})
+        yield SimpleNamespace(text="answer:")
+        yield SimpleNamespace(text=str(len(prompt)))
+
+    def _resolve(self, name):
+        if name is None:
+            return ""
+        entry = self.caches.get(name)
+        if entry is None or entry["expire_at"] <= self.clock():
+            raise LookupError(f"CachedContent {name} not found")
+        return entry["prefix"]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def backend(clock):
+    return FakeCacheBackend(clock)
+
+
+def _client(backend, clock, **kwargs):
+    options = dict(ttl_seconds=600, refresh_margin_seconds=60, min_prefix_tokens=1024, retry_after_seconds=300)
+    options.update(kwargs)
+    return ContextCacheClient(backend, clock=clock, **options)
+
+
+def test_prefix_below_the_provider_minimum_is_sent_inline_without_creating_a_cache(backend, clock):
+    cache = _client(backend, clock)
+
+    response = cache.generate_content("m", SMALL_PREFIX, "data", label="rerank")
+
+    assert response.text == f"answer:{len(SMALL_PREFIX + 'data')}"
+    assert backend.creates == 0
+    assert backend.calls == [{"cached_content": None, "text": SMALL_PREFIX + "data"}]
+    stats = cache.get_stats()
+    assert stats["inline_calls"] == 1
+    assert stats["below_min_prefix_calls"] == 1
+    assert stats["below_min_prefix_tokens"] == {"rerank": 5}
+
+
+def test_large_prefix_is_created_once_and_reused_with_only_the_suffix_sent(backend, clock):
+    cache = _client(backend, clock)
+
+    first = cache.generate_content("m", LARGE_PREFIX, "one", label="summary")
+    second = cache.generate_content("m", LARGE_PREFIX, "two", label="summary")
+
+    assert backend.creates == 1
+    assert [c["text"] for c in backend.calls] == ["one", "two"]
+    assert first.text == f"answer:{len(LARGE_PREFIX) + 3}"
+    assert second.text == f"answer:{len(LARGE_PREFIX) + 3}"
+    assert cache.get_stats()["cached_calls"] == 2
+
+
+def test_cache_is_refreshed_near_expiry_instead_of_recreated(backend, clock):
+    cache = _client(backend, clock)
+    cache.generate_content("m", LARGE_PREFIX, "one")
+
+    clock.now += 570  # inside the 60s refresh margin of the 600s TTL
+    cache.generate_content("m", LARGE_PREFIX, "two")
+
+    assert backend.creates == 1
+    assert backend.refreshes == 1
+    clock.now += 500  # still alive thanks to the refresh
+    cache.generate_content("m", LARGE_PREFIX, "three")
+    assert backend.creates == 1
+
+
+def test_failed_create_backs_off_and_sends_inline(backend, clock):
+    cache = _client(backend, clock)
+    backend.fail_create = True
+
+    cache.generate_content("m", LARGE_PREFIX, "one")
+    backend.fail_create = False
+    cache.generate_content("m", LARGE_PREFIX, "two")
+
+    assert backend.creates == 0
+    assert [c["cached_content"] for c in backend.calls] == [None, None]
+    assert cache.get_stats()["create_failures"] == 1
+
+    clock.now += 301
+    cache.generate_content("m", LARGE_PREFIX, "three")
+    assert backend.creates == 1
+    assert backend.calls[-1] == {"cached_content": "cachedContents/1", "text": "three"}
+
+
+def test_cache_evicted_by_the_provider_falls_back_inline_and_is_recreated(backend, clock):
+    cache = _client(backend, clock)
+    cache.generate_content("m", LARGE_PREFIX, "one")
+    backend.caches.clear()
+
+    response = cache.generate_content("m", LARGE_PREFIX, "two")
+
+    assert response.text == f"answer:{len(LARGE_PREFIX) + 3}"
+    assert backend.calls[-1] == {"cached_content": None, "text": LARGE_PREFIX + "two"}
+    assert cache.get_stats()["stale_fallbacks"] == 1
+
+    cache.generate_content("m", LARGE_PREFIX, "three")
+    assert backend.creates == 2
+
+
+def test_stream_uses_the_cache_and_falls_back_before_yielding(backend, clock):
+    cache = _client(backend, clock)
+
+    chunks = list(cache.generate_content_stream("m", LARGE_PREFIX, "one"))
+    assert "".join(c.text for c in chunks) == f"answer:{len(LARGE_PREFIX) + 3}"
+    assert backend.calls[-1]["cached_content"] == "cachedContents/1"
+
+    backend.caches.clear()
+    chunks = list(cache.generate_content_stream("m", LARGE_PREFIX, "two"))
+    assert "".join(c.text for c in chunks) == f"answer:{len(LARGE_PREFIX) + 3}"
+    assert backend.calls[-1] == {"cached_content": None, "text": LARGE_PREFIX + "two"}
+
+
+def test_disabled_cache_always_sends_inline(backend, clock):
+    cache = _client(backend, clock, enabled=False)
+
+    cache.generate_content("m", LARGE_PREFIX, "one")
+
+    assert backend.creates == 0
+    assert cache.get_stats()["below_min_prefix_calls"] == 0
+
+
+def test_expire_all_deletes_every_created_cache(backend, clock):
+    cache = _client(backend, clock)
+    cache.generate_content("m", LARGE_PREFIX, "one")
+    cache.generate_content("other-model", LARGE_PREFIX, "one")
+
+    cache.expire_all()
+
+    assert sorted(backend.deleted) == ["cachedContents/1", "cachedContents/2"]
+    assert cache.get_stats()["caches"] == []
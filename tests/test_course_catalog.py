@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+import agents.agent4_course_recommendation as agent4
+import agents.course_catalog as course_catalog_module
+from config import CourseScore
+
+
+def test_records_hold_only_short_columns(course_catalog):
+    record = course_catalog.get("c-sql")
+
+    assert len(course_catalog) == 3
+    assert record.lesson_title == "SQL joins in practice"
+    assert record.short_description == "Inner and outer joins."
+    assert not hasattr(record, "description")
+    assert record.to_metadata()["skill_name"] == "SQL"
+
+
+def test_long_text_is_read_on_first_use(course_catalog):
+    assert course_catalog._long_text is None
+
+    assert course_catalog.get_long_text("c-grammar") == "Form the passive voice across tenses."
+    assert course_catalog._long_text is not None
+    assert course_catalog.get_long_text("missing") == ""
+    with pytest.raises(KeyError):
+        course_catalog.get_long_text("c-grammar", field="short_description")
+
+
+def test_catalog_reloads_when_the_csv_changes(course_catalog, monkeypatch):
+    monkeypatch.setattr(course_catalog_module, "COURSE_CSV_PATH", course_catalog.csv_path)
+    monkeypatch.setattr(course_catalog_module, "COURSE_CATALOG_REFRESH_SECONDS", 0)
+    monkeypatch.setattr(course_catalog_module, "_catalog", None)
+
+    first = course_catalog_module.get_course_catalog()
+    assert course_catalog_module.get_course_catalog() is first
+
+    with course_catalog.csv_path.open("a", encoding="utf-8") as handle:
+        handle.write("c-new,New course,,,,,,,,,,\n")
+    stat = course_catalog.csv_path.stat()
+    os.utime(course_catalog.csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    reloaded = course_catalog_module.get_course_catalog()
+    assert reloaded is not first
+    assert reloaded.get("c-new").lesson_title == "New course"
+
+
+def test_selected_courses_get_their_full_description(course_catalog, monkeypatch):
+    monkeypatch.setattr(agent4, "get_course_catalog", lambda: course_catalog)
+    course = agent4._course_from_catalog(course_catalog, "c-sql")
+    assert course.description == "Inner and outer joins."
+
+    [selected] = agent4._with_full_descriptions([CourseScore(course=course, weakness_id="w1", score=0.9, reason="")])
+
+    assert selected.course.description == "Combine tables with inner, left and full outer joins."
+    assert course.description == "Inner and outer joins."  # the retrieval-time record is not mutated
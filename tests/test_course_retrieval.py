@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import agents.agent4_course_recommendation as agent4
+from config import Weakness
+
+
+def _neighbors(*ranked):
+    """Vector hits for one weakness, best first (distance grows with rank)."""
+    return [SimpleNamespace(id=course_id, distance=0.1 * rank) for rank, course_id in enumerate(ranked)]
+
+
+@pytest.fixture
+def retrieval(monkeypatch, course_catalog):
+    monkeypatch.setattr(agent4, "get_course_catalog", lambda: course_catalog)
+    calls = []
+
+    def use_vector_hits(hits, delay=0.0):
+        def _query(texts, limit, return_full_datapoint=False):
+            calls.append(list(texts))
+            time.sleep(delay)
+            return [list(hits) for _ in texts]
+
+        monkeypatch.setattr(agent4, "_query_vertex_index_batch", _query)
+
+    return SimpleNamespace(calls=calls, use_vector_hits=use_vector_hits)
+
+
+WEAKNESS = [Weakness(id="w1", text="Struggles with SQL joins between tables", importance=1.0)]
+
+
+def test_bm25_ranks_title_matches_first(course_catalog):
+    results = course_catalog.lexical_index.search("SQL joins", limit=5)
+    assert [course_id for course_id, _ in results][:2] == ["c-sql", "c-fractions"]
+    assert results[0][1] > results[1][1] > 0
+    assert course_catalog.lexical_index.search("the and of", limit=5) == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = dict(agent4._reciprocal_rank_fusion([["a", "b"], ["b", "c"]], k=60))
+    assert fused["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert max(fused, key=fused.get) == "b"
+
+
+def test_hybrid_scores_are_scaled_rrf(retrieval):
+    retrieval.use_vector_hits(_neighbors("c-sql", "c-grammar"))
+    recs, _ = agent4._retrieve_candidates(WEAKNESS, 3, mode="hybrid")
+    scores = {rec.course.id: rec.score for rec in recs}
+
+    assert scores["c-sql"] == pytest.approx(1.0)  # rank 1 in both sources
+    assert all(0 < score <= 1 for score in scores.values())
+    assert [rec.course.id for rec in recs] == sorted(scores, key=scores.get, reverse=True)
+    reasons = {rec.course.id: rec.reason for rec in recs}
+    assert reasons["c-sql"].startswith("Retrieved by semantic and keyword match")
+    assert reasons["c-grammar"].startswith("Retrieved by semantic match")
+
+
+def test_vector_mode_keeps_distance_scores(retrieval):
+    retrieval.use_vector_hits(_neighbors("c-grammar", "c-sql"))
+    recs, _ = agent4._retrieve_candidates(WEAKNESS, 3, mode="vector")
+    assert [(rec.course.id, rec.score) for rec in recs] == [("c-grammar", 1.0), ("c-sql", pytest.approx(1 / 1.1))]
+
+
+def test_vector_mode_waits_past_the_hybrid_timeout(retrieval, monkeypatch):
+    monkeypatch.setattr(agent4, "VECTOR_SEARCH_TIMEOUT_SECONDS", 0.01)
+    retrieval.use_vector_hits(_neighbors("c-grammar"), delay=0.1)
+    recs, _ = agent4._retrieve_candidates(WEAKNESS, 3, mode="vector")
+    assert [rec.course.id for rec in recs] == ["c-grammar"]
+
+
+def test_hybrid_mode_falls_back_to_lexical_on_timeout(retrieval, monkeypatch):
+    monkeypatch.setattr(agent4, "VECTOR_SEARCH_TIMEOUT_SECONDS", 0.01)
+    retrieval.use_vector_hits(_neighbors("c-grammar"), delay=0.1)
+    recs, _ = agent4._retrieve_candidates(WEAKNESS, 3, mode="hybrid")
+    assert [rec.course.id for rec in recs][0] == "c-sql"
+    assert "c-grammar" not in {rec.course.id for rec in recs}
+    assert all(rec.reason.startswith("Retrieved by keyword match") for rec in recs)
+
+
+def test_vector_mode_surfaces_backend_errors(retrieval, monkeypatch):
+    def broken(texts, limit, return_full_datapoint=False):
+        raise ConnectionError("index unreachable")
+
+    monkeypatch.setattr(agent4, "_query_vertex_index_batch", broken)
+    with pytest.raises(ConnectionError):
+        agent4._retrieve_candidates(WEAKNESS, 3, mode="vector")
+
+
+def test_lexical_mode_never_queries_the_index(retrieval):
+    retrieval.use_vector_hits(_neighbors("c-grammar"))
+    recs, _ = agent4._retrieve_candidates(WEAKNESS, 3, mode="lexical")
+    assert retrieval.calls == []
+    assert recs[0].course.id == "c-sql"
+    assert 0 < recs[0].score < 1
+
+
+def test_prefetch_retrieves_a_streamed_weakness_in_the_background(retrieval):
+    retrieval.use_vector_hits(_neighbors("c-sql"))
+    weakness_id, future = agent4.prefetch_candidates({"id": "w-streamed", "weakness": "SQL joins"}, retrieval_mode="vector")
+
+    recs, _ = future.result(timeout=5)
+
+    assert weakness_id == "w-streamed"
+    assert [(rec.weakness_id, rec.course.id) for rec in recs] == [("w-streamed", "c-sql")]
+    assert retrieval.calls == [["SQL joins"]]
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import agents.agent4_course_recommendation as agent4
+from config import Course, CourseScore
+
+
+def _rec(course_id: str, weakness_id: str, score: float) -> CourseScore:
+    course = Course(id=course_id, lesson_title=course_id, description="", link="")
+    return CourseScore(course=course, weakness_id=weakness_id, score=score, reason="")
+
+
+def _ids(selected):
+    return [rec.course.id for rec in selected]
+
+
+RECS = [
+    _rec("a1", "w1", 0.95),
+    _rec("a2", "w1", 0.90),
+    _rec("a3", "w1", 0.85),
+    _rec("b1", "w2", 0.40),
+    _rec("b2", "w2", 0.30),
+]
+
+
+def test_every_weakness_gets_its_quota_before_the_fill():
+    selected = agent4._select_final_courses(RECS, max_total=3, min_per_weakness=1, max_per_weakness=None, diversity="score")
+    assert _ids(selected) == ["a1", "b1", "a2"]
+
+
+def test_without_quota_the_top_scores_win():
+    selected = agent4._select_final_courses(RECS, max_total=3, min_per_weakness=0, max_per_weakness=None, diversity="score")
+    assert _ids(selected) == ["a1", "a2", "a3"]
+
+
+def test_per_weakness_cap_and_duplicate_courses():
+    recs = RECS + [_rec("a1", "w2", 0.99)]
+    selected = agent4._select_final_courses(recs, max_total=5, min_per_weakness=0, max_per_weakness=2, diversity="score")
+    # a1 is taken once, for w2 (its best score), so w1 still has room for a2 and a3.
+    assert [(rec.course.id, rec.weakness_id) for rec in selected] == [("a1", "w2"), ("a2", "w1"), ("a3", "w1"), ("b1", "w2")]
+
+
+def test_mmr_prefers_a_different_course_over_a_near_duplicate():
+    recs = [_rec("sql-1", "w1", 0.9), _rec("sql-2", "w1", 0.88), _rec("grammar", "w1", 0.7)]
+    vectors = {"sql-1": [1.0, 0.0], "sql-2": [0.99, 0.05], "grammar": [0.0, 1.0]}
+
+    by_score = agent4._select_final_courses(recs, max_total=2, min_per_weakness=0, max_per_weakness=None, diversity="score")
+    by_mmr = agent4._select_final_courses(
+        recs, max_total=2, min_per_weakness=0, max_per_weakness=None,
+        diversity="mmr", mmr_lambda=0.5, course_vectors=vectors,
+    )
+
+    assert _ids(by_score) == ["sql-1", "sql-2"]
+    assert _ids(by_mmr) == ["sql-1", "grammar"]
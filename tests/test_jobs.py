@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import pipeline.jobs as jobs_module
+from pipeline.jobs import (
+    FAILED,
+    SUCCEEDED,
+    CallbackURLRejected,
+    JobConflict,
+    JobManager,
+    JobQueueFull,
+    validate_callback_url,
+)
+from pipeline.priority import BATCH, INTERACTIVE, current_priority
+
+
+@pytest.fixture
+def manager():
+    created = []
+
+    def _make(**overrides) -> JobManager:
+        settings = {"workers": 1, "max_queue": 4, "callback_retries": 1}
+        settings.update(overrides)
+        created.append(JobManager(**settings))
+        return created[-1]
+
+    yield _make
+    for job_manager in created:
+        job_manager.shutdown()
+
+
+def _blocking_fn(release: threading.Event, result=None):
+    def _fn(on_event):
+        release.wait(5)
+        return result or {"status": "ok"}
+
+    return _fn
+
+
+def test_same_correlation_id_returns_the_existing_job(manager, wait_until):
+    jobs = manager()
+    runs = []
+
+    def fn(on_event):
+        runs.append(1)
+        on_event("stage", {"stage": "agent1"})
+        return {"status": "ok"}
+
+    first = jobs.submit(fn, "corr-1", fingerprint="body-a")
+    second = jobs.submit(fn, "corr-1", fingerprint="body-a")
+    assert second is first
+
+    wait_until(lambda: first.status == SUCCEEDED, message="job to finish")
+    assert jobs.submit(fn, "corr-1", fingerprint="body-a") is first  # finished jobs are still deduplicated while retained
+    assert runs == [1]
+    assert first.to_dict()["stages"] == [{"stage": "agent1"}]
+    assert jobs.get_stats()["submitted"] == 1
+
+
+def test_reused_correlation_id_with_a_different_request_conflicts(manager, wait_until):
+    jobs = manager()
+    job = jobs.submit(lambda on_event: {}, "corr-1", fingerprint="body-a")
+
+    with pytest.raises(JobConflict):
+        jobs.submit(lambda on_event: pytest.fail("must not run"), "corr-1", fingerprint="body-b")
+    wait_until(lambda: job.status == SUCCEEDED, message="job to finish")
+    with pytest.raises(JobConflict):
+        jobs.submit(lambda on_event: pytest.fail("must not run"), "corr-1", fingerprint="body-b")
+    assert jobs.get_stats()["submitted"] == 1
+
+
+def test_jobs_endpoint_answers_409_for_a_reused_correlation_id(manager, monkeypatch):
+    monkeypatch.setattr(main, "_jobs", manager())
+    monkeypatch.setattr(main, "API_BEARER_TOKEN", "")
+    monkeypatch.setattr(main, "_run_pipeline_request", lambda request, on_event=None: {"status": "ok"})
+    client = TestClient(main.app)
+    headers = {"X-Correlation-Id": "corr-job"}
+    url = "/api/v1/test-analysis-recommendations/jobs"
+
+    first = client.post(url, json={"test_id": "t-1"}, headers=headers)
+    retry = client.post(url, json={"test_id": "t-1"}, headers=headers)
+    other = client.post(url, json={"test_id": "t-2"}, headers=headers)
+
+    assert first.status_code == 202
+    assert retry.status_code == 202 and retry.json()["job_id"] == first.json()["job_id"]
+    assert other.status_code == 409
+    assert other.json()["detail"]["code"] == "CONFLICT"
+    assert other.headers["X-Correlation-Id"] == "corr-job"
+
+
+def test_full_queue_rejects_new_jobs(manager, wait_until):
+    jobs = manager(max_queue=0)
+    release = threading.Event()
+    running = jobs.submit(_blocking_fn(release), "corr-running")
+
+    with pytest.raises(JobQueueFull):
+        jobs.submit(_blocking_fn(release), "corr-rejected")
+    release.set()
+    wait_until(lambda: running.status == SUCCEEDED, message="job to finish")
+
+    # The finished job's slot is free again.
+    assert jobs.submit(lambda on_event: {}, "corr-next").job_id != running.job_id
+    assert jobs.get_stats()["rejected"] == 1
+
+
+def test_queued_interactive_jobs_run_before_batch_jobs(manager, wait_until):
+    jobs = manager()
+    release = threading.Event()
+    order = []
+
+    def record(label):
+        def _fn(on_event):
+            order.append((label, current_priority()))
+            return {}
+
+        return _fn
+
+    blocker = jobs.submit(_blocking_fn(release), "corr-blocker")
+    wait_until(lambda: blocker.status == "running", message="blocker to start")
+    queued = [
+        jobs.submit(record("batch"), "corr-batch", priority=BATCH),
+        jobs.submit(record("interactive"), "corr-interactive", priority=INTERACTIVE),
+    ]
+    release.set()
+    wait_until(lambda: all(job.status == SUCCEEDED for job in queued), message="queued jobs")
+
+    assert order == [("interactive", INTERACTIVE), ("batch", BATCH)]
+
+
+def test_failed_job_records_the_described_error(manager, wait_until):
+    jobs = manager(describe_error=lambda exc: {"code": "UPSTREAM_UNAVAILABLE", "message": str(exc)})
+
+    def fn(on_event):
+        raise RuntimeError("vector index down")
+
+    job = jobs.submit(fn, "corr-failed")
+    wait_until(lambda: job.status == FAILED, message="job to fail")
+    assert job.to_dict()["error"] == {"code": "UPSTREAM_UNAVAILABLE", "message": "vector index down"}
+    assert jobs.get_stats()["failed"] == 1
+
+
+def test_callback_is_posted_with_the_finished_job(manager, wait_until, monkeypatch):
+    posted = []
+
+    class _Response:
+        status_code = 204
+
+    def fake_post(url, json, timeout, allow_redirects):
+        posted.append((url, json["status"], allow_redirects))
+        return _Response()
+
+    monkeypatch.setattr(jobs_module.socket, "getaddrinfo", lambda *args, **kwargs: [(None, None, None, "", ("93.184.216.34", 443))])
+    monkeypatch.setattr(jobs_module.requests, "post", fake_post)
+    jobs = manager(callback_allowed_hosts=("hooks.example.com",))
+
+    job = jobs.submit(lambda on_event: {"status": "ok"}, "corr-callback", callback_url="https://hooks.example.com/done")
+    wait_until(lambda: job.callback_status is not None, message="callback")
+    assert job.callback_status == "delivered (204)"
+    assert posted == [("https://hooks.example.com/done", SUCCEEDED, False)]
+
+
+@pytest.mark.parametrize(
+    "url, resolved",
+    [
+        ("http://hooks.example.com/done", "93.184.216.34"),
+        ("https://user:pw@hooks.example.com/done", "93.184.216.34"),
+        ("https://evil.example.org/done", "93.184.216.34"),
+        ("https://hooks.example.com/done", "10.0.0.5"),
+        ("https://hooks.example.com/done", "169.254.169.254"),
+        ("https://hooks.example.com/done", "127.0.0.1"),
+    ],
+)
+def test_callback_urls_outside_the_policy_are_rejected(monkeypatch, url, resolved):
+    monkeypatch.setattr(jobs_module.socket, "getaddrinfo", lambda *args, **kwargs: [(None, None, None, "", (resolved, 443))])
+    with pytest.raises(CallbackURLRejected):
+        validate_callback_url(url, ("hooks.example.com",))
+
+
+def test_callback_subdomain_wildcard(monkeypatch):
+    monkeypatch.setattr(jobs_module.socket, "getaddrinfo", lambda *args, **kwargs: [(None, None, None, "", ("93.184.216.34", 443))])
+    validate_callback_url("https://a.partner.org/hook", ("*.partner.org",))
+    with pytest.raises(CallbackURLRejected):
+        validate_callback_url("https://partner.org.evil.com/hook", ("*.partner.org",))
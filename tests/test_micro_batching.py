@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pipeline.micro_batching import MicroBatcher, _PendingCall
+from pipeline.priority import BATCH, INTERACTIVE, priority_scope
+
+
+class RecordingBatchFn:
+    """Upper-cases items and records each batch; the first batch can be held open with `gate`."""
+
+    def __init__(self, gate: threading.Event | None = None) -> None:
+        self.batches = []
+        self.gate = gate
+        self.started = threading.Event()
+
+    def __call__(self, key, items):
+        self.batches.append((key, list(items)))
+        self.started.set()
+        if self.gate is not None and len(self.batches) == 1:
+            self.gate.wait(5)
+        return [item.upper() for item in items]
+
+
+def _submit(batcher: MicroBatcher, items, key=None, priority=INTERACTIVE):
+    with priority_scope(priority):
+        return batcher.submit(items, key=key)
+
+
+def test_concurrent_calls_share_one_batch_and_get_their_own_results():
+    batch_fn = RecordingBatchFn()
+    batcher = MicroBatcher("test", batch_fn, window_ms=100, max_batch_size=10)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(_submit, batcher, [f"a{i}", f"b{i}"]) for i in range(3)]
+        results = [f.result(timeout=5) for f in futures]
+
+    assert results == [[f"A{i}", f"B{i}"] for i in range(3)]
+    assert len(batch_fn.batches) == 1
+    assert batcher.get_stats()["avg_calls_per_batch"] == 3
+
+
+def test_calls_with_different_keys_are_not_mixed():
+    batch_fn = RecordingBatchFn()
+    batcher = MicroBatcher("test", batch_fn, window_ms=50, max_batch_size=10)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(_submit, batcher, ["x"], key=768), pool.submit(_submit, batcher, ["y"], key=256)]
+        assert [f.result(timeout=5) for f in futures] == [["X"], ["Y"]]
+    assert sorted(key for key, _ in batch_fn.batches) == [256, 768]
+
+
+def test_wrong_result_count_fails_every_caller():
+    batcher = MicroBatcher("test", lambda key, items: items[:-1], window_ms=1)
+    with pytest.raises(RuntimeError, match="returned 1 results for 2 items"):
+        batcher.submit(["a", "b"])
+    assert batcher.get_stats()["errors"] == 1
+
+
+def test_zero_window_calls_straight_through():
+    batch_fn = RecordingBatchFn()
+    batcher = MicroBatcher("test", batch_fn, window_ms=0)
+    assert batcher.submit(["a"]) == ["A"]
+    assert batcher.get_stats()["batches"] == 1
+
+
+def _queue_behind_busy_worker(batcher, batch_fn, gate, submissions, wait_until, between=None):
+    """Occupy the only worker, queue `submissions` (label, priority), free it; return batch order."""
+    with ThreadPoolExecutor(max_workers=len(submissions) + 1) as pool:
+        blocker = pool.submit(_submit, batcher, ["blocker"])
+        batch_fn.started.wait(5)
+        futures = []
+        for i, (label, priority) in enumerate(submissions, start=1):
+            futures.append(pool.submit(_submit, batcher, [label], priority=priority))
+            wait_until(lambda: batcher.get_stats()["queued_calls"] == i, message=f"{label} to queue")
+            if between is not None:
+                between(label)
+        gate.set()
+        for future in [blocker, *futures]:
+            future.result(timeout=5)
+    return [items for _, items in batch_fn.batches[1:]]
+
+
+def test_interactive_calls_overtake_queued_batch_calls(wait_until):
+    gate = threading.Event()
+    batch_fn = RecordingBatchFn(gate)
+    batcher = MicroBatcher("test", batch_fn, window_ms=1, max_batch_size=1, max_concurrent_batches=1, aging_seconds=0)
+
+    order = _queue_behind_busy_worker(
+        batcher, batch_fn, gate,
+        [("batch-1", BATCH), ("batch-2", BATCH), ("interactive-1", INTERACTIVE)],
+        wait_until,
+    )
+    assert order == [["interactive-1"], ["batch-1"], ["batch-2"]]
+
+
+def test_aged_batch_calls_are_not_starved_by_later_interactive_calls(wait_until):
+    gate = threading.Event()
+    batch_fn = RecordingBatchFn(gate)
+    batcher = MicroBatcher("test", batch_fn, window_ms=1, max_batch_size=1, max_concurrent_batches=1, aging_seconds=0.05)
+
+    def let_batch_age(label):
+        if label == "batch":
+            time.sleep(0.1)
+
+    order = _queue_behind_busy_worker(
+        batcher, batch_fn, gate,
+        [("batch", BATCH), ("interactive", INTERACTIVE)],
+        wait_until,
+        let_batch_age,
+    )
+    assert order == [["batch"], ["interactive"]]
+    assert batcher.get_stats()["aged_calls"] == 1
+
+
+def test_flush_deadline_follows_the_oldest_call():
+    batcher = MicroBatcher("test", RecordingBatchFn(), window_ms=200, max_batch_size=10, aging_seconds=0)
+    now = time.perf_counter()
+    with priority_scope(BATCH):
+        old_batch_call = _PendingCall("key", ["batch"])
+    new_interactive_call = _PendingCall("key", ["interactive"])
+    old_batch_call.enqueued_at = now - 0.2
+    new_interactive_call.enqueued_at = now
+    # The order a previous `_take` leaves behind: the interactive call first, then the older batch call.
+    batcher._pending["key"] = [new_interactive_call, old_batch_call]
+
+    with batcher._cond:
+        key, calls = batcher._next_ready_batch()
+    assert time.perf_counter() - now < 0.1  # flushed on the batch call's window, not the newer call's
+    assert (key, calls) == ("key", [new_interactive_call, old_batch_call])
+
+
+def test_none_is_a_valid_batch_key():
+    batcher = MicroBatcher("test", RecordingBatchFn(), window_ms=1)
+    assert batcher.submit(["a"], key=None) == ["A"]
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline.model_governor import ModelGovernor, ModelQuotaTimeout, _GovernedModels, _TokenBucket
+from pipeline.priority import BATCH, INTERACTIVE
+
+MODEL = "gemini-test"
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeModels:
+    """Stands in for `genai.Client().models`; streams yield `chunks`, then raise `fail_with`."""
+
+    def __init__(self, chunks=("a", "b"), fail_with=None) -> None:
+        self.chunks = chunks
+        self.fail_with = fail_with
+        self.streams_opened = 0
+
+    def generate_content(self, *, model, contents, **kwargs):
+        if self.fail_with is not None:
+            raise self.fail_with
+        return SimpleNamespace(text="ok", usage_metadata=SimpleNamespace(total_token_count=42))
+
+    def generate_content_stream(self, *, model, contents, **kwargs):
+        self.streams_opened += 1
+        for chunk in self.chunks:
+            yield SimpleNamespace(text=chunk, usage_metadata=None)
+        if self.fail_with is not None:
+            raise self.fail_with
+
+
+def _governor(clock=None, **overrides) -> ModelGovernor:
+    settings = {
+        "limits": {},
+        "default_limits": {"rpm": 0, "tpm": 0, "max_concurrent": 1},
+        "batch_aging_seconds": 0.0,
+        "max_wait_seconds": 5.0,
+    }
+    settings.update(overrides)
+    return ModelGovernor(clock=clock or FakeClock(), **settings)
+
+
+def _lane_stats(governor: ModelGovernor) -> dict:
+    return governor.get_stats()["models"].get(MODEL, {})
+
+
+def _queued(governor: ModelGovernor) -> int:
+    classes = _lane_stats(governor).get("classes", {})
+    return sum(c["queued"] for c in classes.values())
+
+
+def _run_in_order(governor: ModelGovernor, submissions, wait_until, before_release=None):
+    """Hold the only slot, queue `submissions` (label, priority) in order, release; return grant order."""
+    governor.acquire(MODEL, 10, INTERACTIVE)
+    order = []
+
+    def call(label, priority):
+        governor.acquire(MODEL, 10, priority)
+        order.append(label)
+        governor.release(MODEL, 10)
+
+    with ThreadPoolExecutor(max_workers=len(submissions)) as pool:
+        futures = []
+        for i, (label, priority) in enumerate(submissions, start=1):
+            futures.append(pool.submit(call, label, priority))
+            wait_until(lambda: _queued(governor) == i, message=f"{label} to queue")
+            if before_release is not None:
+                before_release(label)
+        governor.release(MODEL, 10)
+        for future in futures:
+            future.result(timeout=5)
+    return order
+
+
+def test_interactive_calls_are_granted_before_earlier_batch_calls(wait_until):
+    governor = _governor()
+    order = _run_in_order(
+        governor,
+        [("batch-1", BATCH), ("batch-2", BATCH), ("interactive-1", INTERACTIVE), ("interactive-2", INTERACTIVE)],
+        wait_until,
+    )
+    assert order == ["interactive-1", "interactive-2", "batch-1", "batch-2"]
+
+
+def test_aged_batch_call_competes_as_interactive(wait_until):
+    clock = FakeClock()
+    governor = _governor(clock, batch_aging_seconds=30.0)
+
+    def age_batch(label):
+        if label == "batch":
+            clock.now += 31
+
+    order = _run_in_order(governor, [("batch", BATCH), ("interactive", INTERACTIVE)], wait_until, age_batch)
+    assert order == ["batch", "interactive"]
+    assert _lane_stats(governor)["aged_grants"] == 1
+
+
+def test_call_times_out_when_no_slot_frees_up():
+    governor = ModelGovernor({}, {"rpm": 0, "tpm": 0, "max_concurrent": 1}, max_wait_seconds=0.05)
+    governor.acquire(MODEL, 10, INTERACTIVE)
+    with pytest.raises(ModelQuotaTimeout):
+        governor.acquire(MODEL, 10, BATCH)
+    stats = _lane_stats(governor)
+    assert stats["timeouts"] == 1
+    assert stats["in_flight"] == 1
+
+
+def test_rate_limited_error_releases_the_slot_and_pauses_the_lane():
+    clock = FakeClock()
+    governor = _governor(clock, rate_limit_pause_seconds=5.0)
+    models = _GovernedModels(FakeModels(fail_with=RuntimeError("429 RESOURCE_EXHAUSTED")), lambda: governor, lambda: 10)
+
+    with pytest.raises(RuntimeError):
+        models.generate_content(model=MODEL, contents="hello")
+    stats = _lane_stats(governor)
+    assert stats["in_flight"] == 0
+    assert stats["rate_limited"] == 1
+    assert governor._lanes[MODEL].paused_until == clock.now + 5.0
+
+
+def test_generate_content_reconciles_actual_usage():
+    governor = _governor()
+    models = _GovernedModels(FakeModels(), lambda: governor, lambda: 10)
+    assert models.generate_content(model=MODEL, contents="hello").text == "ok"
+    stats = _lane_stats(governor)
+    assert stats["in_flight"] == 0
+    assert stats["actual_tokens"] == 42
+
+
+def test_stream_that_is_never_iterated_holds_no_slot():
+    governor = _governor()
+    fake = FakeModels()
+    models = _GovernedModels(fake, lambda: governor, lambda: 10)
+
+    stream = models.generate_content_stream(model=MODEL, contents="hello")
+    assert fake.streams_opened == 0
+    assert _lane_stats(governor) == {}
+    del stream
+    governor.acquire(MODEL, 10, INTERACTIVE)  # the only slot is still free
+    assert _lane_stats(governor)["in_flight"] == 1
+
+
+def test_stream_releases_its_slot_when_closed_early():
+    governor = _governor()
+    models = _GovernedModels(FakeModels(chunks=("a", "b", "c")), lambda: governor, lambda: 10)
+
+    stream = models.generate_content_stream(model=MODEL, contents="hello")
+    assert next(stream).text == "a"
+    assert _lane_stats(governor)["in_flight"] == 1
+    stream.close()
+    assert _lane_stats(governor)["in_flight"] == 0
+
+
+def test_stream_releases_its_slot_when_upstream_fails():
+    governor = _governor()
+    models = _GovernedModels(FakeModels(chunks=("a",), fail_with=ConnectionError("reset")), lambda: governor, lambda: 10)
+
+    received = []
+    with pytest.raises(ConnectionError):
+        for chunk in models.generate_content_stream(model=MODEL, contents="hello"):
+            received.append(chunk.text)
+    assert received == ["a"]
+    assert _lane_stats(governor)["in_flight"] == 0
+
+
+def test_overuse_is_charged_against_the_refilled_bucket():
+    clock = FakeClock()
+    governor = _governor(clock, default_limits={"rpm": 0, "tpm": 600, "max_concurrent": 1})
+    governor.acquire(MODEL, 100, INTERACTIVE)
+
+    clock.now += 60  # a full minute: the bucket is back at capacity before the correction
+    governor.release(MODEL, 100, actual_tokens=300)
+
+    assert _lane_stats(governor)["tokens_available"] == 400
+
+
+def test_refund_never_fills_the_bucket_past_capacity():
+    bucket = _TokenBucket(600, FakeClock())
+
+    bucket.take(-499)
+
+    assert bucket.level == 600
+
+
+def test_disabled_governor_never_blocks():
+    governor = _governor(enabled=False)
+    for _ in range(3):
+        governor.acquire(MODEL, 10, BATCH)
+    assert governor.get_stats() == {"enabled": False, "models": {}}
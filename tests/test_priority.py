@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pipeline.priority import (
+    BATCH,
+    INTERACTIVE,
+    current_priority,
+    get_priority_latency_stats,
+    highest_priority,
+    priority_scope,
+    record_latency,
+    with_current_priority,
+)
+
+
+def test_priority_scope_nests_and_rejects_unknown_classes():
+    assert current_priority() == INTERACTIVE
+    with priority_scope(BATCH):
+        assert current_priority() == BATCH
+        with priority_scope(INTERACTIVE):
+            assert current_priority() == INTERACTIVE
+        assert current_priority() == BATCH
+    with pytest.raises(ValueError):
+        with priority_scope("urgent"):
+            pass
+
+
+def test_highest_priority_prefers_interactive():
+    assert highest_priority([BATCH, INTERACTIVE, BATCH]) == INTERACTIVE
+    assert highest_priority([BATCH]) == BATCH
+    assert highest_priority([]) == BATCH
+
+
+def test_worker_threads_inherit_the_submitting_priority():
+    with priority_scope(BATCH):
+        fn = with_current_priority(current_priority)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        # The same bound callable can run on several threads at once.
+        results = list(pool.map(lambda _: fn(), range(4)))
+    assert results == [BATCH] * 4
+
+
+def test_latency_is_reported_per_class_and_endpoint():
+    for seconds in (0.1, 0.2, 0.3):
+        record_latency(BATCH, "test-endpoint", seconds)
+
+    stats = get_priority_latency_stats()[BATCH]["test-endpoint"]
+    assert stats["requests"] == 3
+    assert stats["max_ms"] == 300.0
+    assert stats["p50_ms"] == 200.0
+
+
+def test_unknown_request_priority_header_is_rejected(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "API_BEARER_TOKEN", "")
+    monkeypatch.setattr(main, "run_full_pipeline", lambda **kwargs: pytest.fail("pipeline must not run"))
+
+    response = TestClient(main.app).post(
+        "/api/v1/test-analysis-recommendations", json={}, headers={"X-Request-Priority": "urgent"}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["code"] == "INVALID_FIELD_VALUE"
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+
+from pipeline.prompt_builder import (
+    compact_json,
+    estimate_tokens,
+    fit_records_to_budget,
+    get_prompt_size_stats,
+    record_prompt_size,
+    truncate_text,
+)
+
+
+def test_token_estimate_weights_non_ascii_scripts_more():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("กขค") == 2  # 3 Thai characters ≈ 2 tokens
+
+
+def test_compact_json_drops_empties_nans_and_duplicates():
+    payload = {"a": None, "b": "", "c": [], "d": float("nan"), "e": [1, 1, {"x": None}, 2], "f": {"g": {}}}
+    assert compact_json(payload) == '{"e":[1,2]}'
+
+
+def test_truncate_text_respects_the_budget():
+    text = "word " * 100
+    cut = truncate_text(text, 10)
+    assert cut.endswith("…")
+    assert estimate_tokens(cut[:-1]) <= 10
+    assert truncate_text("short", 10) == "short"
+
+
+def test_records_within_budget_are_left_alone():
+    records = [{"questionId": "q1", "explanation": "Short."}]
+    assert fit_records_to_budget(records, ["explanation"], budget_tokens=1000) == records
+
+
+def test_long_fields_shrink_to_fit_and_other_fields_are_kept():
+    records = [
+        {"questionId": f"q{i}", "questionText": "Which form is correct? " * 20, "explanation": "Because " * 200}
+        for i in range(5)
+    ]
+
+    fitted = fit_records_to_budget(records, ["explanation", "questionText"], budget_tokens=600)
+
+    assert estimate_tokens(compact_json(fitted)) <= 600
+    assert [r["questionId"] for r in fitted] == [f"q{i}" for i in range(5)]
+    assert all(r["explanation"].endswith("…") for r in fitted)
+
+
+def test_budget_stops_at_the_minimum_field_size():
+    records = [{"id": "x" * 400, "explanation": "Because " * 200}]
+    fitted = fit_records_to_budget(records, ["explanation"], budget_tokens=10, min_field_tokens=16)
+    assert fitted[0]["id"] == "x" * 400
+    assert estimate_tokens(fitted[0]["explanation"][:-1]) <= 16
+
+
+def test_prompt_size_stats_report_the_reduction():
+    before = json.dumps({"text": "a" * 400}, indent=2)
+    sizes = record_prompt_size("test-agent", before, "a" * 100)
+
+    assert sizes == {"prompt_tokens_est_before": estimate_tokens(before), "prompt_tokens_est_after": 25}
+    stats = get_prompt_size_stats()["test-agent"]
+    assert stats["calls"] == 1
+    assert 0 < stats["reduction_pct"] < 100
+
+
+def test_agent3_prompt_drops_attempt_ids_and_fits_the_case_budget(monkeypatch):
+    import agents.agent3_weakness_extraction as agent3
+
+    monkeypatch.setattr(agent3, "AGENT3_CASES_TOKEN_BUDGET", 300)
+    cases = [
+        {"questionId": f"q{i}", "testResultQuestionId": f"tq{i}", "explanation": "Long reasoning. " * 100, "score": None}
+        for i in range(3)
+    ]
+
+    suffix, sizes = agent3._extraction_suffix(cases)
+
+    assert "testResultQuestionId" not in suffix and '"score"' not in suffix
+    assert all(f'"questionId":"q{i}"' in suffix for i in range(3))
+    assert sizes["prompt_tokens_est_after"] <= 300 < sizes["prompt_tokens_est_before"]
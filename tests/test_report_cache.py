@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from pipeline.report_cache import ReportCache
+
+REPORT = {"status": "ok", "final_response": {"summary": {"Test Title": "SQL basics"}}}
+
+
+def _key(exam_result_id, catalog_version="v1", max_courses=5):
+    return ReportCache.report_key(exam_result_id, catalog_version, max_courses=max_courses)
+
+
+def test_report_is_stored_per_language_for_the_observed_attempt():
+    cache = ReportCache(maxsize=10, ttl_seconds=60)
+    cache.observe_attempt("s1", "t1", "r1")
+
+    cache.put("s1", "t1", "r1", _key("r1"), {"EN": REPORT})
+    cache.put("s1", "t1", "r1", _key("r1"), {"TH": {"status": "ok"}})
+
+    assert cache.get(_key("r1"), "EN") == REPORT
+    assert cache.get(_key("r1"), "TH") == {"status": "ok"}
+    assert cache.get(_key("r1", catalog_version="v2"), "EN") is None
+    assert cache.get(_key("r1", max_courses=3), "EN") is None
+
+
+def test_new_attempt_invalidates_reports_of_the_previous_attempt():
+    cache = ReportCache(maxsize=10, ttl_seconds=60)
+    cache.observe_attempt("s1", "t1", "r1")
+    cache.put("s1", "t1", "r1", _key("r1"), {"EN": REPORT})
+    cache.put("s1", "t1", "r1", _key("r1", max_courses=3), {"EN": REPORT})
+    cache.observe_attempt("s2", "t1", "r9")
+    cache.put("s2", "t1", "r9", _key("r9"), {"EN": REPORT})
+
+    assert cache.observe_attempt("s1", "t1", "r1") is False
+    assert cache.observe_attempt("s1", "t1", "r2") is True
+
+    assert cache.get(_key("r1"), "EN") is None
+    assert cache.get(_key("r1", max_courses=3), "EN") is None
+    assert cache.get(_key("r9"), "EN") == REPORT  # other students keep their reports
+    stats = cache.get_stats()
+    assert stats["new_attempts"] == 1
+    assert stats["invalidated_reports"] == 2
+
+
+def test_write_for_an_attempt_superseded_mid_run_is_skipped():
+    cache = ReportCache(maxsize=10, ttl_seconds=60)
+    cache.observe_attempt("s1", "t1", "r1")
+    cache.observe_attempt("s1", "t1", "r2")  # newer attempt seen while the r1 run was in flight
+
+    cache.put("s1", "t1", "r1", _key("r1"), {"EN": REPORT})
+
+    assert cache.get(_key("r1"), "EN") is None
+    assert cache.get_stats()["stale_writes_skipped"] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ReportCache(maxsize=10, ttl_seconds=60, enabled=False)
+    cache.observe_attempt("s1", "t1", "r1")
+
+    cache.put("s1", "t1", "r1", _key("r1"), {"EN": REPORT})
+
+    assert cache.get(_key("r1"), "EN") is None
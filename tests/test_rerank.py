@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import agents.agent4_course_recommendation as agent4
+from config import Course, CourseScore, Weakness
+from pipeline.cache import TTLCache
+from pipeline.run_logging import get_token_entries, reset_token_log
+
+
+def _rec(course_id: str, weakness_id: str, score: float) -> CourseScore:
+    course = Course(id=course_id, lesson_title=f"Course {course_id}", description="", link="")
+    return CourseScore(course=course, weakness_id=weakness_id, score=score, reason="vector")
+
+
+class FakeLLM:
+    """Stands in for the context cache client; `respond(label, suffix)` returns the response text."""
+
+    def __init__(self, respond) -> None:
+        self.respond = respond
+        self.calls = []
+
+    def generate_content(self, model, prefix, suffix, label="prompt"):
+        self.calls.append((label, suffix))
+        return SimpleNamespace(text=self.respond(label, suffix), usage_metadata=None)
+
+
+def score_everything(value: float):
+    """Answer any rerank prompt with `value` for every candidate it lists."""
+
+    def _respond(label, suffix):
+        if label == "agent4-batched-rerank":
+            items = []
+            for block in suffix.split("\n\n"):
+                alias = re.search(r"(w\d+):", block)
+                items += [
+                    {"weakness": alias.group(1), "course_id": cid, "relevance_score": value, "justification": "llm"}
+                    for cid in re.findall(r'id="([^"]+)"', block)
+                ]
+            return json.dumps(items)
+        return json.dumps(
+            [{"course_id": cid, "relevance_score": value, "justification": "llm"} for cid in re.findall(r'id="([^"]+)"', suffix)]
+        )
+
+    return _respond
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeLLM(score_everything(0.9))
+    monkeypatch.setattr(agent4, "get_context_cache", lambda: fake)
+    monkeypatch.setattr(agent4, "_rerank_cache", TTLCache(name="rerank-test", maxsize=100, ttl_seconds=60))
+    reset_token_log()
+    return fake
+
+
+WEAKNESSES = [
+    Weakness(id="sql", text="SQL joins"),
+    Weakness(id="grammar", text="Passive voice"),
+]
+RECS = [_rec("c1", "sql", 0.5), _rec("c2", "sql", 0.4), _rec("c3", "grammar", 0.3)]
+
+
+def test_batched_rerank_scores_every_weakness_in_one_call(llm):
+    rescored = agent4._llm_rerank_courses(WEAKNESSES, RECS, mode="batched")
+
+    assert [label for label, _ in llm.calls] == ["agent4-batched-rerank"]
+    assert sorted((r.weakness_id, r.course.id, r.score, r.reason) for r in rescored) == [
+        ("grammar", "c3", 0.9, "llm"),
+        ("sql", "c1", 0.9, "llm"),
+        ("sql", "c2", 0.9, "llm"),
+    ]
+
+
+def test_batched_items_with_a_malformed_score_drop_only_that_weakness():
+    aliases = {"w1": "sql", "w2": "grammar"}
+    recs_by_weakness = {"sql": RECS[:2], "grammar": RECS[2:]}
+    items = [
+        {"weakness": "w1", "course_id": "c1", "relevance_score": 0.8},
+        {"weakness": "w1", "course_id": "c2", "relevance_score": "high"},
+        {"weakness": "w2", "course_id": "c3", "relevance_score": 0.7},
+        {"weakness": "w2", "course_id": "unknown", "relevance_score": 0.9},
+        {"weakness": "w9", "course_id": "c1", "relevance_score": 0.9},
+        "not an item",
+    ]
+
+    parsed = agent4._map_batched_items(items, aliases, recs_by_weakness)
+
+    assert list(parsed) == ["grammar"]
+    assert [(r.course.id, r.score) for r in parsed["grammar"]] == [("c3", 0.7)]
+
+
+def test_weaknesses_missing_from_the_batched_answer_are_retried_alone(llm):
+    def respond(label, suffix):
+        if label == "agent4-batched-rerank":
+            return json.dumps([{"weakness": "w1", "course_id": "c1", "relevance_score": 0.8}])
+        return score_everything(0.6)(label, suffix)
+
+    llm.respond = respond
+    rescored = agent4._llm_rerank_courses(WEAKNESSES, RECS, mode="batched")
+
+    assert [label for label, _ in llm.calls] == ["agent4-batched-rerank", "agent4-rerank"]
+    assert "Passive voice" in llm.calls[1][1]
+    assert {(r.course.id, r.score) for r in rescored} == {("c1", 0.8), ("c3", 0.6)}
+
+
+def test_per_weakness_calls_run_concurrently(llm):
+    both_in_flight = threading.Barrier(2, timeout=5)
+
+    def respond(label, suffix):
+        both_in_flight.wait()  # breaks (and fails the rerank) if the calls ran one after another
+        return score_everything(0.7)(label, suffix)
+
+    llm.respond = respond
+    rescored = agent4._rerank_per_weakness_concurrently(
+        {"sql": RECS[:2], "grammar": RECS[2:]}, {"sql": "SQL joins", "grammar": "Passive voice"}, "m", max_concurrency=2
+    )
+
+    assert sorted((r.course.id, r.score) for r in rescored) == [("c1", 0.7), ("c2", 0.7), ("c3", 0.7)]
+
+
+def test_calls_past_the_deadline_keep_vector_order_and_are_discarded(llm, monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(agent4, "_rerank_executor", executor)
+    release = threading.Event()
+
+    def respond(label, suffix):
+        if "Passive voice" in suffix:
+            release.wait(5)
+        return score_everything(0.7)(label, suffix)
+
+    llm.respond = respond
+    rescored = agent4._rerank_per_weakness_concurrently(
+        {"sql": RECS[:2], "grammar": RECS[2:]},
+        {"sql": "SQL joins", "grammar": "Passive voice"},
+        "m",
+        max_concurrency=2,
+        deadline_seconds=0.2,
+    )
+    release.set()
+    executor.shutdown(wait=True)  # let the abandoned call finish
+
+    assert sorted((r.course.id, r.score, r.reason) for r in rescored) == [
+        ("c1", 0.7, "llm"),
+        ("c2", 0.7, "llm"),
+        ("c3", 0.3, "vector"),
+    ]
+    assert [entry["usage"] for entry in get_token_entries()] == ["agent4: course rerank (sql)"]
+    assert agent4._rerank_cache.get(agent4._rerank_cache_key("Passive voice", "c3", "m")) is None
+    assert agent4._rerank_cache.get(agent4._rerank_cache_key("SQL joins", "c1", "m")) is not None
+
+
+def test_cached_judgments_skip_the_llm_and_only_new_pairs_are_prompted(llm):
+    agent4._llm_rerank_courses(WEAKNESSES, RECS, mode="per_weakness")
+    llm.calls.clear()
+
+    same_text = [Weakness(id="other-id", text="  sql   JOINS "), WEAKNESSES[1]]
+    recs = [_rec("c1", "other-id", 0.5), _rec("c2", "other-id", 0.4), _rec("c3", "grammar", 0.3)]
+    rescored = agent4._llm_rerank_courses(same_text, recs, mode="per_weakness")
+    assert llm.calls == []
+    assert {(r.weakness_id, r.course.id, r.score) for r in rescored} == {
+        ("other-id", "c1", 0.9), ("other-id", "c2", 0.9), ("grammar", "c3", 0.9),
+    }
+
+    agent4._llm_rerank_courses(WEAKNESSES, RECS + [_rec("c4", "sql", 0.2)], mode="per_weakness")
+    [(_, suffix)] = llm.calls
+    assert re.findall(r'id="([^"]+)"', suffix) == ["c4"]
+
+
+def test_rerank_cache_is_per_model(llm):
+    agent4._llm_rerank_courses(WEAKNESSES, RECS, model="model-a", mode="batched")
+    agent4._llm_rerank_courses(WEAKNESSES, RECS, model="model-b", mode="batched")
+    assert len(llm.calls) == 2
+
+
+def test_uncertain_weaknesses_are_near_ties_or_near_the_threshold():
+    recs = [
+        _rec("a", "clear", 0.90), _rec("b", "clear", 0.60),
+        _rec("c", "tied", 0.80), _rec("d", "tied", 0.79),
+        _rec("e", "borderline", 0.52), _rec("f", "borderline", 0.30),
+    ]
+    assert agent4._uncertain_weaknesses(recs, min_score=0.5, margin=0.03, threshold_band=0.05) == {"tied", "borderline"}
+
+
+def test_auto_rerank_only_sends_uncertain_weaknesses(llm):
+    weaknesses = [Weakness(id="clear", text="SQL joins"), Weakness(id="tied", text="Passive voice")]
+    recs = [_rec("a", "clear", 0.9), _rec("b", "clear", 0.6), _rec("c", "tied", 0.8), _rec("d", "tied", 0.79)]
+    before = agent4.get_auto_rerank_stats()
+
+    combined = agent4._auto_rerank_courses(weaknesses, recs, selected=[recs[0], recs[2]], min_score=0.2)
+
+    [(_, suffix)] = llm.calls
+    assert "Passive voice" in suffix and "SQL joins" not in suffix
+    assert [(r.course.id, r.score, r.reason) for r in combined] == [("a", 0.9, "vector"), ("c", 0.9, "llm")]
+    after = agent4.get_auto_rerank_stats()
+    assert after["weaknesses_reranked"] - before["weaknesses_reranked"] == 1
+    assert after["weaknesses_skipped"] - before["weaknesses_skipped"] == 1
+
+
+def test_auto_rerank_skips_the_call_when_every_weakness_is_clear(llm):
+    recs = [_rec("a", "clear", 0.9), _rec("b", "clear", 0.6)]
+    before = agent4.get_auto_rerank_stats()
+
+    combined = agent4._auto_rerank_courses([Weakness(id="clear", text="SQL joins")], recs, selected=recs[:1], min_score=0.2)
+
+    assert llm.calls == []
+    assert combined == recs[:1]
+    assert agent4.get_auto_rerank_stats()["rerank_calls_skipped"] - before["rerank_calls_skipped"] == 1
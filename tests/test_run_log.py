@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pipeline.run_pipeline as run_pipeline
+
+
+def test_concurrent_runs_all_land_in_the_run_log(tmp_path, monkeypatch):
+    log_file = tmp_path / "run_log.json"
+    monkeypatch.setattr(run_pipeline, "RUN_LOG_PATH", str(log_file))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: run_pipeline._write_run_log(run=i, output={"text": "x" * 2000}), range(40)))
+
+    entries = json.loads(log_file.read_text(encoding="utf-8"))
+    assert sorted(entry["run"] for entry in entries) == list(range(40))
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from pipeline.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution(wait_until):
+    flights = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def leader_fn():
+        calls.append(1)
+        release.wait(5)
+        return "report"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flights.do, "key", leader_fn)
+        wait_until(lambda: flights.get_stats()["in_flight"] == 1, message="leader to start")
+        waiters = [pool.submit(flights.do, "key", leader_fn) for _ in range(3)]
+        wait_until(lambda: flights.get_stats()["shared"] == 3, message="waiters to join")
+        release.set()
+
+        assert leader.result(timeout=5) == ("report", False)
+        assert [w.result(timeout=5) for w in waiters] == [("report", True)] * 3
+    assert len(calls) == 1
+    assert flights.get_stats() == {"name": "test", "in_flight": 0, "executions": 1, "shared": 3, "in_flight_max": 1}
+
+
+def test_leader_failure_wakes_waiters_with_the_same_error(wait_until):
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def failing_fn():
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        leader = pool.submit(flights.do, "key", failing_fn)
+        wait_until(lambda: flights.get_stats()["in_flight"] == 1, message="leader to start")
+        waiters = [pool.submit(flights.do, "key", failing_fn) for _ in range(2)]
+        wait_until(lambda: flights.get_stats()["shared"] == 2, message="waiters to join")
+        release.set()
+
+        for future in [leader, *waiters]:
+            with pytest.raises(RuntimeError, match="upstream down"):
+                future.result(timeout=5)
+
+    # The failed execution is not remembered: the next caller runs again.
+    assert flights.do("key", lambda: "retried") == ("retried", False)
+    assert flights.get_stats()["executions"] == 2
+
+
+def test_different_keys_run_independently():
+    flights = SingleFlight("test")
+    assert flights.do("a", lambda: 1) == (1, False)
+    assert flights.do("b", lambda: 2) == (2, False)
+    assert flights.get_stats()["shared"] == 0
+
+
+def test_retry_with_a_finished_correlation_id_is_replayed_or_conflicts(monkeypatch):
+    runs = []
+    monkeypatch.setattr(main, "API_BEARER_TOKEN", "")
+    monkeypatch.setattr(main, "_run_pipeline_request", lambda request, on_event=None: runs.append(1) or {"status": "ok"})
+    client = TestClient(main.app)
+    headers = {"X-Correlation-Id": f"corr-replay-{uuid.uuid4().hex}"}
+    url = "/api/v1/test-analysis-recommendations"
+
+    first = client.post(url, json={"test_id": "t-1"}, headers=headers)
+    replay = client.post(url, json={"test_id": "t-1"}, headers=headers)
+    other = client.post(url, json={"test_id": "t-2"}, headers=headers)
+
+    assert first.status_code == 200 and "X-Idempotent-Replay" not in first.headers
+    assert replay.status_code == 200 and replay.headers["X-Idempotent-Replay"] == "true"
+    assert replay.json() == first.json()
+    assert other.status_code == 409
+    assert runs == [1]
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+import uuid
+
+from fastapi.testclient import TestClient
+
+import main
+
+URL = "/api/v1/test-analysis-recommendations/stream"
+
+
+def _events(body: str):
+    """Parse SSE frames into (event, data) pairs, skipping keep-alive comments."""
+    parsed = []
+    for frame in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines() if not line.startswith(":"))
+        if fields:
+            parsed.append((fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+def _fake_pipeline(request, on_event=None):
+    on_event("stage", {"stage": "agent1", "elapsed_seconds": 0.1, "output": {}})
+    on_event("summary_field", {"field": "headline", "value": "Good work"})
+    on_event("paragraph_delta", {"text": "Keep "})
+    on_event("paragraph_delta", {"text": "going."})
+    return {"status": "ok", "test_id": request.test_id}
+
+
+def test_stream_sends_progress_then_the_result(monkeypatch):
+    monkeypatch.setattr(main, "API_BEARER_TOKEN", "")
+    monkeypatch.setattr(main, "_run_pipeline_request", _fake_pipeline)
+    correlation_id = f"corr-sse-{uuid.uuid4().hex}"
+
+    response = TestClient(main.app).post(URL, json={"test_id": "t-1"}, headers={"X-Correlation-Id": correlation_id})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert [event for event, _ in events] == ["stage", "summary_field", "paragraph_delta", "paragraph_delta", "result"]
+    assert "".join(data["text"] for event, data in events if event == "paragraph_delta") == "Keep going."
+    assert events[-1][1] == {
+        "correlation_id": correlation_id,
+        "status_code": 200,
+        "data": {"status": "ok", "test_id": "t-1"},
+    }
+
+
+def test_stream_replays_only_the_result_for_a_finished_correlation_id(monkeypatch):
+    monkeypatch.setattr(main, "API_BEARER_TOKEN", "")
+    monkeypatch.setattr(main, "_run_pipeline_request", _fake_pipeline)
+    client = TestClient(main.app)
+    headers = {"X-Correlation-Id": f"corr-sse-{uuid.uuid4().hex}"}
+
+    client.post(URL, json={"test_id": "t-1"}, headers=headers)
+    replay = client.post(URL, json={"test_id": "t-1"}, headers=headers)
+
+    assert replay.headers["X-Idempotent-Replay"] == "true"
+    assert [event for event, _ in _events(replay.text)] == ["result"]
+
+
+def test_stream_reports_a_failure_as_an_error_event(monkeypatch):
+    def failing_pipeline(request, on_event=None):
+        on_event("stage", {"stage": "agent1", "elapsed_seconds": 0.1, "output": {}})
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(main, "API_BEARER_TOKEN", "")
+    monkeypatch.setattr(main, "_run_pipeline_request", failing_pipeline)
+
+    response = TestClient(main.app).post(URL, json={}, headers={"X-Correlation-Id": f"corr-sse-{uuid.uuid4().hex}"})
+
+    events = _events(response.text)
+    assert [event for event, _ in events] == ["stage", "error"]
+    assert events[-1][1]["code"] == "INTERNAL_ERROR"
+
+
+def test_job_workers_are_shut_down_with_the_app(monkeypatch):
+    shutdowns = []
+    monkeypatch.setattr(main._jobs, "shutdown", lambda: shutdowns.append(1))
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        assert shutdowns == []
+    assert shutdowns == [1]
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import json
+
+from pipeline.streaming_json import JsonArrayStreamParser, JsonObjectStreamParser
+
+
+def _feed_in_chunks(parser, text, size):
+    emitted = []
+    for start in range(0, len(text), size):
+        emitted.append(parser.feed(text[start:start + size]))
+    return emitted
+
+
+def test_array_elements_are_emitted_as_soon_as_they_close():
+    items = [{"weakness": "A, with a comma", "ids": [1, 2]}, {"weakness": 'Quote \\" and ] bracket'}]
+    text = "```json\n" + json.dumps(items) + "\n```"
+    parser = JsonArrayStreamParser()
+
+    emitted = _feed_in_chunks(parser, text, 5)
+
+    assert [item for batch in emitted for item in batch] == items
+    first_done = next(i for i, batch in enumerate(emitted) if batch)
+    assert first_done < len(emitted) - 3  # the first element arrived well before the stream ended
+    assert parser.done
+    assert parser.text == text
+
+
+def test_array_scalars_and_python_literals():
+    parser = JsonArrayStreamParser()
+    assert parser.feed("[1, \"two\", {'k': 'single quotes'}, 4]") == [1, "two", {"k": "single quotes"}, 4]
+
+
+def test_malformed_elements_are_counted_and_skipped():
+    parser = JsonArrayStreamParser()
+    assert parser.feed('[{"a": 1}, {"b": nope}, {"c": 3}]') == [{"a": 1}, {"c": 3}]
+    assert (parser.elements_parsed, parser.elements_failed) == (2, 1)
+
+
+def test_nothing_is_emitted_after_the_closing_bracket():
+    parser = JsonArrayStreamParser()
+    assert parser.feed('[{"a": 1}] trailing [{"b": 2}]') == [{"a": 1}]
+
+
+def test_object_pairs_are_emitted_per_key():
+    text = json.dumps({"headline": "Good work", "focus": ["joins", "grammar"], "note": "a } inside"})
+    parser = JsonObjectStreamParser()
+
+    emitted = [pair for batch in _feed_in_chunks(parser, text, 3) for pair in batch]
+
+    assert emitted == [("headline", "Good work"), ("focus", ["joins", "grammar"]), ("note", "a } inside")]
+    assert parser.done
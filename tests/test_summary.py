@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import agents.agent5_user_facing_response as agent5
+from config import Course, CourseScore, Weakness
+from pipeline.cache import TTLCache
+
+LLM_SUMMARY = {
+    "Test Title": "SQL basics",
+    "Current Performance": "You scored 6/10.",
+    "Area to be Improved": "Join types.",
+    "Recommended Course": ["SQL joins"],
+}
+
+
+class FakeLLM:
+    """Stands in for the context cache client; `responses[label]` is the text (or exception) per call."""
+
+    def __init__(self) -> None:
+        self.responses = {
+            "agent5-summary": json.dumps(LLM_SUMMARY),
+            "agent5-polish": "You did well on most questions.",
+        }
+        self.calls = []
+
+    def generate_content(self, model, prefix, suffix, label="prompt"):
+        self.calls.append((label, suffix))
+        answer = self.responses[label]
+        if isinstance(answer, Exception):
+            raise answer
+        return SimpleNamespace(text=answer(suffix) if callable(answer) else answer, usage_metadata=None)
+
+    def generate_content_stream(self, model, prefix, suffix, label="prompt"):
+        text = self.generate_content(model, prefix, suffix, label).text
+        for start in range(0, len(text), 9):
+            yield SimpleNamespace(text=text[start:start + 9], usage_metadata=None)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(agent5, "get_context_cache", lambda: fake)
+    monkeypatch.setattr(agent5, "_summary_cache", TTLCache(name="agent5-test", maxsize=100, ttl_seconds=60))
+    return fake
+
+
+def _inputs(weakness_id="w1", score=0.9):
+    weaknesses = [Weakness(id=weakness_id, text="Confuses SQL join types")]
+    course = Course(id="c-sql", lesson_title="SQL joins", description="", link="https://courses.example.com/c-sql")
+    return weaknesses, [CourseScore(course=course, weakness_id=weakness_id, score=score, reason="fits")]
+
+
+def _summarize(**kwargs):
+    weaknesses, recommendations = _inputs(kwargs.pop("weakness_id", "w1"), kwargs.pop("score", 0.9))
+    kwargs.setdefault("min_score", 0.5)
+    return agent5.generate_user_facing_response(weaknesses, recommendations, **kwargs)
+
+
+def test_template_mode_makes_no_llm_call(llm):
+    result = _summarize(summary_mode="template")
+
+    assert llm.calls == []
+    assert "Confuses SQL join types" in result["summary"]["Area to be Improved"]
+    assert "https://courses.example.com/c-sql" in result["user_facing_paragraph"]
+
+
+def test_hybrid_mode_polishes_only_one_field(llm):
+    template = _summarize(summary_mode="template")["summary"]
+    result = _summarize(summary_mode="hybrid")
+
+    assert [label for label, _ in llm.calls] == ["agent5-polish"]
+    assert result["summary"]["Current Performance"] == "You did well on most questions."
+    assert {k: v for k, v in result["summary"].items() if k != "Current Performance"} == {
+        k: v for k, v in template.items() if k != "Current Performance"
+    }
+
+
+def test_hybrid_mode_keeps_the_template_text_when_polish_fails(llm):
+    llm.responses["agent5-polish"] = RuntimeError("quota")
+    assert _summarize(summary_mode="hybrid")["summary"] == _summarize(summary_mode="template")["summary"]
+
+
+def test_llm_mode_uses_one_call_and_falls_back_to_the_template(llm):
+    result = _summarize(summary_mode="llm")
+    assert [label for label, _ in llm.calls] == ["agent5-summary"]
+    assert result["summary"]["Current Performance"] == "You scored 6/10."
+
+    llm.responses["agent5-summary"] = "not json"
+    fallback = _summarize(summary_mode="llm", score=0.8)
+    assert fallback["summary"] == _summarize(summary_mode="template", score=0.8)["summary"]
+
+
+def test_streamed_paragraph_matches_the_final_paragraph(llm):
+    events = []
+    result = _summarize(summary_mode="llm", on_event=lambda event, data: events.append((event, data)))
+
+    fields = [data["field"] for event, data in events if event == "summary_field"]
+    assert fields[:2] == ["Test Title", "Current Performance"]
+    assert "".join(data["text"] for event, data in events if event == "paragraph_delta") == result["user_facing_paragraph"]
+
+
+def test_identical_request_is_served_from_the_summary_cache(llm):
+    first = _summarize(summary_mode="llm", weakness_id="w1")
+    second = _summarize(summary_mode="llm", weakness_id="w-other")
+
+    assert len(llm.calls) == 1
+    assert second["summary"] == first["summary"]
+
+
+def test_changed_score_or_threshold_misses_the_summary_cache(llm):
+    _summarize(summary_mode="llm")
+    _summarize(summary_mode="llm", score=0.8)
+    _summarize(summary_mode="llm", min_score=0.6)
+    _summarize(summary_mode="hybrid")
+
+    assert [label for label, _ in llm.calls] == ["agent5-summary"] * 3 + ["agent5-polish"]
+
+
+def test_template_fallback_is_not_cached(llm):
+    llm.responses["agent5-summary"] = "not json"
+    _summarize(summary_mode="llm")
+    llm.responses["agent5-summary"] = json.dumps(LLM_SUMMARY)
+
+    result = _summarize(summary_mode="llm")
+
+    assert len(llm.calls) == 2
+    assert result["summary"]["Current Performance"] == "You scored 6/10."
+
+
+THAI_SUMMARY = {**LLM_SUMMARY, "Current Performance": "คุณได้ 6/10"}
+
+
+def test_translate_mode_adds_the_other_language_and_caches_it(llm):
+    llm.responses["agent5-translate"] = json.dumps({"Current Performance": "คุณได้ 6/10"})
+
+    result = _summarize(summary_mode="llm", alt_language_mode="translate")
+    repeat = _summarize(summary_mode="llm", alt_language_mode="translate")
+
+    assert [label for label, _ in llm.calls] == ["agent5-summary", "agent5-translate"]
+    thai = result["alternate_languages"]["TH"]["summary"]
+    assert thai["Current Performance"] == "คุณได้ 6/10"
+    assert thai["Test Title"] == "SQL basics"  # untranslated fields keep the source text
+    assert repeat["alternate_languages"] == result["alternate_languages"]
+
+
+def test_bilingual_mode_writes_both_languages_in_one_call(llm):
+    llm.responses["agent5-summary"] = json.dumps({"EN": LLM_SUMMARY, "TH": THAI_SUMMARY}, ensure_ascii=False)
+
+    result = _summarize(summary_mode="llm", alt_language_mode="bilingual")
+
+    assert [label for label, _ in llm.calls] == ["agent5-summary"]
+    assert result["summary"]["Current Performance"] == "You scored 6/10."
+    assert result["alternate_languages"]["TH"]["summary"]["Current Performance"] == "คุณได้ 6/10"
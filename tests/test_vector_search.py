@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import agents.agent4_course_recommendation as agent4
+from pipeline.micro_batching import MicroBatcher
+
+
+class FakeEndpoint:
+    """Answers each query vector with neighbors named after its first component."""
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    def find_neighbors(self, deployed_index_id, queries, num_neighbors, return_full_datapoint):
+        self.calls.append((len(queries), num_neighbors, return_full_datapoint))
+        return [[f"q{int(vector[0])}-n{i}" for i in range(num_neighbors)] for vector in queries]
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    fake = FakeEndpoint()
+    monkeypatch.setattr(agent4, "_get_index_endpoint", lambda: fake)
+    return fake
+
+
+def test_one_find_neighbors_call_serves_queries_with_different_limits(endpoint):
+    results = agent4._find_neighbors_direct(False, [([1.0], 2), ([2.0], 3)])
+
+    assert endpoint.calls == [(2, 3, False)]
+    assert results == [["q1-n0", "q1-n1"], ["q2-n0", "q2-n1", "q2-n2"]]
+
+
+def test_concurrent_pipelines_share_a_vector_search_call(endpoint, monkeypatch):
+    batcher = MicroBatcher("vector_search_test", agent4._find_neighbors_direct, window_ms=200, max_batch_size=4)
+    monkeypatch.setattr(agent4, "_vector_search_batcher", batcher)
+    monkeypatch.setattr(agent4, "embed_texts", lambda texts: [[float(text)] for text in texts])
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(agent4._query_vertex_index_batch, ["1", "2"], 2)
+        second = pool.submit(agent4._query_vertex_index_batch, ["3", "4"], 1)
+        results = first.result(timeout=5), second.result(timeout=5)
+
+    assert endpoint.calls == [(4, 2, False)]
+    assert results == (
+        [["q1-n0", "q1-n1"], ["q2-n0", "q2-n1"]],
+        [["q3-n0"], ["q4-n0"]],
+    )
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import agents.agent3_weakness_extraction as agent3
+import agents.question_diagnosis as question_diagnosis
+from pipeline.cache import TTLCache
+
+WEAKNESS = {
+    "weakness": "Confuses past simple and passive forms",
+    "pattern_type": "language",
+    "description": "Uses 'was' + past simple.",
+    "evidence_question_ids": ["q2"],
+    "frequency": 1,
+}
+
+
+def _case(question_id, answers, attempt_id="tq-1", domain="Grammar"):
+    return {
+        "questionId": question_id,
+        "testResultQuestionId": attempt_id,
+        "questionText": f"Question {question_id}",
+        "domain": domain,
+        "studentAnswers": answers,
+        "correctAnswers": ["right"],
+    }
+
+
+class FakeLLM:
+    """Stands in for the context cache client; answers every extraction with `weaknesses`."""
+
+    def __init__(self) -> None:
+        self.weaknesses = [WEAKNESS]
+        self.calls = []
+
+    def generate_content(self, model, prefix, suffix, label="prompt"):
+        self.calls.append(suffix)
+        return SimpleNamespace(text=json.dumps(self.weaknesses), usage_metadata=None)
+
+    def generate_content_stream(self, model, prefix, suffix, label="prompt"):
+        self.calls.append(suffix)
+        text = json.dumps(self.weaknesses)
+        for start in range(0, len(text), 7):
+            yield SimpleNamespace(text=text[start:start + 7], usage_metadata=None)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(agent3, "get_context_cache", lambda: fake)
+    monkeypatch.setattr(agent3, "_weakness_cache", TTLCache(name="agent3-test", maxsize=100, ttl_seconds=60))
+    return fake
+
+
+def test_the_same_wrong_answers_from_another_attempt_hit_the_cache(llm):
+    first = agent3.extract_weaknesses_and_patterns(
+        [_case("q1", ["a", "b"], "tq-1"), _case("q2", ["c"], "tq-2")], map_reduce_threshold=0
+    )
+    second = agent3.extract_weaknesses_and_patterns(
+        [_case("q2", ["c"], "tq-9"), _case("q1", ["b", "a"], "tq-8")], map_reduce_threshold=0
+    )
+
+    assert len(llm.calls) == 1
+    assert [w["weakness"] for w in second] == [WEAKNESS["weakness"]]
+    assert second[0]["id"] != first[0]["id"]  # ids are per run, also on a cache hit
+
+
+def test_different_wrong_answers_miss_the_cache(llm):
+    agent3.extract_weaknesses_and_patterns([_case("q1", ["a"])], map_reduce_threshold=0)
+    agent3.extract_weaknesses_and_patterns([_case("q1", ["b"])], map_reduce_threshold=0)
+    assert len(llm.calls) == 2
+
+
+def test_extraction_mode_is_part_of_the_cache_key(llm):
+    cases = [_case("q1", ["a"]), _case("q2", ["b"])]
+    agent3.extract_weaknesses_and_patterns(cases, map_reduce_threshold=0)
+    agent3.extract_weaknesses_and_patterns(cases, map_reduce_threshold=2)
+    agent3.extract_weaknesses_and_patterns(cases, map_reduce_threshold=2)
+    assert len(llm.calls) == 2
+
+
+
+class FakeDiagnosisModels:
+    """Diagnoses every case as `weakness`, except the question ids listed in `skip`."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.skip = set()
+
+    def generate_content(self, model, contents):
+        self.calls += 1
+        prompt = contents[0]["parts"][0]["text"]
+        cases = json.loads(prompt.split("Cases:", 1)[1])
+        items = [
+            {"caseId": case["caseId"], "weakness": "Passive voice", "pattern_type": "language"}
+            for case in cases
+            if case["questionText"].split()[-1] not in self.skip
+        ]
+        return SimpleNamespace(text=json.dumps(items), usage_metadata=None)
+
+
+@pytest.fixture
+def diagnosis(monkeypatch):
+    models = FakeDiagnosisModels()
+    monkeypatch.setattr(question_diagnosis, "client", SimpleNamespace(models=models))
+    monkeypatch.setattr(question_diagnosis, "_diagnosis_store", TTLCache(name="diagnosis-test", maxsize=100, ttl_seconds=60))
+    return models
+
+
+def test_memo_aggregates_diagnoses_and_reuses_them_for_other_students(llm, diagnosis):
+    weaknesses = agent3.extract_weaknesses_and_patterns(
+        [_case("q1", ["a"]), _case("q2", ["b"])], use_diagnosis_memo=True
+    )
+    assert [(w["weakness"], w["evidence_question_ids"], w["frequency"]) for w in weaknesses] == [
+        ("Passive voice", ["q1", "q2"], 2)
+    ]
+
+    # Another student with the same wrong answer on q1 and a new one on q3.
+    agent3.extract_weaknesses_and_patterns([_case("q1", ["a"], "tq-7"), _case("q3", ["c"])], use_diagnosis_memo=True)
+    assert diagnosis.calls == 2
+    assert llm.calls == []
+
+
+def test_memo_falls_back_to_full_extraction_when_a_case_is_undiagnosed(llm, diagnosis):
+    diagnosis.skip = {"q2"}
+    cases = [_case("q1", ["a"]), _case("q2", ["b"])]
+
+    weaknesses = agent3.extract_weaknesses_and_patterns(cases, use_diagnosis_memo=True)
+
+    assert [w["weakness"] for w in weaknesses] == [WEAKNESS["weakness"]]
+    assert len(llm.calls) == 1
+
+
+def test_streamed_extraction_fills_the_cache_for_the_non_streaming_path(llm):
+    emitted = []
+    agent3.stream_weaknesses_and_patterns([_case("q1", ["a"])], emitted.append, map_reduce_threshold=0)
+    cached = agent3.extract_weaknesses_and_patterns([_case("q1", ["a"])], map_reduce_threshold=0)
+
+    assert [w["weakness"] for w in emitted] == [WEAKNESS["weakness"]]
+    assert [w["weakness"] for w in cached] == [WEAKNESS["weakness"]]
+    assert len(llm.calls) == 1